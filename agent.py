@@ -2,21 +2,29 @@
 
 import json
 import os
+import uuid
 from datetime import datetime
 
 from dotenv import load_dotenv
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import AIMessage, SystemMessage
 from langchain_deepseek import ChatDeepSeek
 from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import ToolNode
 
+from fast_path import parse_transaction
 from models import AgentState
 from tools import (
     ARGENTINA,
     add_expense,
+    add_expenses,
     add_income,
+    compare_years,
+    data_quality_report,
+    describe_tools,
+    enum_registry,
     generate_monthly_report,
     list_recent_transactions,
+    monthly_trend,
     spending_by_category,
 )
 
@@ -32,12 +40,34 @@ llm = ChatDeepSeek(
 
 tools = [
     add_expense,
+    add_expenses,
     add_income,
     generate_monthly_report,
     spending_by_category,
     list_recent_transactions,
+    monthly_trend,
+    compare_years,
+    data_quality_report,
 ]
 llm_with_tools = llm.bind_tools(tools)
+# enum_registry version the bound tool descriptions list the categories of.
+_tools_version = describe_tools()
+
+
+def _model():
+    """llm_with_tools, bound again first if the valid categories or payment
+    methods changed since it was (see tools.describe_tools)."""
+    global llm_with_tools, _tools_version
+    if enum_registry.version != _tools_version:
+        _tools_version = describe_tools()
+        llm_with_tools = llm.bind_tools(tools)
+        print(f"[Enums] Tools now describe version {_tools_version}")
+    return llm_with_tools
+
+
+# Tools whose successful result is confirmed with a template instead of a
+# second model call.
+TRANSACTION_TOOLS = {"add_expense", "add_expenses", "add_income"}
 
 
 SYSTEM_PROMPT_TEMPLATE = """You are a personal finance assistant. Your ONLY job is to record transactions immediately.
@@ -49,12 +79,16 @@ RULES - follow strictly:
 - NEVER say "quieres que registre...?" or "confirmas...?". Just do it.
 - If the category is ambiguous, pick the closest one and proceed.
 - Record each transaction ONLY ONCE: call add_expense or add_income at most one time per user message.
+- When one message lists several expenses: call add_expenses ONCE with all of them instead of add_expense for each.
 - If a tool result says the transaction was already recorded ("ya fue registrado"), do NOT call the tool again. Just tell the user it was already saved.
 - After recording, reply with one short confirmation line in Spanish. Nothing more.
 - All amounts are in Argentinian pesos (ARS).
 - When the user asks for a report, balance, or summary: call generate_monthly_report RIGHT AWAY.
 - When the user asks where their money went or which category they spent most on: call spending_by_category.
-- When the user asks for their latest transactions or movements: call list_recent_transactions.
+- When the user asks for their latest transactions or movements: call list_recent_transactions. When they then ask for the previous ones ("los 10 anteriores"), call it again with the offset the last result gave.
+- When the user asks how the last few months went ("últimos 6 meses", "este semestre"): call monthly_trend.
+- When the user asks to compare this year with the previous one: call compare_years.
+- When a report mentions expenses "Fuera de la lista", or the user asks whether the sheet data is correct: call data_quality_report.
 - Today is {today}. When the user names a specific month ("mayo", "marzo 2025"), pass month and year to the tool. A month with no year means the most recent past occurrence of that month. With no month at all, omit both arguments to get the current month.
 - Always respond in Spanish.
 
@@ -91,7 +125,7 @@ def call_model(state: AgentState):
     messages = [build_system_prompt()] + list(state["messages"])
 
     print(f"[DeepSeek] Sending {len(messages)} message(s) to {MODEL_NAME}...")
-    response = llm_with_tools.invoke(messages)
+    response = _model().invoke(messages)
     print(
         f"[DeepSeek] Response received. Tool calls: {[tc['name'] for tc in response.tool_calls] if response.tool_calls else 'none'}"
     )
@@ -120,18 +154,88 @@ def should_continue(state: AgentState):
     return "end"
 
 
-def build_graph():
-    """Build the LangGraph workflow"""
+def plan_fast_path(state: AgentState):
+    """Node that turns a plain "gasté 1500 en farmacia con QR" into the tool
+    call the model would have made, without calling the model. Adds nothing
+    when the message needs the model."""
+    last_message = state["messages"][-1]
+    if getattr(last_message, "type", None) != "human" or not isinstance(last_message.content, str):
+        return {"messages": []}
+    parsed = parse_transaction(last_message.content, enum_registry)
+    if parsed is None:
+        return {"messages": []}
+    name, args = parsed
+    print(f"[FastPath] Parsed as {name}, no model call")
+    call = {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:24]}"}
+    return {"messages": [AIMessage(content="", tool_calls=[call])]}
+
+
+def after_fast_path(state: AgentState):
+    """Run the parsed tool call, or hand the message to the model."""
+    return "tools" if should_continue(state) == "tools" else "agent"
+
+
+def _tool_results(state: AgentState) -> list:
+    """The tool messages produced after the last AI message."""
+    results = []
+    for message in reversed(state["messages"]):
+        if getattr(message, "type", None) != "tool":
+            break
+        results.append(message)
+    return results[::-1]
+
+
+def after_tools(state: AgentState):
+    """Confirm straight away when every tool run was a transaction that went
+    through; anything else (errors, reports) goes back to the model."""
+    results = _tool_results(state)
+    if results and all(
+        result.name in TRANSACTION_TOOLS and result.status != "error" for result in results
+    ):
+        return "confirm"
+    return "agent"
+
+
+def confirm_transaction(state: AgentState):
+    """Node that replies with the confirmation lines of each transaction tool
+    result (everything before the balance), e.g. "Gasto de $1500 en farmacia
+    registrado (categoría: Farmacia, pago: QR)." Those lines are already the
+    short plain-Spanish confirmation the prompt asks for."""
+    lines = [str(result.content).split("\n\n", 1)[0] for result in _tool_results(state)]
+    print("[FastPath] Confirmed with a template, no second model call")
+    return {"messages": [AIMessage(content="\n".join(lines))]}
+
+
+def build_graph(fast_path: bool = True):
+    """Build the LangGraph workflow.
+
+    With fast_path, messages parse_transaction understands skip the model
+    entirely, and a successful add_expense/add_income ends the turn with a
+    templated confirmation instead of a second model call. Without it every
+    turn is agent -> tools -> agent.
+    """
     workflow = StateGraph(AgentState)
 
     workflow.add_node("agent", call_model)
     workflow.add_node("tools", ToolNode(tools))
 
-    workflow.set_entry_point("agent")
-
     workflow.add_conditional_edges(
         "agent", should_continue, {"tools": "tools", "end": END}
     )
-    workflow.add_edge("tools", "agent")
+
+    if fast_path:
+        workflow.add_node("fast_path", plan_fast_path)
+        workflow.add_node("confirm", confirm_transaction)
+        workflow.set_entry_point("fast_path")
+        workflow.add_conditional_edges(
+            "fast_path", after_fast_path, {"tools": "tools", "agent": "agent"}
+        )
+        workflow.add_conditional_edges(
+            "tools", after_tools, {"confirm": "confirm", "agent": "agent"}
+        )
+        workflow.add_edge("confirm", END)
+    else:
+        workflow.set_entry_point("agent")
+        workflow.add_edge("tools", "agent")
 
     return workflow.compile()
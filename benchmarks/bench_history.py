@@ -0,0 +1,104 @@
+"""Benchmark: load_history latency as the conversations table grows.
+
+    python benchmarks/bench_history.py                      # 1k .. 1M rows
+    python benchmarks/bench_history.py --max-rows 10000000  # up to 10M (~2 GB on disk)
+
+Rows are spread round-robin over --chats active chats. One extra "quiet"
+chat only has rows at the very start of the table, which is the worst case
+for a scan walking back from the newest row. Every size is timed with the
+schema migrate() creates; sizes up to --unindexed-max are also timed with the
+(chat_id, id) index dropped, to show the scan it replaces.
+
+Loads go through a plain sqlite3 connection, not init_db's BotConnection, so
+every one runs the query instead of being answered by the history cache.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import HumanMessage, message_to_dict  # noqa: E402
+
+import database  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+QUIET_CHAT = -1
+
+
+def grow(con, current: int, target: int, chats: int) -> None:
+    content = json.dumps(
+        message_to_dict(HumanMessage(content="gasté 1500 en farmacia con QR")),
+        ensure_ascii=False,
+    )
+    batch = 50_000
+    for start in range(current, target, batch):
+        stop = min(start + batch, target)
+        con.executemany(
+            "INSERT INTO conversations (chat_id, role, content) VALUES (?, 'human', ?)",
+            ((n % chats, content) for n in range(start, stop)),
+        )
+        con.commit()
+
+
+def time_loads(con, pick_chat, runs: int) -> tuple[float, float]:
+    """Median and p95 load_history latency in microseconds."""
+    samples = []
+    for _ in range(runs):
+        chat_id = pick_chat()
+        started = time.perf_counter()
+        database.load_history(con, chat_id)
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-rows", type=int, default=1_000_000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=300)
+    parser.add_argument("--unindexed-max", type=int, default=100_000)
+    args = parser.parse_args()
+
+    def active():
+        return random.randrange(args.chats)
+
+    def quiet():
+        return QUIET_CHAT
+
+    with tempfile.TemporaryDirectory() as tmp:
+        con = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        con.execute("PRAGMA journal_mode=WAL")
+        database.migrate(con)
+        for _ in range(20):
+            database.save_message(con, QUIET_CHAT, HumanMessage(content="hola"))
+        rows = 20
+        print("load_history latency in µs (p50 / p95)")
+        print(f"{'rows':>12} {'active chat':>16} {'quiet chat':>16} "
+              f"{'active, no idx':>16} {'quiet, no idx':>16}")
+        for size in (s for s in SIZES if s <= args.max_rows):
+            grow(con, rows, size, args.chats)
+            rows = size
+            cells = [time_loads(con, active, args.runs), time_loads(con, quiet, args.runs)]
+            if size <= args.unindexed_max:
+                con.execute("DROP INDEX idx_conversations_chat_id")
+                scan_runs = max(args.runs // 10, 5)
+                cells += [time_loads(con, active, scan_runs), time_loads(con, quiet, scan_runs)]
+                con.execute(
+                    "CREATE INDEX idx_conversations_chat_id ON conversations (chat_id, id)"
+                )
+            print(f"{size:>12,} " + " ".join(f"{p50:>7.0f} / {p95:<6.0f}" for p50, p95 in cells))
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,505 @@
 import json
 import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
 
 from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.messages.utils import count_tokens_approximately
 
 DB_PATH = "processed_updates.db"
 
+# How many recently processed update_ids each connection remembers in memory.
+RECENT_UPDATES_CACHE_SIZE = 1024
+# Bounds of the per-connection cache of parsed history windows. Size is
+# measured as the rows' serialized JSON length.
+HISTORY_CACHE_CHATS = 256
+HISTORY_CACHE_BYTES = 8 * 1024 * 1024
+# A claim on an update that was neither processed nor released within this
+# many seconds belongs to a worker that died; another worker may take it over.
+CLAIM_LEASE_SECONDS = 600
+
+# Schema history. Each entry upgrades the DB by one version and PRAGMA
+# user_version records how many have been applied, so init_db brings any older
+# file up to date by itself. Append new steps; never edit one that shipped.
+MIGRATIONS = [
+    # 1: the original tables (IF NOT EXISTS: DBs from before versioning have them)
+    """
+    CREATE TABLE IF NOT EXISTS updates (update_id INTEGER PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS conversations (
+        id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id   INTEGER NOT NULL,
+        role      TEXT NOT NULL,
+        content   TEXT NOT NULL,
+        timestamp DATETIME DEFAULT (datetime('now', '-3 hours'))
+    );
+    """,
+    # 2: load_history seeks to one chat's newest rows instead of scanning the table
+    """
+    CREATE INDEX IF NOT EXISTS idx_conversations_chat_id
+        ON conversations (chat_id, id);
+    """,
+    # 3: when each update was processed, so compact() can age them out
+    """
+    ALTER TABLE updates ADD COLUMN processed_at REAL;
+    CREATE INDEX IF NOT EXISTS idx_updates_processed_at ON updates (processed_at);
+    """,
+    # 4: which worker is answering an update, so two workers never both do
+    """
+    CREATE TABLE claims (
+        update_id  INTEGER PRIMARY KEY,
+        worker     TEXT NOT NULL,
+        claimed_at REAL NOT NULL
+    );
+    """,
+]
+
+
+# A cached history row: its id, the parsed message (None for a row
+# load_history skips) and its serialized size.
+_Row = tuple[int, BaseMessage | None, int]
+
+
+class _Window:
+    """Newest history rows of one chat, oldest first, and the data_version
+    they were last known to match the table at."""
+
+    __slots__ = ("limit", "rows", "complete", "size", "version")
+
+    def __init__(self, limit: int, rows: list[_Row], version: int | None):
+        self.limit = limit
+        self.rows = rows
+        # fewer rows than asked for: this is the chat's whole history
+        self.complete = len(rows) < limit
+        self.size = sum(size for _, _, size in rows)
+        self.version = version
+
+    def bounds(self) -> tuple[int | None, int | None]:
+        """Ids of the oldest and newest row held."""
+        return (self.rows[0][0], self.rows[-1][0]) if self.rows else (None, None)
+
+
+class HistoryCache:
+    """LRU of each chat's recent history as LangChain objects.
+
+    load_history fills a chat's window once; after that save_message and
+    save_turn append the very objects they persist, so a steady-state turn
+    neither re-reads nor re-parses its history. Chats are evicted least
+    recently used first, beyond max_chats or max_bytes.
+
+    Writes from other connections are caught per chat: ``get`` is given the
+    current data_version and, when it moved since the window was last
+    checked, compares the window's first and newest row ids with the table
+    (an index-only query) before serving it. Other chats keep their windows.
+    """
+
+    def __init__(self, max_chats: int, max_bytes: int):
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self._windows: OrderedDict[int, _Window] = OrderedDict()
+        self.size = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, con: sqlite3.Connection, chat_id: int, limit: int,
+            version: int | None = None) -> list[BaseMessage | None] | None:
+        window = self._windows.get(chat_id)
+        if window is not None and window.version != version:
+            if _window_bounds(con, chat_id, window.limit) == window.bounds():
+                window.version = version
+            else:
+                self.counters["invalidations"] += 1
+                self.discard(chat_id)
+                window = None
+        if window is None or (limit > window.limit and not window.complete):
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self._windows.move_to_end(chat_id)
+        return [message for _, message, _ in window.rows[-limit:]]
+
+    def put(self, chat_id: int, limit: int, rows: list[_Row], version: int | None = None) -> None:
+        self.discard(chat_id)
+        window = _Window(limit, rows, version)
+        self._windows[chat_id] = window
+        self.size += window.size
+        self._evict()
+
+    def append(self, chat_id: int, rows: list[_Row]) -> None:
+        """Add freshly saved rows to a cached window (no-op for uncached chats)."""
+        window = self._windows.get(chat_id)
+        if window is None:
+            return
+        for row in rows:
+            window.rows.append(row)
+            window.size += row[2]
+            self.size += row[2]
+        while len(window.rows) > window.limit:
+            _, _, size = window.rows.pop(0)
+            window.size -= size
+            self.size -= size
+            window.complete = False
+        self._evict()
+
+    def discard(self, chat_id: int) -> None:
+        window = self._windows.pop(chat_id, None)
+        if window is not None:
+            self.size -= window.size
+
+    def clear(self) -> None:
+        self.counters["invalidations"] += len(self._windows)
+        self._windows.clear()
+        self.size = 0
+
+    def _evict(self) -> None:
+        while self._windows and (
+            len(self._windows) > self.max_chats or self.size > self.max_bytes
+        ):
+            _, window = self._windows.popitem(last=False)
+            self.size -= window.size
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": self.counters["hits"] / lookups if lookups else 0.0,
+            "chats": len(self._windows),
+            "bytes": self.size,
+        }
+
+
+class BotConnection(sqlite3.Connection):
+    """The connection init_db returns: sqlite plus an in-memory front for the
+    updates table, so most dedup checks never touch disk.
+
+    recent_updates is an LRU of update_ids processed lately, and
+    max_update_id the highest one ever recorded. Telegram hands out increasing
+    ids, so an id above it can't have been processed yet. With several
+    workers sharing the file another one may have processed such an id, so
+    the front can only answer "not seen" wrongly, never invent a duplicate;
+    claim_update settles those.
+
+    history_cache holds parsed history windows (see HistoryCache). PRAGMA
+    data_version tells it when another connection, possibly in another
+    process, committed since a window was last checked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recent_updates: OrderedDict[int, None] = OrderedDict()
+        self.max_update_id: int | None = None
+        self.dedup_stats = {"memory": 0, "disk": 0}
+        self.history_cache = HistoryCache(HISTORY_CACHE_CHATS, HISTORY_CACHE_BYTES)
+
+    def data_version(self) -> int:
+        """Changes whenever another connection commits (own commits don't count)."""
+        return self.execute("PRAGMA data_version").fetchone()[0]
+
+    def remember_updates(self, update_ids: Iterable[int]) -> None:
+        for update_id in update_ids:
+            self.recent_updates[update_id] = None
+            self.recent_updates.move_to_end(update_id)
+            if self.max_update_id is None or update_id > self.max_update_id:
+                self.max_update_id = update_id
+        while len(self.recent_updates) > RECENT_UPDATES_CACHE_SIZE:
+            self.recent_updates.popitem(last=False)
+
+
+def migrate(con: sqlite3.Connection) -> int:
+    """Apply the migrations this DB hasn't seen yet; return the resulting version."""
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        # each step and its version bump commit together
+        con.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+        version = number
+    return version
+
 
 def init_db() -> sqlite3.Connection:
-    """Create the DB and tables if they don't exist, return connection."""
-    con = sqlite3.connect(DB_PATH)
-    con.execute("CREATE TABLE IF NOT EXISTS updates (update_id INTEGER PRIMARY KEY)")
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS conversations (
-            id        INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id   INTEGER NOT NULL,
-            role      TEXT NOT NULL,
-            content   TEXT NOT NULL,
-            timestamp DATETIME DEFAULT (datetime('now', '-3 hours'))
-        )
-    """)
-    con.commit()
+    """Open the DB, bring its schema up to date and return the connection."""
+    # timeout: how long a write waits for another worker's transaction
+    con = sqlite3.connect(DB_PATH, factory=BotConnection, timeout=30)
+    # WAL lets readers run alongside the writer and turns each commit into one
+    # sequential log append; synchronous=NORMAL only fsyncs at checkpoints,
+    # which in WAL mode can lose the last commits on power loss but never
+    # corrupts the file.
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA cache_size=-8000")  # 8 MB page cache
+    con.execute("PRAGMA temp_store=MEMORY")
+    migrate(con)
+    con.max_update_id = con.execute("SELECT MAX(update_id) FROM updates").fetchone()[0]
     return con
 
 
 # ── deduplication ────────────────────────────────────────────────
 
 def is_duplicate(con: sqlite3.Connection, update_id: int) -> bool:
-    """Return True if this update_id was already processed."""
+    """Return True if this update_id was already processed.
+
+    On a BotConnection the answer usually comes from memory (see BotConnection);
+    only ids at or below the high-water mark that aren't in the LRU are looked
+    up in sqlite."""
+    if isinstance(con, BotConnection):
+        if update_id in con.recent_updates:
+            con.recent_updates.move_to_end(update_id)
+            con.dedup_stats["memory"] += 1
+            return True
+        if con.max_update_id is None or update_id > con.max_update_id:
+            con.dedup_stats["memory"] += 1
+            return False
+        con.dedup_stats["disk"] += 1
     row = con.execute("SELECT 1 FROM updates WHERE update_id = ?", (update_id,)).fetchone()
     return row is not None
 
 
+def _insert_updates(con: sqlite3.Connection, update_ids: list[int]) -> None:
+    now = time.time()
+    con.executemany(
+        "INSERT OR IGNORE INTO updates (update_id, processed_at) VALUES (?, ?)",
+        [(uid, now) for uid in update_ids],
+    )
+
+
+def claim_update(con: sqlite3.Connection, update_id: int, worker: str) -> bool:
+    """Atomically take update_id for this worker. True if we won it.
+
+    False when it was already processed or another worker holds a live claim
+    on it. A claim older than CLAIM_LEASE_SECONDS (its worker crashed
+    mid-turn) is taken over. One statement, so two workers racing for the
+    same update can't both win."""
+    now = time.time()
+    with con:
+        won = con.execute(
+            """
+            INSERT INTO claims (update_id, worker, claimed_at)
+            SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM updates WHERE update_id = ?)
+            ON CONFLICT (update_id) DO UPDATE SET
+                worker = excluded.worker, claimed_at = excluded.claimed_at
+                WHERE claims.claimed_at < ?
+            RETURNING update_id
+            """,
+            (update_id, worker, now, update_id, now - CLAIM_LEASE_SECONDS),
+        ).fetchone()
+    return won is not None
+
+
+def release_claims(con: sqlite3.Connection, update_ids: Iterable[int], worker: str) -> None:
+    """Give up this worker's claims after a failed turn, so a redelivery can retry."""
+    with con:
+        con.executemany(
+            "DELETE FROM claims WHERE update_id = ? AND worker = ?",
+            [(update_id, worker) for update_id in update_ids],
+        )
+
+
 def mark_processed(con: sqlite3.Connection, update_id: int) -> None:
     """Record update_id as successfully processed."""
-    con.execute("INSERT OR IGNORE INTO updates (update_id) VALUES (?)", (update_id,))
+    _insert_updates(con, [update_id])
     con.commit()
+    if isinstance(con, BotConnection):
+        con.remember_updates([update_id])
+
+
+def compact(
+    con: sqlite3.Connection, updates_max_age: float, messages_per_chat: int
+) -> tuple[int, int]:
+    """Retention pass: forget update_ids processed more than updates_max_age
+    seconds ago (and ones recorded before timestamps existed), and keep only
+    the newest messages_per_chat rows of each chat.
+
+    Telegram stops redelivering an update after a day, so old ids only cost
+    disk and index pages. Age (not id order) decides, because after a week
+    without updates Telegram restarts ids at a random value. Returns the number
+    of (updates, conversation rows) deleted."""
+    cutoff = time.time() - updates_max_age
+    with con:
+        updates = con.execute(
+            "DELETE FROM updates WHERE processed_at IS NULL OR processed_at < ?", (cutoff,)
+        ).rowcount
+        con.execute("DELETE FROM claims WHERE claimed_at < ?", (cutoff,))
+        messages = con.execute(
+            """
+            DELETE FROM conversations WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id DESC) AS newest
+                    FROM conversations
+                )
+                WHERE newest > ?
+            )
+            """,
+            (messages_per_chat,),
+        ).rowcount
+    if isinstance(con, BotConnection) and messages:
+        con.history_cache.clear()
+    # hand the freed WAL space back and refresh planner statistics
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    con.execute("PRAGMA optimize")
+    return updates, messages
 
 
 # ── conversation history ─────────────────────────────────────────
 
+def _message_row(chat_id: int, message: BaseMessage) -> tuple[int, str, str]:
+    return chat_id, message.type, json.dumps(message_to_dict(message), ensure_ascii=False)
+
+
+def _window_bounds(con: sqlite3.Connection, chat_id: int, limit: int):
+    """Ids of the oldest and newest of a chat's newest limit rows."""
+    return con.execute(
+        "SELECT MIN(id), MAX(id) FROM ("
+        "SELECT id FROM conversations WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+        (chat_id, limit),
+    ).fetchone()
+
+
+def _parse_row(content: str) -> BaseMessage | None:
+    """The message stored in a conversations row, or None for legacy rows."""
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return None  # legacy plain-text row
+    if isinstance(data, dict) and "type" in data and "data" in data:
+        return messages_from_dict([data])[0]
+    return None
+
+
 def save_message(con: sqlite3.Connection, chat_id: int, message: BaseMessage) -> None:
     """Persist a single LangChain message (including tool calls / tool results)."""
-    con.execute(
+    row = _message_row(chat_id, message)
+    row_id = con.execute(
         "INSERT INTO conversations (chat_id, role, content) VALUES (?, ?, ?)",
-        (chat_id, message.type, json.dumps(message_to_dict(message), ensure_ascii=False))
-    )
+        row
+    ).lastrowid
     con.commit()
+    if isinstance(con, BotConnection):
+        con.history_cache.append(chat_id, [(row_id, message, len(row[2]))])
+
 
+def save_turn(
+    con: sqlite3.Connection,
+    chat_id: int,
+    messages: Iterable[BaseMessage],
+    update_id: int | Iterable[int] | None = None,
+) -> None:
+    """Persist a whole agent turn in one transaction: every message, then the
+    update_id(s) it answered marked as processed.
+
+    Either all of it is stored or none of it is, so a crash can no longer leave
+    a turn's messages saved while its update looks unprocessed."""
+    if update_id is None:
+        update_ids = []
+    elif isinstance(update_id, int):
+        update_ids = [update_id]
+    else:
+        update_ids = list(update_id)
+    messages = list(messages)
+    rows = [_message_row(chat_id, message) for message in messages]
+    with con:
+        # one INSERT per row: the cache needs each row's id
+        row_ids = [
+            con.execute(
+                "INSERT INTO conversations (chat_id, role, content) VALUES (?, ?, ?)", row
+            ).lastrowid
+            for row in rows
+        ]
+        _insert_updates(con, update_ids)
+    if isinstance(con, BotConnection):
+        con.remember_updates(update_ids)
+        con.history_cache.append(
+            chat_id,
+            [(i, message, len(row[2])) for i, message, row in zip(row_ids, messages, rows)],
+        )
 
-def load_history(con: sqlite3.Connection, chat_id: int, limit: int = 20) -> list[BaseMessage]:
+
+def load_history(
+    con: sqlite3.Connection,
+    chat_id: int,
+    limit: int = 20,
+    max_tokens: int | None = None,
+    tool_output_chars: int | None = None,
+) -> list[BaseMessage]:
     """Load recent conversation history for a chat_id as LangChain messages.
 
+    limit caps the rows read. With max_tokens the newest of them are kept
+    until that many (approximate) tokens are used, see fit_to_budget.
+
     Only JSON-serialized rows are replayed. Legacy plain-text rows are skipped
     on purpose: they contain AI confirmations with no visible tool call, and
     replaying that pattern teaches the model to confirm transactions without
     actually calling the tools.
+
+    On a BotConnection the window usually comes from its history cache, already
+    parsed.
     """
-    rows = con.execute(
-        "SELECT role, content FROM conversations WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
-        (chat_id, limit)
-    ).fetchall()
-    rows.reverse()
-    messages = []
-    for _role, content in rows:
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            continue  # legacy plain-text row
-        if isinstance(data, dict) and "type" in data and "data" in data:
-            messages.extend(messages_from_dict([data]))
+    window = version = None
+    if isinstance(con, BotConnection):
+        version = con.data_version()
+        window = con.history_cache.get(con, chat_id, limit, version)
+    if window is None:
+        rows = con.execute(
+            "SELECT id, content FROM conversations WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+            (chat_id, limit)
+        ).fetchall()
+        rows.reverse()
+        parsed = [(row_id, _parse_row(content), len(content)) for row_id, content in rows]
+        if isinstance(con, BotConnection):
+            con.history_cache.put(chat_id, limit, parsed, version)
+        window = [message for _, message, _ in parsed]
+    messages = [message for message in window if message is not None]
     # If the LIMIT window cut a tool sequence in half, drop orphaned tool
     # results so the model never sees a tool message without its tool call.
     while messages and messages[0].type == "tool":
         messages.pop(0)
+    if max_tokens is not None:
+        messages = fit_to_budget(messages, max_tokens, tool_output_chars)
     return messages
+
+
+def fit_to_budget(
+    messages: list[BaseMessage], max_tokens: int, tool_output_chars: int | None = None
+) -> list[BaseMessage]:
+    """The newest messages whose approximate token count fits in max_tokens.
+
+    A message and the tool results that follow it are kept or dropped
+    together, so an AI tool call never loses its results and no tool result
+    is left without its call. With tool_output_chars, results older than the
+    latest exchange are cut to that many characters first: a month's report
+    from several turns ago shouldn't crowd out the conversation.
+    """
+    units: list[list[BaseMessage]] = []
+    for message in messages:
+        if message.type == "tool" and units:
+            units[-1].append(message)
+        else:
+            units.append([message])
+
+    if tool_output_chars is not None:
+        # the latest exchange: everything from the last human message on
+        latest = max(
+            (i for i, unit in enumerate(units) if unit[0].type == "human"), default=0
+        )
+        units[:latest] = [
+            [_truncate_tool_output(message, tool_output_chars) for message in unit]
+            for unit in units[:latest]
+        ]
+
+    kept: list[list[BaseMessage]] = []
+    used = 0
+    for unit in reversed(units):
+        used += count_tokens_approximately(unit)
+        if used > max_tokens:
+            break
+        kept.append(unit)
+    return [message for unit in reversed(kept) for message in unit]
+
+
+def _truncate_tool_output(message: BaseMessage, max_chars: int) -> BaseMessage:
+    if message.type != "tool" or not isinstance(message.content, str):
+        return message
+    if len(message.content) <= max_chars:
+        return message
+    # copy: the original may be shared with the history cache
+    return message.model_copy(
+        update={"content": message.content[:max_chars] + " …[recortado]"}
+    )
@@ -0,0 +1,121 @@
+"""Guardrail against recording the same transaction twice in a short window."""
+
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+class RecentWrites:
+    """Keys written within the last ``window`` seconds.
+
+    ``claim(key)`` reserves a key for a write and answers False while an
+    identical one is still inside the window; ``release(key)`` undoes a claim
+    whose write failed. Check and reservation are one step, so two calls
+    racing on the same key can't both win.
+
+    In memory, a dict holds each key's time and a deque holds the keys in
+    claim order, so expiring old keys pops from the deque's front instead of
+    scanning the dict: amortized O(1) per claim. With ``path`` the keys live
+    in a sqlite table instead, which survives restarts and is shared by every
+    process that opens the same file.
+    """
+
+    def __init__(self, window: float, path: str | None = None):
+        self.window = window
+        self.path = path
+        self._lock = threading.Lock()
+        self._times: dict[str, float] = {}
+        self._order: deque[tuple[float, str]] = deque()
+        self._con: sqlite3.Connection | None = None
+        self._counters = {"claimed": 0, "suppressed": 0, "released": 0, "expired": 0}
+
+    def claim(self, key: str) -> bool:
+        with self._lock:
+            won = self._claim_sqlite(key) if self.path else self._claim_memory(key)
+            self._counters["claimed" if won else "suppressed"] += 1
+            return won
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            if self.path:
+                with self._connection() as con:
+                    con.execute("DELETE FROM recent_writes WHERE key = ?", (key,))
+            else:
+                # its deque entry is skipped when it reaches the front
+                self._times.pop(key, None)
+            self._counters["released"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self.path:
+                size = self._connection().execute(
+                    "SELECT COUNT(*) FROM recent_writes"
+                ).fetchone()[0]
+            else:
+                size = len(self._times)
+            return {**self._counters, "keys": size}
+
+    def reset(self) -> None:
+        """Forget every key and counter (and close the sqlite connection)."""
+        with self._lock:
+            self._times.clear()
+            self._order.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+    # ── in memory ───────────────────────────────────────────────────
+
+    def _claim_memory(self, key: str) -> bool:
+        now = time.monotonic()
+        while self._order and now - self._order[0][0] > self.window:
+            claimed_at, old_key = self._order.popleft()
+            # skip entries for keys released or claimed again since
+            if self._times.get(old_key) == claimed_at:
+                del self._times[old_key]
+                self._counters["expired"] += 1
+        if key in self._times:
+            return False
+        self._times[key] = now
+        self._order.append((now, key))
+        return True
+
+    # ── sqlite ──────────────────────────────────────────────────────
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            con = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS recent_writes (
+                    key         TEXT PRIMARY KEY,
+                    recorded_at REAL NOT NULL
+                )
+            """)
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS idx_recent_writes_recorded_at "
+                "ON recent_writes (recorded_at)"
+            )
+            con.commit()
+            self._con = con
+        return self._con
+
+    def _claim_sqlite(self, key: str) -> bool:
+        # wall clock: monotonic time means nothing to another process
+        now = time.time()
+        with self._connection() as con:
+            self._counters["expired"] += con.execute(
+                "DELETE FROM recent_writes WHERE recorded_at < ?", (now - self.window,)
+            ).rowcount
+            won = con.execute(
+                """
+                INSERT INTO recent_writes (key, recorded_at) VALUES (?, ?)
+                ON CONFLICT (key) DO NOTHING
+                RETURNING key
+                """,
+                (key, now),
+            ).fetchone()
+        return won is not None
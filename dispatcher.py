@@ -0,0 +1,121 @@
+"""Scheduling of agent turns across chats."""
+
+import asyncio
+import time
+from collections import deque
+
+
+class ChatDispatcher:
+    """Per-chat work queues between the Telegram handler and the agent.
+
+    ``submit`` puts an item on its chat's queue and returns immediately. Each
+    chat is drained by at most ``max_per_chat`` workers (1 keeps its messages
+    strictly sequential), and every turn holds one of ``max_concurrent`` global
+    slots. A chat whose queue already holds ``max_queue_per_chat`` items is
+    refused, so a flood from one chat can't grow memory without bound.
+
+    With ``coalesce_seconds`` > 0 a worker waits that long after the first
+    queued item and hands everything that arrived meanwhile to one turn.
+    ``handle_turn(chat_id, items)`` is awaited with the list of items.
+    """
+
+    def __init__(self, handle_turn, max_concurrent: int = 4, max_per_chat: int = 1,
+                 max_queue_per_chat: int = 20, coalesce_seconds: float = 0.0,
+                 wait_samples: int = 1000):
+        if max_concurrent < 1 or max_per_chat < 1 or max_queue_per_chat < 1:
+            raise ValueError("dispatcher limits must be at least 1")
+        self._handle_turn = handle_turn
+        self.max_concurrent = max_concurrent
+        self.max_per_chat = max_per_chat
+        self.max_queue_per_chat = max_queue_per_chat
+        self.coalesce_seconds = coalesce_seconds
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._queues: dict[int, deque[tuple[float, object]]] = {}
+        self._workers: dict[int, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._waits: deque[float] = deque(maxlen=wait_samples)
+        self._in_flight = 0
+        self._counters = {
+            "submitted": 0,
+            "rejected": 0,
+            "turns": 0,
+            "coalesced": 0,
+            "failed": 0,
+            "max_depth": 0,
+        }
+
+    def submit(self, chat_id: int, item) -> bool:
+        """Queue item for chat_id. False when that chat's queue is full."""
+        queue = self._queues.setdefault(chat_id, deque())
+        if len(queue) >= self.max_queue_per_chat:
+            self._counters["rejected"] += 1
+            return False
+        queue.append((time.monotonic(), item))
+        self._counters["submitted"] += 1
+        self._counters["max_depth"] = max(self._counters["max_depth"], len(queue))
+        if self._workers.get(chat_id, 0) < self.max_per_chat:
+            self._workers[chat_id] = self._workers.get(chat_id, 0) + 1
+            task = asyncio.create_task(self._work(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def join(self) -> None:
+        """Wait until every queued item has been handled."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    async def _work(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                if self.coalesce_seconds > 0:
+                    delay = queue[0][0] + self.coalesce_seconds - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                async with self._slots:
+                    if not queue:
+                        break  # another worker of this chat took them
+                    if self.coalesce_seconds > 0:
+                        batch = list(queue)
+                        queue.clear()
+                    else:
+                        batch = [queue.popleft()]
+                    started = time.monotonic()
+                    self._waits.extend(started - queued_at for queued_at, _ in batch)
+                    self._counters["turns"] += 1
+                    self._counters["coalesced"] += len(batch) - 1
+                    self._in_flight += 1
+                    try:
+                        await self._handle_turn(chat_id, [item for _, item in batch])
+                    except Exception as e:
+                        self._counters["failed"] += 1
+                        print(f"[Dispatch] Turn for chat {chat_id} failed: {e}")
+                    finally:
+                        self._in_flight -= 1
+        finally:
+            self._workers[chat_id] -= 1
+            if not self._workers[chat_id]:
+                del self._workers[chat_id]
+                if not queue:
+                    del self._queues[chat_id]
+
+    def stats(self) -> dict:
+        """Queue depth, throughput and wait-time (queued -> turn start) figures."""
+        waits = sorted(self._waits)
+        depths = [len(q) for q in self._queues.values()]
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000 if waits else 0.0
+
+        return {
+            **self._counters,
+            "queued": sum(depths),
+            "busiest_chat_depth": max(depths, default=0),
+            "active_chats": len(self._workers),
+            "in_flight": self._in_flight,
+            "wait_ms_avg": sum(waits) / len(waits) * 1000 if waits else 0.0,
+            "wait_ms_p50": percentile(0.50),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": waits[-1] * 1000 if waits else 0.0,
+        }
@@ -0,0 +1,250 @@
+"""Valid categories and payment methods, kept in step with the spreadsheet.
+
+The sheets restrict the Categoria and payment-method columns with data
+validation ("list of items" or "list from a range"). ``fetch_enums`` reads
+those rules, ``write_cache`` saves the lists to a versioned JSON file, and an
+``EnumRegistry`` serves them at runtime, rereading the file when it changes,
+so a new category in the sheet reaches the bot without a redeploy. config.py
+holds the lists it falls back to when there is no cache file yet.
+
+    python enums.py            # sync the cache file from the sheet
+    python enums.py --config   # ...and regenerate config.py with the same lists
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from gspread.utils import rowcol_to_a1
+
+import config
+
+ENUMS_PATH = "enums.json"
+
+# Enum name -> (worksheet, header of the column its validation rule is on).
+ENUM_COLUMNS = {
+    "ENTRADA_CATEGORIES": ("EntradaMaterial", "Categoria"),
+    "ENTRADA_PAYMENT_METHODS": ("EntradaMaterial", "MetodoPago"),
+    "VENTAS_CATEGORIES": ("Ventas", "Categoria"),
+    "VENTAS_PAYMENT_METHODS": ("Ventas", "VentaMetodoPago"),
+}
+
+DEFAULTS = {name: list(getattr(config, name)) for name in ENUM_COLUMNS}
+
+
+def _check(enums: dict) -> dict[str, list[str]]:
+    """enums with every name in ENUM_COLUMNS as a non-empty list of strings."""
+    checked = {}
+    for name in ENUM_COLUMNS:
+        values = enums.get(name)
+        if not values or not all(isinstance(v, str) and v for v in values):
+            raise ValueError(f"{name} must be a non-empty list of strings")
+        checked[name] = list(values)
+    return checked
+
+
+# ── reading the sheet ───────────────────────────────────────────────
+
+def _validation_values(spreadsheet, rules: dict[str, dict]) -> dict[str, list[str]]:
+    """The items each validation rule allows; ranges are read in one request."""
+    ranges = {}
+    values = {}
+    for name, condition in rules.items():
+        kind = condition.get("type")
+        entries = [v.get("userEnteredValue", "") for v in condition.get("values", [])]
+        if kind == "ONE_OF_LIST":
+            values[name] = entries
+        elif kind == "ONE_OF_RANGE" and entries:
+            # "=Listas!$A$2:$A$40" -> "Listas!A2:A40"
+            ranges[name] = entries[0].lstrip("=").replace("$", "")
+        else:
+            raise ValueError(f"{name}: the column has no list validation (found {kind})")
+    if ranges:
+        response = spreadsheet.values_batch_get(list(ranges.values()))
+        for name, value_range in zip(ranges, response.get("valueRanges", [])):
+            values[name] = [cell for row in value_range.get("values", []) for cell in row]
+    return values
+
+
+def fetch_enums(spreadsheet) -> dict[str, list[str]]:
+    """Every list in ENUM_COLUMNS, read from the validation rule on the first
+    data row of its column. Three read requests whatever the number of lists:
+    the headers, the rules, and the ranges the rules point to."""
+    worksheets = sorted({worksheet for worksheet, _ in ENUM_COLUMNS.values()})
+    response = spreadsheet.values_batch_get(
+        [f"'{worksheet}'!1:1" for worksheet in worksheets]
+    )
+    headers = {
+        worksheet: (value_range.get("values") or [[]])[0]
+        for worksheet, value_range in zip(worksheets, response.get("valueRanges", []))
+    }
+    cells = {}
+    for name, (worksheet, column) in ENUM_COLUMNS.items():
+        header = headers.get(worksheet, [])
+        if column not in header:
+            raise ValueError(f"Falta la columna {column} en la hoja {worksheet}")
+        index = header.index(column)
+        # first data row: 'Ventas'!B2
+        cells[name] = (worksheet, index, f"'{worksheet}'!{rowcol_to_a1(2, index + 1)}")
+
+    metadata = spreadsheet.fetch_sheet_metadata({
+        "includeGridData": "true",
+        "ranges": [cell for _, _, cell in cells.values()],
+        "fields": "sheets(properties.title,data(startColumn,rowData.values.dataValidation))",
+    })
+    found = {}
+    for sheet in metadata.get("sheets", []):
+        title = sheet["properties"]["title"]
+        for grid in sheet.get("data", []):
+            rows = grid.get("rowData") or [{}]
+            cell = (rows[0].get("values") or [{}])[0]
+            found[(title, grid.get("startColumn", 0))] = cell.get("dataValidation", {})
+    rules = {
+        name: found.get((worksheet, index), {}).get("condition", {})
+        for name, (worksheet, index, _) in cells.items()
+    }
+    values = _validation_values(spreadsheet, rules)
+    return _check({
+        name: sorted({v.strip() for v in values.get(name, []) if v.strip()})
+        for name in ENUM_COLUMNS
+    })
+
+
+# ── cache file ──────────────────────────────────────────────────────
+
+def read_cache(path: str) -> dict | None:
+    """The cache file's content ({"version", "synced_at", "enums"}), None when
+    there is none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    data["enums"] = _check(data.get("enums", {}))
+    return data
+
+
+def write_cache(path: str, enums: dict[str, list[str]]) -> int:
+    """Save enums and return the cache version: the old one when nothing
+    changed (the file is left alone), the next one otherwise."""
+    enums = _check(enums)
+    current = read_cache(path)
+    if current is not None and current["enums"] == enums:
+        return current["version"]
+    version = (current["version"] if current else 0) + 1
+    data = json.dumps(
+        {
+            "version": version,
+            "synced_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "enums": enums,
+        },
+        ensure_ascii=False,
+        indent=2,
+    )
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return version
+
+
+def render_config(enums: dict[str, list[str]]) -> str:
+    """config.py holding these lists, in the layout the file has always had."""
+    lists = "\n\n\n".join(f"{name} = {enums[name]!r}" for name in ENUM_COLUMNS)
+    return f'"""\nAuto-generated enum values from Google Sheets.\n"""\n\n\n{lists}\n'
+
+
+# ── registry ────────────────────────────────────────────────────────
+
+class EnumRegistry:
+    """The current lists, by name: ``registry["ENTRADA_CATEGORIES"]``.
+
+    Loads ``path`` on first use and checks it again at most once every
+    ``reload_interval`` seconds, reloading when the file changed. ``version``
+    is the cache file's (0 while serving the defaults); it moves whenever the
+    lists do, so callers can tell when anything built from them is out of
+    date. A broken or missing file keeps whatever was loaded last.
+    """
+
+    def __init__(self, path: str, defaults: dict[str, list[str]] = DEFAULTS,
+                 reload_interval: float = 60.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._defaults = _check(defaults)
+        self._enums, self._version = dict(self._defaults), 0
+        self._identity = self._checked_at = None
+
+    def __getitem__(self, name: str) -> list[str]:
+        self.check()
+        return self._enums[name]
+
+    def reset(self) -> None:
+        """Back to the defaults; the file is read again on next use."""
+        with self._lock:
+            self._enums, self._version = dict(self._defaults), 0
+            self._identity = self._checked_at = None
+
+    @property
+    def version(self) -> int:
+        self.check()
+        return self._version
+
+    def check(self) -> None:
+        """Reload the file if reload_interval elapsed since the last look."""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            print(f"[Enums] Keeping version {self._version}, cannot load {self.path}: {e}")
+
+    def reload(self) -> bool:
+        """Read the file now if it changed; True when the lists did."""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return False
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity == self._identity:
+                return False
+            data = read_cache(self.path)
+            self._identity = identity
+            changed = data["version"] != self._version
+            if changed:
+                self._enums, self._version = data["enums"], data["version"]
+                print(f"[Enums] Loaded version {self._version} from {self.path}")
+            return changed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sync the valid categories and payment "
+                                                 "methods from the spreadsheet.")
+    parser.add_argument("--config", action="store_true",
+                        help="also regenerate config.py with the synced lists")
+    args = parser.parse_args()
+
+    from tools import sync_enums  # needs the credentials and sheet settings
+
+    version, enums = sync_enums()
+    print(f"Cache version {version}: " + ", ".join(f"{n} ({len(v)})" for n, v in enums.items()))
+    if args.config:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_config(enums))
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Rules-based reading of the most common message: one plain expense or income.
+
+``parse_transaction("gasté 1500 en farmacia con QR")`` returns the add_expense
+call the model would have made, so the agent can record it without asking
+DeepSeek. Anything it isn't sure about (no verb, several amounts, a question,
+a category it can't place) returns None and the model handles the message.
+"""
+
+import re
+
+from enums import DEFAULTS
+from matcher import fold
+
+# Verbs (accents stripped, lowercase) that make a message an expense or income.
+EXPENSE_VERBS = ("gaste", "pague", "compre", "gastamos", "pagamos", "compramos")
+INCOME_VERBS = ("cobre", "recibi", "me pagaron", "me depositaron", "me transfirieron", "vendi")
+
+# Words in the description (plurals match too) -> start of a category name.
+# tools also resolves the model's category guesses with these (see matcher.py).
+EXPENSE_KEYWORDS = {
+    "farmacia": "Farmacia",
+    "remedio": "Farmacia",
+    "gimnasio": "Gimnasio",
+    "gym": "Gimnasio",
+    "super": "Alimentación",
+    "supermercado": "Alimentación",
+    "almacen": "Alimentación",
+    "verduleria": "Alimentación",
+    "carniceria": "Alimentación",
+    "panaderia": "Alimentación",
+    "comida": "Alimentación",
+    "kiosco": "Alimentación",
+    "almuerzo": "Alimentación",
+    "cena": "Alimentación",
+    "desayuno": "Alimentación",
+    "restaurant": "Alimentación",
+    "restaurante": "Alimentación",
+    "pizza": "Alimentación",
+    "delivery": "Alimentación",
+    "cafe": "Alimentación",
+    "nafta": "Transporte",
+    "combustible": "Transporte",
+    "uber": "Transporte",
+    "taxi": "Transporte",
+    "colectivo": "Transporte",
+    "subte": "Transporte",
+    "sube": "Transporte",
+    "peaje": "Transporte",
+    "estacionamiento": "Transporte",
+    "alquiler": "Vivienda",
+    "expensas": "Vivienda",
+    "luz": "Vivienda",
+    "gas": "Vivienda",
+    "agua": "Vivienda",
+    "hogar": "Vivienda",
+    "servicio": "Vivienda",
+    "internet": "Tecnología",
+    "celular": "Tecnología",
+    "cine": "Entretenimiento",
+    "teatro": "Entretenimiento",
+    "recital": "Entretenimiento",
+    "streaming": "Entretenimiento",
+    "suscripcion": "Entretenimiento",
+    "ropa": "Ropa",
+    "zapatilla": "Ropa",
+    "remera": "Ropa",
+    "peluqueria": "Cuidado personal",
+    "veterinaria": "Mascotas",
+    "veterinario": "Mascotas",
+    "perro": "Mascotas",
+    "gato": "Mascotas",
+    "medico": "Salud",
+    "consulta": "Salud",
+    "prepaga": "Salud",
+    "dentista": "Salud",
+    "curso": "Educación",
+    "libro": "Educación",
+    "regalo": "Regalos",
+    "impuesto": "Impuestos",
+    "monotributo": "Impuestos",
+    "tarjeta": "Deudas",
+    "prestamo": "Deudas",
+    "otro": "Varios",
+}
+INCOME_KEYWORDS = {
+    "sueldo": "Salario",
+    "salario": "Salario",
+    "aguinaldo": "Bonificaciones",
+    "bono": "Bonificaciones",
+    "freelance": "Freelance",
+    "changa": "Freelance",
+    "reembolso": "Reembolsos",
+    "devolucion": "Reembolsos",
+    "reintegro": "Reembolsos",
+    "dividendo": "Ingresos de inversiones",
+    "plazo fijo": "Ingresos de inversiones",
+    "interes": "Ingresos de inversiones",
+}
+
+# Phrases naming how it was paid -> start of a payment method name.
+PAYMENT_KEYWORDS = {
+    "qr": "QR",
+    "mercado pago": "QR",
+    "efectivo": "Efectivo",
+    "cash": "Efectivo",
+    "credito": "Tarjeta de crédito",
+    "debito": "Tarjeta de débito",
+    "transferencia": "Transferencia",
+    "cripto": "Cripto",
+    "usdt": "Cripto",
+    "billetera": "QR",
+}
+
+# 1500 / 1.500 / 1,500 / 1500,50 / $ 2.000 / 15k / 15 mil
+_AMOUNT = re.compile(
+    r"\$?\s*(\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,](\d{1,2}))?\s*(k|mil|lucas)?\b"
+)
+# The description: what follows "en"/"de"/"por" after the amount, up to the
+# payment phrase.
+_DESCRIPTION = re.compile(
+    r"^\s*(?:pesos\s+)?(?:en|de|por|del)\s+(?:(?:el|la|los|las|un|una|unos|unas)\s+)?(.+?)\s*$"
+)
+_PAYMENT_TAIL = re.compile(
+    r"\s+(con|en|por|via|pagando con)\s+(?:(?:la|el|una|un)\s+)?"
+    r"(?:tarjeta de\s+)?(\w+(?:\s+\w+)?)\s*$"
+)
+# After these a payment method must follow; anything else is left to the model.
+_PAYMENT_ONLY = ("con", "via", "pagando con")
+_NEGATION = re.compile(r"\b(?:no|nunca|todavia no)\b")
+# A date other than today: the tools would record it with today's.
+_TIME = re.compile(
+    r"\b(?:ayer|anteayer|antier|anoche|manana|pasad[oa]s?|anterior|proxim[oa]|hace|"
+    r"semanas?|mes|meses|ano|anos|dias?|finde|fin de semana|"
+    r"lunes|martes|miercoles|jueves|viernes|sabado|domingo|"
+    r"enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|"
+    r"noviembre|diciembre)\b|\d{1,2}/\d{1,2}"
+)
+# Another clause left in the description ("super en cuotas", "pizza para
+# Juan"): something the tools' arguments can't hold.
+_CLAUSE = re.compile(r"\b(?:en|con|por|para|via|pagando|a|al|desde|hasta|sin|entre)\b")
+
+
+def _resolve(prefix: str, valid: list[str]) -> str | None:
+    for item in valid:
+        if item.startswith(prefix):
+            return item
+    return None
+
+
+def _parse_amount(whole: str, decimals: str | None, suffix: str | None) -> float:
+    value = float(re.sub(r"[.,]", "", whole))
+    if decimals:
+        value += float(f"0.{decimals}")
+    if suffix:
+        value *= 1000
+    return value
+
+
+def _lookup(words: str, keywords: dict[str, str]) -> str | None:
+    for keyword, target in keywords.items():
+        if re.search(rf"\b{re.escape(keyword)}(?:s|es)?\b", words):
+            return target
+    return None
+
+
+def parse_transaction(text: str, enums=DEFAULTS) -> tuple[str, dict] | None:
+    """(tool name, tool args) for a message that plainly records one
+    transaction, or None when the model should read it instead.
+
+    Categories and payment methods resolve against the lists in enums (by
+    name, like enums.EnumRegistry); the config.py ones by default."""
+    text = text.strip()
+    plain = fold(text).rstrip(".!")
+    if not plain or "?" in plain or "\n" in plain:
+        return None
+    if _NEGATION.search(plain) or _TIME.search(plain):
+        return None
+
+    if any(re.match(rf"(?:hoy )?{verb}\b", plain) for verb in EXPENSE_VERBS):
+        tool, keywords = "add_expense", EXPENSE_KEYWORDS
+        categories, payment_methods = enums["ENTRADA_CATEGORIES"], enums["ENTRADA_PAYMENT_METHODS"]
+    elif any(re.match(rf"(?:hoy )?{verb}\b", plain) for verb in INCOME_VERBS):
+        tool, keywords = "add_income", INCOME_KEYWORDS
+        categories, payment_methods = enums["VENTAS_CATEGORIES"], enums["VENTAS_PAYMENT_METHODS"]
+    else:
+        return None
+
+    amounts = list(_AMOUNT.finditer(plain))
+    if len(amounts) != 1:
+        return None
+    match = amounts[0]
+    amount = _parse_amount(*match.groups())
+    if amount <= 0:
+        return None
+
+    rest = plain[match.end():]
+    payment_method = "Efectivo"
+    tail = _PAYMENT_TAIL.search(rest)
+    if tail:
+        connector, words = tail.groups()
+        target = _lookup(words, PAYMENT_KEYWORDS)
+        if target is not None:
+            payment_method = _resolve(target, payment_methods)
+            if payment_method is None:
+                return None  # e.g. income "con QR": not a valid method there
+            rest = rest[:tail.start()]
+        elif connector in _PAYMENT_ONLY:
+            return None  # "con la tarjeta", "con leche": unclear
+
+    description = _DESCRIPTION.match(rest)
+    if not description:
+        return None
+    description = description.group(1)
+    if _CLAUSE.search(description):
+        return None
+    target = _lookup(description, keywords)
+    category = _resolve(target, categories) if target else None
+    if category is None:
+        return None
+
+    # keep the user's own spelling (accents included) for the sheet
+    start = plain.index(description, match.end())
+    original = text[start:start + len(description)]
+    if fold(original) != description:
+        original = description
+    return tool, {
+        "amount": amount,
+        "description": original,
+        "category": category,
+        "payment_method": payment_method,
+    }
@@ -1,73 +1,480 @@
+import asyncio
+import multiprocessing
 import os
+import queue
+import secrets
+import socket
+import sqlite3
+import ssl
 import sys
+from types import SimpleNamespace
 
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage
-from telegram.ext import Application, MessageHandler, filters
+from telegram import Bot, Update
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
+import database
 from agent import build_graph
-from database import init_db, is_duplicate, load_history, mark_processed, save_message
+from database import (
+    claim_update,
+    compact,
+    init_db,
+    is_duplicate,
+    load_history,
+    release_claims,
+    save_turn,
+)
+from dispatcher import ChatDispatcher
+from streaming import ReplyStreamer, stream_agent
+from webhook import LatencyTracker, WebhookServer
+from tools import (
+    reconcile_balances,
+    replay_sheet_journal,
+    resync_transactions,
+    sheet_writer,
+    sheets_scheduler,
+    sync_enums,
+    transaction_guard,
+)
 
 load_dotenv()
 
+# Agent turns running at once across all chats. Each one occupies a worker
+# thread while it waits on DeepSeek and Google Sheets.
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", "4"))
+# Turns of one chat running at once. 1 keeps a chat's messages strictly in order.
+MAX_TURNS_PER_CHAT = int(os.getenv("MAX_TURNS_PER_CHAT", "1"))
+# Messages a chat may have waiting before new ones are turned away.
+MAX_QUEUED_PER_CHAT = int(os.getenv("MAX_QUEUED_PER_CHAT", "20"))
+# Messages of one chat arriving within this window are answered as one turn (0 = off).
+COALESCE_MS = float(os.getenv("COALESCE_MS", "0"))
+# Retention: processed update_ids older than this are forgotten (Telegram only
+# redelivers recent updates), and each chat keeps this many history rows.
+UPDATES_RETENTION_HOURS = float(os.getenv("UPDATES_RETENTION_HOURS", "48"))
+HISTORY_ROWS_PER_CHAT = int(os.getenv("HISTORY_ROWS_PER_CHAT", "500"))
+DB_COMPACT_SECONDS = float(os.getenv("DB_COMPACT_SECONDS", "3600"))
+# History sent with each turn: the newest messages fitting this many tokens
+# (0 = the last 20 rows regardless of size), read from at most HISTORY_MAX_ROWS
+# rows. Tool results before the latest exchange are cut to HISTORY_TOOL_OUTPUT_CHARS.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_MAX_ROWS = int(os.getenv("HISTORY_MAX_ROWS", "100"))
+HISTORY_TOOL_OUTPUT_CHARS = int(os.getenv("HISTORY_TOOL_OUTPUT_CHARS", "1500"))
+# How often dispatcher queue statistics are logged (0 = never).
+DISPATCH_STATS_LOG_SECONDS = float(os.getenv("DISPATCH_STATS_LOG_SECONDS", "300"))
+
+# Record plain "gasté 1500 en farmacia" messages and confirm transactions
+# without a model call (0 = always go through the model).
+AGENT_FAST_PATH = os.getenv("AGENT_FAST_PATH", "1") != "0"
+
+# Stream replies: "typing" at once, then the reply edited in as the model
+# writes it, at most one edit per STREAM_EDIT_SECONDS (0 = send the finished
+# reply only).
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") != "0"
+STREAM_EDIT_SECONDS = float(os.getenv("STREAM_EDIT_SECONDS", "1.5"))
+
+# Webhook mode: set WEBHOOK_URL (the public https URL Telegram should POST
+# to, path included) to receive updates through an embedded HTTP server
+# instead of long polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+# Certificate and key to serve HTTPS directly (self-signed certificates are
+# uploaded to Telegram). Leave unset behind a TLS-terminating proxy.
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT")
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY")
+
+# Scale-out: with WORKERS > 1 this process only receives updates (polling or
+# webhook) and forwards each one to worker process chat_id % WORKERS, which
+# runs the agent. A chat always lands on the same worker, so its messages
+# stay in order; workers share the sqlite files and claim every update
+# atomically before answering it.
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Names this process in update claims.
+WORKER_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
+# How often the running monthly totals are checked against a full reload of the sheets.
+BALANCE_RECONCILE_SECONDS = float(os.getenv("BALANCE_RECONCILE_SECONDS", "3600"))
+# How often the valid categories and payment methods are pulled from the
+# sheet's validation rules into the enum cache file; 0 turns it off.
+ENUMS_SYNC_SECONDS = float(os.getenv("ENUMS_SYNC_SECONDS", "3600"))
+
 # to avoid BUG: 'charmap' codec can't encode character '\U0001f42c'
 # line_buffering so print() reaches bot_log.txt immediately when redirected
 sys.stdout.reconfigure(encoding="utf-8", errors="replace", line_buffering=True)
 sys.stderr.reconfigure(encoding="utf-8", errors="replace", line_buffering=True)
 
-agent = build_graph()
+agent = build_graph(fast_path=AGENT_FAST_PATH)
+# Webhook ingest -> reply latency (only webhook updates are stamped).
+ingest_latency = LatencyTracker()
+webhook_server: WebhookServer | None = None
 
 # sqlite initialization
 db = init_db()
 
 
-async def handle_message(update, context):
-    update_id = update.update_id
+async def enqueue_message(update, context):
+    """MessageHandler callback: hand the message to its chat's queue and return."""
     chat_id = update.message.chat_id
-    text = update.message.text
+    if not dispatcher.submit(chat_id, (update, context)):
+        print(f"Queue full for chat {chat_id}, rejected update_id: {update.update_id}")
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Tengo varios mensajes tuyos pendientes. Esperá a que responda y volvé a enviarlo.",
+        )
+
 
-    if is_duplicate(db, update_id):
-        print(f"Skipping duplicate update_id: {update_id}")
+async def handle_message(chat_id, batch):
+    """One agent turn for a chat. batch holds the (update, context) pairs the
+    dispatcher handed over: one, or several when a burst was coalesced."""
+    bot = batch[-1][1].bot
+
+    updates = []
+    for update, _context in batch:
+        if is_duplicate(db, update.update_id):
+            print(f"Skipping duplicate update_id: {update.update_id}")
+        elif not claim_update(db, update.update_id, WORKER_NAME):
+            print(f"Skipping update_id {update.update_id}: claimed by another worker")
+        else:
+            updates.append(update)
+    if not updates:
         return
 
+    text = "\n".join(update.message.text for update in updates)
     print(f"Recibido mensaje de {chat_id}: {text}")
 
     # Load history from SQLite and append new message
-    history = load_history(db, chat_id)
+    if HISTORY_TOKEN_BUDGET:
+        history = load_history(
+            db,
+            chat_id,
+            limit=HISTORY_MAX_ROWS,
+            max_tokens=HISTORY_TOKEN_BUDGET,
+            tool_output_chars=HISTORY_TOOL_OUTPUT_CHARS or None,
+        )
+    else:
+        history = load_history(db, chat_id)
     user_message = HumanMessage(content=text)
     history.append(user_message)
-    save_message(db, chat_id, user_message)
+    saved = False
+    reply = ReplyStreamer(bot, chat_id, STREAM_EDIT_SECONDS)
+    inputs = {"messages": history, "chat_id": chat_id}
+    config = {"recursion_limit": 10}
 
     try:
-        result = agent.invoke(
-            {"messages": history, "chat_id": chat_id}, config={"recursion_limit": 10}
-        )
+        if STREAM_REPLIES:
+            await reply.start()
+            # astream runs the graph's blocking nodes (DeepSeek, gspread) on
+            # worker threads, so the event loop keeps serving other chats.
+            result = await stream_agent(agent, inputs, config, reply.update)
+        else:
+            # The graph blocks on DeepSeek and gspread; run it on a worker
+            # thread so the event loop keeps serving other chats.
+            result = await asyncio.to_thread(agent.invoke, inputs, config=config)
 
         response_text = result["messages"][-1].content
 
-        # Persist every message the agent produced this turn (tool calls and
-        # tool results included) so replayed history shows the model that
-        # confirmations always come after a real tool call.
-        for message in result["messages"][len(history):]:
-            save_message(db, chat_id, message)
+        # Persist the user message and every message the agent produced this
+        # turn (tool calls and tool results included) so replayed history
+        # shows the model that confirmations always come after a real tool
+        # call. One transaction, together with marking the updates processed.
+        save_turn(
+            db,
+            chat_id,
+            [user_message, *result["messages"][len(history):]],
+            [update.update_id for update in updates],
+        )
+        saved = True
 
-        await context.bot.send_message(chat_id=chat_id, text=response_text)
-        mark_processed(db, update_id)
+        await reply.finish(response_text)
+        ingest_latency.replied(update.update_id for update in updates)
         print(f"Respuesta enviada: {response_text}")
 
     except Exception as e:
+        if not saved:
+            # Keep what the user said even though the turn failed; the update
+            # stays unprocessed and unclaimed.
+            save_turn(db, chat_id, [user_message])
+            release_claims(db, [update.update_id for update in updates], WORKER_NAME)
         error_msg = f"Lo siento, ocurrió un error: {str(e)}"
-        await context.bot.send_message(chat_id=chat_id, text=error_msg)
+        # replaces a half-streamed reply, if there is one
+        await reply.finish(error_msg)
+        print(f"Error: {e}")
+    finally:
+        reply.close()
+
+
+dispatcher = ChatDispatcher(
+    handle_message,
+    max_concurrent=MAX_CONCURRENT_TURNS,
+    max_per_chat=MAX_TURNS_PER_CHAT,
+    max_queue_per_chat=MAX_QUEUED_PER_CHAT,
+    coalesce_seconds=COALESCE_MS / 1000,
+)
+
+
+async def handle_resync(update, context):
+    """/resync: reload both sheets into the local mirror after editing them by hand."""
+    chat_id = update.message.chat_id
+    try:
+        await asyncio.to_thread(resync_transactions)
+        await context.bot.send_message(chat_id=chat_id, text="Planilla sincronizada.")
+    except Exception as e:
+        await context.bot.send_message(
+            chat_id=chat_id, text=f"No se pudo sincronizar la planilla: {str(e)}"
+        )
         print(f"Error: {e}")
 
 
+async def reconcile_periodically():
+    """Background job: keep the running balances honest against the sheets."""
+    while True:
+        await asyncio.sleep(BALANCE_RECONCILE_SECONDS)
+        try:
+            await asyncio.to_thread(reconcile_balances)
+        except Exception as e:
+            print(f"[Balance] Reconcile failed: {e}")
+
+
+async def sync_enums_periodically():
+    """Background job: pick up categories and payment methods added to the
+    sheet. Every process rereads the cache file when it changes."""
+    while True:
+        try:
+            version, _enums = await asyncio.to_thread(sync_enums)
+            print(f"[Enums] Synced from the sheet, version {version}")
+        except Exception as e:
+            print(f"[Enums] Sync failed, keeping the cached lists: {e}")
+        await asyncio.sleep(ENUMS_SYNC_SECONDS)
+
+
+async def log_dispatch_stats_periodically():
+    """Background job: queue depth and wait times, for sizing the limits under load."""
+    last_submitted = 0
+    while True:
+        await asyncio.sleep(DISPATCH_STATS_LOG_SECONDS)
+        stats = dispatcher.stats()
+        if stats["submitted"] == last_submitted and not stats["queued"]:
+            continue  # nothing happened since the last line
+        last_submitted = stats["submitted"]
+        print(
+            "[Dispatch] "
+            f"queued={stats['queued']} in_flight={stats['in_flight']} "
+            f"max_depth={stats['max_depth']} turns={stats['turns']} "
+            f"coalesced={stats['coalesced']} rejected={stats['rejected']} "
+            f"wait_ms avg={stats['wait_ms_avg']:.0f} p95={stats['wait_ms_p95']:.0f} "
+            f"max={stats['wait_ms_max']:.0f}"
+        )
+        stats = sheet_writer.stats()
+        print(
+            "[Sheets] "
+            f"appends={stats['appends']} rows={stats['rows']} "
+            f"requests={stats['requests']} failed_requests={stats['failed_requests']}"
+        )
+        stats = sheets_scheduler.stats()
+        print(
+            "[Sheets] "
+            f"reads={stats['read_last_minute']}/{stats['read_quota']} "
+            f"writes={stats['write_last_minute']}/{stats['write_quota']} per minute, "
+            f"retries={stats['read_retries'] + stats['write_retries']} "
+            f"throttled={stats['read_throttled'] + stats['write_throttled']} "
+            f"wait_ms={stats['wait_ms']} "
+            f"failed={stats['read_failed'] + stats['write_failed']}"
+        )
+        stats = transaction_guard.stats()
+        print(
+            "[Dedup] "
+            f"claimed={stats['claimed']} suppressed={stats['suppressed']} "
+            f"released={stats['released']} expired={stats['expired']} keys={stats['keys']}"
+        )
+        if webhook_server is not None:
+            stats = webhook_server.stats()
+            print(
+                "[Webhook] "
+                f"received={stats['received']} queued={stats['queued']} "
+                f"rejected_full={stats['rejected_full']} forbidden={stats['forbidden']} "
+                f"repeated={stats['repeated']} failed={stats['failed']} "
+                f"reply_ms p50={stats['reply_ms_p50']:.0f} p95={stats['reply_ms_p95']:.0f} "
+                f"max={stats['reply_ms_max']:.0f}"
+            )
+
+
+def _compact_db() -> tuple[int, int]:
+    """One retention pass on a connection of its own, so it can run in a
+    thread; db's history cache notices the deleted rows per chat."""
+    con = sqlite3.connect(database.DB_PATH, timeout=30)
+    try:
+        return compact(con, UPDATES_RETENTION_HOURS * 3600, HISTORY_ROWS_PER_CHAT)
+    finally:
+        con.close()
+
+
+async def compact_db_periodically():
+    """Background job: apply the retention policy to the sqlite DB, off the
+    event loop so chats keep being answered meanwhile."""
+    while True:
+        await asyncio.sleep(DB_COMPACT_SECONDS)
+        try:
+            updates, messages = await asyncio.to_thread(_compact_db)
+            print(f"[DB] Compacted: {updates} update id(s), {messages} history row(s) removed")
+            print(f"[DB] History cache: {db.history_cache.stats()}")
+        except Exception as e:
+            print(f"[DB] Compaction failed: {e}")
+
+
+async def start_background_jobs(app):
+    try:
+        await asyncio.to_thread(replay_sheet_journal)
+    except Exception as e:
+        print(f"[Sheets] Journal replay failed, will retry on the next start: {e}")
+    app.create_task(reconcile_periodically())
+    app.create_task(compact_db_periodically())
+    if ENUMS_SYNC_SECONDS > 0:
+        app.create_task(sync_enums_periodically())
+    # with workers, each of them logs its own dispatcher
+    if DISPATCH_STATS_LOG_SECONDS > 0 and WORKERS == 1:
+        app.create_task(log_dispatch_stats_periodically())
+
+
+# ── scale-out ────────────────────────────────────────────────────
+
+worker_queues: list = []
+
+
+async def forward_message(update, context):
+    """MessageHandler callback with WORKERS > 1: pass the update to the worker
+    that owns its chat."""
+    chat_id = update.message.chat_id
+    try:
+        worker_queues[chat_id % WORKERS].put_nowait(update.to_dict())
+    except queue.Full:
+        print(f"Worker queue full, rejected update_id: {update.update_id}")
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Tengo varios mensajes tuyos pendientes. Esperá a que responda y volvé a enviarlo.",
+        )
+
+
+def run_worker(index: int, inbox) -> None:
+    """Worker process: answer the updates the receiving process forwards."""
+    asyncio.run(_serve_worker(index, inbox))
+
+
+async def _serve_worker(index: int, inbox) -> None:
+    async with Bot(os.getenv("HTTP_TELEGRAM_TOKEN")) as bot:
+        context = SimpleNamespace(bot=bot)
+        if DISPATCH_STATS_LOG_SECONDS > 0:
+            stats_job = asyncio.create_task(log_dispatch_stats_periodically())
+        print(f"[Worker {index}] Ready as {WORKER_NAME}")
+        while (payload := await asyncio.to_thread(inbox.get)) is not None:
+            await enqueue_message(Update.de_json(payload, bot), context)
+        await dispatcher.join()
+        if DISPATCH_STATS_LOG_SECONDS > 0:
+            stats_job.cancel()
+    print(f"[Worker {index}] Stopped")
+
+
+def start_workers() -> list:
+    # spawn, not fork: each worker opens its own sqlite connections and HTTP clients
+    spawn = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(WORKERS):
+        inbox = spawn.Queue(WORKER_QUEUE_SIZE)
+        process = spawn.Process(target=run_worker, args=(index, inbox), name=f"worker-{index}")
+        process.start()
+        worker_queues.append(inbox)
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes: list) -> None:
+    """Let every worker finish what it has queued, then wait for it."""
+    for inbox in worker_queues:
+        inbox.put(None)
+    for process in processes:
+        process.join()
+
+
+async def ingest_update(app, payload: dict):
+    """Webhook consumer: hand one update to the application's handlers."""
+    update = Update.de_json(payload, app.bot)
+    if is_duplicate(db, update.update_id):
+        print(f"Skipping duplicate update_id: {update.update_id}")
+        return
+    await app.process_update(update)
+
+
+async def run_webhook(app):
+    """Serve the webhook until cancelled (CTRL+C)."""
+    global webhook_server
+
+    tls = None
+    if WEBHOOK_CERT:
+        tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        tls.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+    webhook_server = WebhookServer(
+        lambda payload: ingest_update(app, payload),
+        secret_token=WEBHOOK_SECRET,
+        path=WEBHOOK_PATH,
+        max_queue=WEBHOOK_QUEUE_SIZE,
+        latency=ingest_latency,
+    )
+
+    async with app:
+        await app.start()
+        await start_background_jobs(app)
+        await webhook_server.start(WEBHOOK_LISTEN, WEBHOOK_PORT, ssl=tls)
+        certificate = open(WEBHOOK_CERT, "rb") if WEBHOOK_CERT else None
+        try:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                certificate=certificate,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        finally:
+            if certificate is not None:
+                certificate.close()
+        print(f"Webhook listening on {WEBHOOK_LISTEN}:{webhook_server.port}{WEBHOOK_PATH}... (CTRL+C to stop)")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await webhook_server.stop()
+            await dispatcher.join()
+            await app.stop()
+
+
 def main():
     token = os.getenv("HTTP_TELEGRAM_TOKEN")
-    app = Application.builder().token(token).build()
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(True)  # the dispatcher does the ordering and bounding
+        .post_init(start_background_jobs)
+        .build()
+    )
+    app.add_handler(CommandHandler("resync", handle_resync))
+    app.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND,
+        forward_message if WORKERS > 1 else enqueue_message,
+    ))
 
-    print("Bot polling started... (CTRL+C to stop)")
-    app.run_polling()
+    processes = start_workers() if WORKERS > 1 else []
+    try:
+        if WEBHOOK_URL:
+            try:
+                asyncio.run(run_webhook(app))
+            except KeyboardInterrupt:
+                pass
+        else:
+            print("Bot polling started... (CTRL+C to stop)")
+            app.run_polling()
+    finally:
+        stop_workers(processes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""Resolve the model's free-form category and payment-method guesses to valid entries.
+
+A ``Matcher`` is built once per list of valid entries (tools keeps one per
+list and enum registry version), so a lookup only normalizes the guess and
+probes precomputed tables, in this order:
+
+1. exact match, ignoring case and accents ("alimentacion");
+2. start of an entry ("aliment");
+3. an alias ("super", "nafta", "uber"), plurals included;
+4. start of a later word of an entry ("comestibles", "restaur");
+5. any word of the guess being an alias ("comida rapida");
+6. trigram similarity with an entry's short name, its words or an alias, if
+   it reaches ``threshold`` ("farmcia", "restaurant").
+
+Steps 1 to 5 are dictionary lookups, one per word of the guess at most, so
+they cost the same whatever the length of the list. Step 6 visits only the
+labels sharing a trigram with the guess. Anything below the threshold is no
+match, so the caller can still reject it.
+"""
+
+import re
+import unicodedata
+
+
+def fold(text: str) -> str:
+    """Lowercase with accents removed, for matching."""
+    decomposed = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _key(text: str) -> str:
+    """fold with whitespace collapsed."""
+    return " ".join(fold(text).split())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Matcher:
+    """Lookup tables for one list of valid entries.
+
+    aliases maps words (any case or accents) to the start of the entry they
+    stand for, like fast_path's keyword tables; aliases whose target isn't in
+    the list are ignored.
+    """
+
+    def __init__(self, values, aliases: dict[str, str] | None = None, threshold: float = 0.6):
+        self.values = tuple(values)
+        self.threshold = threshold
+        self._exact: dict[str, str] = {}
+        self._prefixes: dict[str, str] = {}
+        self._word_prefixes: dict[str, str] = {}
+        keys = [(_key(value), value) for value in self.values]
+        for key, value in keys:
+            self._exact.setdefault(key, value)
+            # first entry in list order wins
+            for end in range(1, len(key) + 1):
+                self._prefixes.setdefault(key[:end], value)
+            for word in re.finditer(r"\w+", key):
+                if word.start():
+                    for end in range(word.start() + 1, len(key) + 1):
+                        self._word_prefixes.setdefault(key[word.start():end], value)
+
+        self._aliases: dict[str, str] = {}
+        for word, target in (aliases or {}).items():
+            value = self._prefixes.get(_key(target))
+            if value is not None:
+                word = _key(word)
+                for form in (word, f"{word}s", f"{word}es"):
+                    self._aliases.setdefault(form, value)
+
+        # trigram -> labels containing it; a label is a short name, a word of
+        # an entry or an alias
+        self._labels: list[tuple[int, str]] = []
+        self._index: dict[str, list[int]] = {}
+        labels = {}
+        for key, value in keys:
+            labels.setdefault(key.split(" (")[0], value)
+            for word in re.findall(r"\w{4,}", key):
+                labels.setdefault(word, value)
+        for word, value in self._aliases.items():
+            labels.setdefault(word, value)
+        for label, value in labels.items():
+            grams = _trigrams(label)
+            for gram in grams:
+                self._index.setdefault(gram, []).append(len(self._labels))
+            self._labels.append((len(grams), value))
+
+    def match(self, guess: str) -> str | None:
+        """The valid entry guess stands for, or None."""
+        key = _key(guess)
+        if not key:
+            return None
+        found = (
+            self._exact.get(key)
+            or self._prefixes.get(key)
+            or self._aliases.get(key)
+            or self._word_prefixes.get(key)
+            or next((self._aliases[w] for w in re.findall(r"\w+", key) if w in self._aliases), None)
+        )
+        return found if found is not None else self._similar(key)
+
+    def _similar(self, key: str) -> str | None:
+        """The entry whose label shares the most trigrams with key (Dice
+        coefficient), if at least threshold."""
+        grams = _trigrams(key)
+        shared: dict[int, int] = {}
+        for gram in grams:
+            for label in self._index.get(gram, ()):
+                shared[label] = shared.get(label, 0) + 1
+        if not shared:
+            return None
+        # ties go to the label built first, so the answer never depends on set order
+        score, label = max(
+            (2 * count / (len(grams) + self._labels[label][0]), -label)
+            for label, count in shared.items()
+        )
+        return self._labels[-label][1] if score >= self.threshold else None
@@ -2,7 +2,7 @@ import operator
 from typing import Annotated, Sequence, TypedDict
 
 from langchain_core.messages import BaseMessage
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class TelegramMessage(BaseModel):
@@ -19,3 +19,11 @@ class FinanceEntry(BaseModel):
     amount: float
     description: str
     category: str = "general"
+
+
+class ExpenseItem(BaseModel):
+    """One expense inside an add_expenses call"""
+    amount: float = Field(description="The amount spent (positive number)")
+    description: str = Field(description="What the expense was for")
+    category: str = Field(description="Category from the sheet (e.g., Alimentación, Transporte)")
+    payment_method: str = Field(default="Efectivo", description="Payment method from the sheet")
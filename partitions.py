@@ -0,0 +1,220 @@
+"""Month partitions of the mirrored transactions as memory-mapped NumPy files.
+
+One ``.npy`` file per (kind, month) holds a structured array with one record
+per transaction, in sheet order:
+
+    row         int64    sheet row number (negative: provisional write-through)
+    day         int32    days since 1970-01-01
+    monto       float64
+    categoria   int32    code into the kind's dictionary
+    metodo_pago int32    code into the kind's dictionary
+    usuario     int32    code into the kind's dictionary
+    notas       <U{n}    n = longest note of that month, at most NOTE_WIDTH
+
+Reads open a file with ``mmap_mode="r"``: nothing is parsed, and a query about
+one month touches only that month's file however long the history is. The
+dictionaries are append-only JSON lists per kind, so a code keeps its meaning
+in every partition, and frames get the encoded columns as pandas Categoricals
+built straight from the codes, never as one Python string per row. Files are
+written under a temporary name and renamed over the old one, so a reader sees
+either the old partition or the new one.
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Bumped when the record layout changes; each version has its own directory,
+# so partitions in an older layout are simply never read (and are removed by
+# the next full export).
+FORMAT_VERSION = 2
+
+_EPOCH = date(1970, 1, 1).toordinal()
+_MONTH_FILE = re.compile(r"^(\d{4})-(\d{2})\.npy$")
+
+# Dictionary-encoded fields.
+ENCODED = ("categoria", "metodo_pago", "usuario")
+
+# Columns of MonthPartitions.frame, named like the store's frames.
+COLUMNS = ("Fecha", "Monto", "UsuarioID", "Categoria", "MetodoPago", "Notas")
+
+# Notes are fixed-width fields sized to the month's longest one, so a single
+# pasted paragraph would widen every record of its month; longer notes are cut
+# here (the full text stays in the mirror and the sheet).
+NOTE_WIDTH = 200
+
+
+def _note(value) -> str:
+    note = "" if value is None else str(value)
+    return note if len(note) <= NOTE_WIDTH else note[:NOTE_WIDTH - 1] + "…"
+
+
+def _dtype(note_width: int) -> np.dtype:
+    return np.dtype([
+        ("row", "<i8"),
+        ("day", "<i4"),
+        ("monto", "<f8"),
+        ("categoria", "<i4"),
+        ("metodo_pago", "<i4"),
+        ("usuario", "<i4"),
+        ("notas", f"<U{max(note_width, 1)}"),
+    ])
+
+
+def _replace(path: str, write) -> None:
+    """Call write(file) on a temporary file next to path, then rename it over path."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class MonthPartitions:
+    """Columnar per-month copies of the mirror under ``root``.
+
+    Writers must not run concurrently for the same kind (the store writes
+    while holding its database lock). Readers need no lock: a dictionary is
+    always saved before the partitions that use its new codes, and is reloaded
+    whenever the file on disk changes.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        # kind -> (file identity, {field: values})
+        self._dictionaries: dict[str, tuple[tuple, dict[str, list[str]]]] = {}
+
+    def _dir(self, kind: str) -> str:
+        return os.path.join(self.root, kind, f"v{FORMAT_VERSION}")
+
+    def _path(self, kind: str, year: int, month: int) -> str:
+        return os.path.join(self._dir(kind), f"{year:04d}-{month:02d}.npy")
+
+    def exists(self, kind: str) -> bool:
+        return os.path.isdir(self._dir(kind))
+
+    def months(self, kind: str) -> list[tuple[int, int]]:
+        """(year, month) of every partition of kind, oldest first."""
+        if not self.exists(kind):
+            return []
+        found = (_MONTH_FILE.match(name) for name in os.listdir(self._dir(kind)))
+        return sorted((int(m.group(1)), int(m.group(2))) for m in found if m)
+
+    # ── writing ─────────────────────────────────────────────────────
+
+    def write(self, kind: str, year: int, month: int, rows: list[tuple]) -> None:
+        """Replace the partition of one month with rows of (row_number,
+        fecha 'YYYY-MM-DD', usuario_id, monto, categoria, metodo_pago, notas).
+        No rows removes the partition."""
+        os.makedirs(self._dir(kind), exist_ok=True)
+        path = self._path(kind, year, month)
+        if not rows:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        notes = [_note(r[6]) for r in rows]
+        array = np.empty(len(rows), dtype=_dtype(max(map(len, notes))))
+        array["row"] = [r[0] for r in rows]
+        array["day"] = [date.fromisoformat(r[1]).toordinal() - _EPOCH for r in rows]
+        array["monto"] = [r[3] for r in rows]
+        array["categoria"], array["metodo_pago"], array["usuario"] = self._encode(kind, {
+            "categoria": [r[4] for r in rows],
+            "metodo_pago": [r[5] for r in rows],
+            "usuario": [r[2] for r in rows],
+        })
+        array["notas"] = notes
+        _replace(path, lambda f: np.save(f, array, allow_pickle=False))
+
+    def write_all(self, kind: str, rows_by_month: dict[tuple[int, int], list[tuple]]) -> None:
+        """Replace every partition of kind: write the months given, drop the
+        rest, and any left in an older layout."""
+        os.makedirs(self._dir(kind), exist_ok=True)
+        for name in os.listdir(os.path.join(self.root, kind)):
+            if name != f"v{FORMAT_VERSION}":
+                shutil.rmtree(os.path.join(self.root, kind, name), ignore_errors=True)
+        for (year, month), rows in rows_by_month.items():
+            self.write(kind, year, month, rows)
+        for year, month in set(self.months(kind)) - set(rows_by_month):
+            self.write(kind, year, month, [])
+
+    def _encode(self, kind: str, columns: dict[str, list]) -> list[list[int]]:
+        """Codes of the values of each encoded field, extending (and saving)
+        the dictionary with values it hasn't seen."""
+        entries = {field: list(values) for field, values in self._dictionary(kind).items()}
+        encoded = []
+        for field, values in columns.items():
+            codes = {value: code for code, value in enumerate(entries[field])}
+            column = []
+            for value in values:
+                value = "" if value is None else str(value)
+                if value not in codes:
+                    codes[value] = len(entries[field])
+                    entries[field].append(value)
+                column.append(codes[value])
+            encoded.append(column)
+        if entries != self._dictionary(kind):
+            data = json.dumps(entries, ensure_ascii=False).encode()
+            _replace(os.path.join(self._dir(kind), "dictionary.json"), lambda f: f.write(data))
+        return encoded
+
+    def _dictionary(self, kind: str) -> dict[str, list[str]]:
+        """The kind's dictionary as on disk now (cached until the file changes)."""
+        path = os.path.join(self._dir(kind), "dictionary.json")
+        try:
+            stat = os.stat(path)
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            identity = None
+        with self._lock:
+            cached = self._dictionaries.get(kind)
+            if cached is not None and cached[0] == identity:
+                return cached[1]
+            loaded = {}
+            if identity is not None:
+                with open(path, encoding="utf-8") as f:
+                    loaded = json.load(f)
+            dictionary = {field: loaded.get(field, []) for field in ENCODED}
+            self._dictionaries[kind] = (identity, dictionary)
+            return dictionary
+
+    # ── reading ─────────────────────────────────────────────────────
+
+    def read(self, kind: str, year: int, month: int) -> np.ndarray | None:
+        """The memory-mapped partition of one month, None when there is none."""
+        try:
+            return np.load(self._path(kind, year, month), mmap_mode="r", allow_pickle=False)
+        except FileNotFoundError:
+            return None
+
+    def frame(self, kind: str, year: int, month: int) -> pd.DataFrame:
+        """One month with the columns in COLUMNS: Fecha as datetime64[ns],
+        Monto as float64, Notas as strings and the encoded columns as
+        Categoricals over the kind's whole dictionary."""
+        array = self.read(kind, year, month)
+        if array is None:
+            array = np.empty(0, dtype=_dtype(1))
+        # after the partition: a dictionary is never older than what uses it
+        dictionary = self._dictionary(kind)
+
+        def decode(field):
+            return pd.Categorical.from_codes(array[field], categories=dictionary[field])
+
+        return pd.DataFrame({
+            "Fecha": array["day"].astype("datetime64[D]").astype("datetime64[ns]"),
+            "Monto": array["monto"],
+            "UsuarioID": decode("usuario"),
+            "Categoria": decode("categoria"),
+            "MetodoPago": decode("metodo_pago"),
+            "Notas": pd.Series(array["notas"], dtype="string"),
+        })
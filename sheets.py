@@ -0,0 +1,550 @@
+"""Process-wide Google Sheets access: one authorized client, cached handles,
+paced and retried requests, and batched appends."""
+
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import requests
+from gspread.exceptions import APIError
+from google.auth.transport.requests import Request
+
+# Worksheet/Spreadsheet methods that count against the write quota; any other
+# call is a read.
+WRITE_METHODS = frozenset({
+    "append_row", "append_rows", "insert_row", "insert_rows", "update", "update_cell",
+    "update_cells", "batch_update", "batch_clear", "clear", "delete_rows", "delete_columns",
+    "format", "add_rows", "add_cols", "resize", "values_append", "values_update",
+    "values_batch_update", "values_clear",
+})
+
+
+def _credentials_of(client):
+    """The google-auth credentials behind a gspread client, or None for stand-ins."""
+    http_client = getattr(client, "http_client", None)
+    creds = getattr(http_client, "auth", None)
+    if creds is None:
+        creds = getattr(getattr(http_client, "session", None), "credentials", None)
+    return creds
+
+
+def _status_of(error: Exception) -> int | None:
+    """HTTP status of a failed gspread request, None for anything else."""
+    if isinstance(error, APIError):
+        return getattr(error, "code", None) or getattr(error.response, "status_code", None)
+    return None
+
+
+def is_server_error(error: Exception) -> bool:
+    status = _status_of(error)
+    return status is not None and status >= 500
+
+
+def is_connection_error(error: Exception) -> bool:
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class RequestScheduler:
+    """Every Sheets API request of the process, paced and retried.
+
+    Reads and writes each draw from a token bucket sized to their per-minute
+    quota: ``burst`` requests may go at once and the rest are spaced out, so a
+    burst is slowed down instead of answered with 429s. At most
+    ``max_in_flight`` requests run at a time, and a waiting write takes the
+    next free slot ahead of any read.
+
+    A 429 is retried up to ``max_retries`` times with exponential backoff and
+    jitter (or the Retry-After the API sent), and pauses every request of the
+    process until then. 5xx answers, dropped connections and timeouts are
+    retried for reads only: a write that failed with one may still have been
+    applied, so callers that can check decide (see SheetWriter).
+    """
+
+    def __init__(self, reads_per_minute: int = 60, writes_per_minute: int = 60,
+                 burst: int = 10, max_in_flight: int = 4, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 32.0):
+        quotas = {"read": reads_per_minute, "write": writes_per_minute}
+        if min(quotas.values()) < 1 or max_in_flight < 1:
+            raise ValueError("quotas and max_in_flight must be at least 1")
+        self.quotas = quotas
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # A full bucket plus a minute of refill must stay inside the quota.
+        self._capacity = {kind: max(1, min(burst, q // 2)) for kind, q in quotas.items()}
+        self._rate = {kind: (q - self._capacity[kind]) / 60 or q / 60 for kind, q in quotas.items()}
+        self._tokens = dict(self._capacity)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._waiting_writes = 0
+        self._cond = threading.Condition()
+        self._recent: dict[str, deque[float]] = {"read": deque(), "write": deque()}
+        self._counters = {
+            f"{kind}_{name}": 0
+            for kind in quotas
+            for name in ("requests", "retries", "throttled", "failed")
+        }
+        self._counters["wait_ms"] = 0
+
+    def call(self, kind: str, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) as one request of kind "read" or "write"."""
+        attempt = 0
+        while True:
+            self._acquire(kind)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(kind, e, attempt)
+                if delay is None:
+                    with self._cond:
+                        self._counters[f"{kind}_failed"] += 1
+                    raise
+                error = e
+            finally:
+                self._release()
+            attempt += 1
+            with self._cond:
+                self._counters[f"{kind}_retries"] += 1
+                if _status_of(error) == 429:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            print(f"[Sheets] {kind} failed ({error}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        """Counters plus requests sent in the last minute against each quota."""
+        with self._cond:
+            now = time.monotonic()
+            usage = {}
+            for kind, sent in self._recent.items():
+                while sent and now - sent[0] > 60:
+                    sent.popleft()
+                usage[f"{kind}_last_minute"] = len(sent)
+                usage[f"{kind}_quota"] = self.quotas[kind]
+            return {**self._counters, **usage, "in_flight": self._in_flight}
+
+    def reset(self) -> None:
+        """Full buckets, no pause, and zeroed counters."""
+        with self._cond:
+            self._tokens = dict(self._capacity)
+            self._refilled_at = time.monotonic()
+            self._paused_until = 0.0
+            for sent in self._recent.values():
+                sent.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+            self._cond.notify_all()
+
+    def _acquire(self, kind: str) -> None:
+        started = time.monotonic()
+        throttled = False
+        with self._cond:
+            if kind == "write":
+                self._waiting_writes += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._paused_until - now
+                    if wait <= 0 and self._tokens[kind] < 1:
+                        wait = (1 - self._tokens[kind]) / self._rate[kind]
+                    blocked = self._in_flight >= self.max_in_flight or (
+                        kind == "read" and self._waiting_writes
+                    )
+                    if wait <= 0 and not blocked:
+                        break
+                    throttled = True
+                    self._cond.wait(wait if wait > 0 else None)
+                self._tokens[kind] -= 1
+                self._in_flight += 1
+                self._recent[kind].append(now)
+                self._counters[f"{kind}_requests"] += 1
+                if throttled:
+                    self._counters[f"{kind}_throttled"] += 1
+                    self._counters["wait_ms"] += int((now - started) * 1000)
+            finally:
+                if kind == "write":
+                    self._waiting_writes -= 1
+                    self._cond.notify_all()
+
+    def _release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        for kind, capacity in self._capacity.items():
+            self._tokens[kind] = min(capacity, self._tokens[kind] + elapsed * self._rate[kind])
+
+    def _retry_delay(self, kind: str, error: Exception, attempt: int) -> float | None:
+        """Seconds to wait before retrying, None when error is not worth a retry."""
+        if attempt >= self.max_retries:
+            return None
+        status = _status_of(error)
+        transient = status == 429
+        if kind == "read" and (is_server_error(error) or is_connection_error(error)):
+            transient = True
+        if not transient:
+            return None
+        retry_after = None
+        if isinstance(error, APIError):
+            retry_after = getattr(error.response, "headers", {}).get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+class _Scheduled:
+    """A gspread Worksheet or Spreadsheet whose API calls go through a
+    RequestScheduler."""
+
+    def __init__(self, handle, scheduler: RequestScheduler):
+        self._handle = handle
+        self._scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self._handle, name)
+        if not callable(attr):
+            return attr
+        kind = "write" if name in WRITE_METHODS else "read"
+
+        def scheduled(*args, **kwargs):
+            return self._scheduler.call(kind, attr, *args, **kwargs)
+
+        return scheduled
+
+
+class SheetsPool:
+    """Keep one authorized gspread client alive for the whole process.
+
+    ``connect`` builds the client (reading the service-account file and
+    authorizing it). The pool calls it once, reuses the client's HTTP session
+    for every later request, refreshes the access token ``refresh_margin``
+    seconds before it expires, and caches Spreadsheet/Worksheet handles per
+    sheet id so ``open_by_key`` and ``worksheet`` metadata lookups only happen
+    the first time.
+
+    With a ``scheduler``, those lookups and every call on the Spreadsheet
+    and Worksheet handles it returns are paced and retried by it.
+
+    Connecting, token refreshes and lookups run outside the pool's lock, so a
+    slow one never holds up threads whose handles are cached. Threads racing
+    on the same first lookup may both make it; the first handle stored wins.
+    """
+
+    def __init__(self, connect, refresh_margin: float = 300.0,
+                 scheduler: RequestScheduler | None = None):
+        self._connect = connect
+        self.refresh_margin = refresh_margin
+        self.scheduler = scheduler
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._client = None
+        self._spreadsheets: dict[str, object] = {}
+        self._worksheets: dict[tuple[str, str], object] = {}
+        # One transport for token refreshes, so refreshing reuses its connection.
+        self._refresh_request = None
+        self._counters = {
+            "client_hits": 0,
+            "client_misses": 0,
+            "spreadsheet_hits": 0,
+            "spreadsheet_misses": 0,
+            "worksheet_hits": 0,
+            "worksheet_misses": 0,
+            "token_refreshes": 0,
+        }
+
+    def client(self):
+        """The shared gspread client, with a token that is valid for a while longer."""
+        with self._lock:
+            client = self._client
+            self._counters["client_hits" if client is not None else "client_misses"] += 1
+        if client is None:
+            # connect outside the lock; if another thread won the race, use its client
+            connected = self._connect()
+            with self._lock:
+                if self._client is None:
+                    self._client = connected
+                client = self._client
+        self._refresh_if_expiring(client)
+        return client
+
+    def spreadsheet(self, sheet_id: str):
+        """Cached ``Spreadsheet`` handle for sheet_id."""
+        client = self.client()
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(sheet_id)
+            self._counters["spreadsheet_hits" if spreadsheet is not None else "spreadsheet_misses"] += 1
+        if spreadsheet is None:
+            opened = self._scheduled(self._read(client.open_by_key, sheet_id))
+            with self._lock:
+                spreadsheet = self._spreadsheets.setdefault(sheet_id, opened)
+        return spreadsheet
+
+    def worksheet(self, sheet_id: str, name: str):
+        """Cached ``Worksheet`` handle for the tab called name inside sheet_id."""
+        spreadsheet = self.spreadsheet(sheet_id)
+        key = (sheet_id, name)
+        with self._lock:
+            worksheet = self._worksheets.get(key)
+            self._counters["worksheet_hits" if worksheet is not None else "worksheet_misses"] += 1
+        if worksheet is None:
+            opened = self._scheduled(spreadsheet.worksheet(name))
+            with self._lock:
+                worksheet = self._worksheets.setdefault(key, opened)
+        return worksheet
+
+    def invalidate(self) -> None:
+        """Forget cached Spreadsheet/Worksheet handles but keep the client.
+
+        Called after a failed request, in case a tab was renamed or removed."""
+        with self._lock:
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+
+    def reset(self) -> None:
+        """Drop the client, every cached handle and the counters."""
+        with self._lock:
+            self._client = None
+            self.invalidate()
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def stats(self) -> dict[str, int]:
+        """Snapshot of the hit/miss counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def _read(self, fn, *args):
+        if self.scheduler is None:
+            return fn(*args)
+        return self.scheduler.call("read", fn, *args)
+
+    def _scheduled(self, handle):
+        return handle if self.scheduler is None else _Scheduled(handle, self.scheduler)
+
+    def _needs_refresh(self, creds) -> bool:
+        if not getattr(creds, "token", None):
+            return True
+        expiry = getattr(creds, "expiry", None)
+        if expiry is None:
+            return False  # token that never expires
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds() <= self.refresh_margin
+
+    def _refresh_if_expiring(self, client) -> None:
+        creds = _credentials_of(client)
+        if creds is None or not hasattr(creds, "refresh") or not self._needs_refresh(creds):
+            return
+        # one refresh at a time, without holding the pool's lock; a thread
+        # that waited here finds the token fresh and skips it
+        with self._refresh_lock:
+            if not self._needs_refresh(creds):
+                return
+            if self._refresh_request is None:
+                self._refresh_request = Request()
+            creds.refresh(self._refresh_request)
+        with self._lock:
+            self._counters["token_refreshes"] += 1
+
+
+class _Batch:
+    """Rows waiting for one append_rows call to one worksheet."""
+
+    def __init__(self):
+        self.rows: list[list] = []
+        self.journal_ids: list[int] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.ranges: list[str | None] = []
+        self.error: Exception | None = None
+
+
+class SheetWriter:
+    """Write-behind buffer that turns concurrent appends into one request.
+
+    ``append(name, rows)`` blocks until its rows are in the sheet. The first
+    caller for a worksheet waits up to ``window`` seconds (less if
+    ``max_rows`` pile up) for others, then sends every collected row with a
+    single ``append_rows``; each caller gets back the ranges of its own rows,
+    or the error the batch failed with.
+
+    Rows are written to a sqlite journal before they are buffered and
+    removed once the batch is answered, so rows buffered when the process
+    dies are still there on the next start; ``replay`` appends the ones the
+    sheet doesn't have yet (matched by the ID in their first column).
+    Several processes may share one journal file; replay only looks at rows
+    journaled before this writer was created.
+    """
+
+    def __init__(self, open_worksheet, journal_path: str, window: float = 0.05,
+                 max_rows: int = 100):
+        self._open_worksheet = open_worksheet
+        self.journal_path = journal_path
+        self.window = window
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._collecting: dict[str, _Batch] = {}
+        self._con: sqlite3.Connection | None = None
+        # Rows journaled after this are another live writer's (workers share
+        # the file), never leftovers for replay to pick up.
+        self._started_at = time.time()
+        self._counters = {"appends": 0, "rows": 0, "requests": 0, "failed_requests": 0}
+
+    def append(self, name: str, rows: list[list]) -> list[str | None]:
+        """Append rows to worksheet name; their A1 ranges, in order (None when
+        the response didn't say where they landed)."""
+        journal_ids = self._journal(name, rows)
+        with self._lock:
+            batch = self._collecting.get(name)
+            leader = batch is None
+            if leader:
+                batch = self._collecting[name] = _Batch()
+            first = len(batch.rows)
+            batch.rows.extend(rows)
+            batch.journal_ids.extend(journal_ids)
+            self._counters["appends"] += 1
+            self._counters["rows"] += len(rows)
+            if len(batch.rows) >= self.max_rows:
+                del self._collecting[name]  # closed: later rows start a new batch
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._collecting.get(name) is batch:
+                    del self._collecting[name]
+            self._flush(name, batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.ranges[first:first + len(rows)]
+
+    def _flush(self, name: str, batch: _Batch) -> None:
+        try:
+            worksheet = self._open_worksheet(name)
+            try:
+                response = worksheet.append_rows(batch.rows, value_input_option="USER_ENTERED")
+            except Exception as e:
+                if not (is_server_error(e) or is_connection_error(e)):
+                    raise
+                # A 5xx, timeout or dropped connection may come after the rows
+                # were written: send only the ones the sheet doesn't have.
+                # Where they landed is unknown.
+                _append_missing(worksheet, batch.rows)
+                response = None
+            batch.ranges = _row_ranges(name, response, len(batch.rows))
+            with self._lock:
+                self._counters["requests"] += 1
+        except Exception as e:
+            # The caller reports the failure, so the rows must not come back
+            # from the journal later.
+            batch.error = e
+            with self._lock:
+                self._counters["failed_requests"] += 1
+        finally:
+            self._forget(batch.journal_ids)
+            batch.done.set()
+
+    def replay(self) -> int:
+        """Append journaled rows left over from a crash; return how many were
+        missing from the sheet."""
+        with self._lock:
+            entries = self._connection().execute(
+                "SELECT id, worksheet, row FROM journal WHERE created_at < ? ORDER BY id",
+                (self._started_at,),
+            ).fetchall()
+        by_sheet: dict[str, list[tuple[int, list]]] = {}
+        for entry_id, name, row in entries:
+            by_sheet.setdefault(name, []).append((entry_id, json.loads(row)))
+        replayed = 0
+        for name, pending in by_sheet.items():
+            worksheet = self._open_worksheet(name)
+            replayed += _append_missing(worksheet, [row for _, row in pending])
+            self._forget([entry_id for entry_id, _ in pending])
+        return replayed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            con = sqlite3.connect(self.journal_path, check_same_thread=False, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            # the journal exists to survive crashes: fsync every commit
+            con.execute("PRAGMA synchronous=FULL")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS journal (
+                    id         INTEGER PRIMARY KEY,
+                    worksheet  TEXT NOT NULL,
+                    row        TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            con.commit()
+            self._con = con
+        return self._con
+
+    def _journal(self, name: str, rows: list[list]) -> list[int]:
+        now = time.time()
+        with self._lock:
+            con = self._connection()
+            with con:
+                return [
+                    con.execute(
+                        "INSERT INTO journal (worksheet, row, created_at) VALUES (?, ?, ?)",
+                        (name, json.dumps(row, ensure_ascii=False), now),
+                    ).lastrowid
+                    for row in rows
+                ]
+
+    def _forget(self, journal_ids: list[int]) -> None:
+        with self._lock:
+            con = self._connection()
+            with con:
+                con.executemany("DELETE FROM journal WHERE id = ?", [(i,) for i in journal_ids])
+
+
+def _append_missing(worksheet, rows: list[list]) -> int:
+    """Append the rows whose ID (first column) the worksheet doesn't have yet."""
+    present = set(worksheet.col_values(1))
+    missing = [row for row in rows if str(row[0]) not in present]
+    if missing:
+        worksheet.append_rows(missing, value_input_option="USER_ENTERED")
+    return len(missing)
+
+
+def _row_ranges(name: str, response, count: int) -> list[str | None]:
+    """Split an append response's range ('Ventas!A10:I12') into one per row."""
+    updated_range = None
+    if isinstance(response, dict):
+        updated_range = response.get("updates", {}).get("updatedRange")
+    match = re.search(r"!([A-Z]+)(\d+)(?::([A-Z]+)\d+)?", updated_range or "")
+    if not match:
+        return [None] * count
+    first_column, first_row, last_column = match.groups()
+    last_column = last_column or first_column
+    return [
+        f"{name}!{first_column}{int(first_row) + i}:{last_column}{int(first_row) + i}"
+        for i in range(count)
+    ]
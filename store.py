@@ -0,0 +1,679 @@
+"""Local SQLite mirror of the Ventas and EntradaMaterial sheets.
+
+Reports read transactions from here instead of downloading whole worksheets.
+The mirror pulls only the rows appended since its last sync, receives the rows
+add_expense/add_income write, and does a full resync every so often (or on
+demand) to pick up edits made by hand in the spreadsheet. Syncs download only
+the columns the mirror keeps, one range per column, and read every stale
+sheet in one values_batch_get.
+
+It also keeps running income/expense totals per (year, month, category,
+payment method, user), moved in place by every row it takes in, so a balance
+or a breakdown over any span of months reads a handful of aggregate rows per
+month instead of the transactions. Each full resync recomputes them from the
+rows and reports any drift.
+
+The rows are also kept as month partitions (see partitions.py),
+memory-mapped columnar copies that let ``latest`` read only the newest months
+instead of the whole history. A full resync rewrites them all; pulls and
+write-throughs only mark the months they touched as stale, and the next read
+exports each stale month once, however many rows landed in it meanwhile.
+Month totals and breakdowns don't read partitions: the running totals answer
+them from a few aggregate rows, fewer than any month's transactions.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import NamedTuple
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from partitions import COLUMNS as PARTITION_COLUMNS
+from partitions import MonthPartitions
+
+STORE_PATH = "transactions.db"
+
+# Bumped when the tables change. The mirror only holds copies of the sheets,
+# so an older file is dropped and rebuilt by the next sync instead of migrated.
+SCHEMA_VERSION = 3
+
+
+class SheetSpec(NamedTuple):
+    """Where one kind of transaction lives and what its sheet columns are called."""
+
+    worksheet: str
+    id_column: str
+    date_column: str
+    notes_column: str
+    payment_column: str
+
+
+SHEETS = {
+    "expense": SheetSpec(
+        "EntradaMaterial", "EntradaMaterialID", "EntradaMaterialFecha", "Notas", "MetodoPago"
+    ),
+    "income": SheetSpec("Ventas", "VentaID", "VentaFecha", "VentaNotas", "VentaMetodoPago"),
+}
+
+# Frame column -> sqlite column. Frames use the same names for both sheets so
+# reports don't care which worksheet a row came from.
+_SQL_COLUMNS = {
+    "ID": "tx_id",
+    "Fecha": "fecha",
+    "UsuarioID": "usuario_id",
+    "Monto": "monto",
+    "Categoria": "categoria",
+    "Notas": "notas",
+    "MetodoPago": "metodo_pago",
+}
+
+# What the running totals can be grouped by (see aggregate).
+AGGREGATE_KEYS = ("year", "month", "categoria", "metodo_pago", "usuario_id")
+
+# Without these the mirror can't serve any report.
+_REQUIRED_COLUMNS = ("Fecha", "Monto", "UsuarioID")
+
+
+class Drift(NamedTuple):
+    """A running monthly total that disagreed with a recomputation from the rows."""
+
+    kind: str
+    year: int
+    month: int
+    usuario_id: str
+    running: float
+    actual: float
+
+
+def sheet_column(kind: str, column: str) -> str:
+    """Name of a frame column in the worksheet that holds this kind of transaction."""
+    spec = SHEETS[kind]
+    return {
+        "ID": spec.id_column,
+        "Fecha": spec.date_column,
+        "Notas": spec.notes_column,
+        "MetodoPago": spec.payment_column,
+    }.get(column, column)
+
+
+def _parse_date(value) -> str | None:
+    """'15/05/2026' -> '2026-05-15'; None for anything that isn't a dd/mm/YYYY date."""
+    try:
+        return datetime.strptime(str(value).strip(), "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _parse_amount(value) -> float | None:
+    """A number as read from the sheet; text keeps working the way
+    gspread's numericise reads it ('1,500' -> 1500.0)."""
+    if isinstance(value, str):
+        value = value.replace(",", "")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _column_letter(index: int) -> str:
+    """0 -> 'A', 26 -> 'AA'."""
+    return re.sub(r"\d", "", rowcol_to_a1(1, index + 1))
+
+
+def _projection(kind: str, header: list[str], first_row: int):
+    """The mirrored columns of a sheet with this header, and one A1 range per
+    column covering the rows from first_row down.
+
+    Returns (names, ranges): the sheet names of those columns and their ranges."""
+    wanted = {sheet_column(kind, c) for c in _SQL_COLUMNS}
+    projection = [(name, _column_letter(i)) for i, name in enumerate(header) if name in wanted]
+    return (
+        [name for name, _ in projection],
+        [f"{letter}{first_row}:{letter}" for _, letter in projection],
+    )
+
+
+def _rows_from_columns(columns: list[list]) -> list[list]:
+    """Columns as returned by a COLUMNS-major read (each cut at its last
+    non-empty cell) back into equal-length rows."""
+    height = max(map(len, columns), default=0)
+    return [
+        [column[r] if r < len(column) else "" for column in columns] for r in range(height)
+    ]
+
+
+def _check_header(kind: str, header: list[str]) -> None:
+    missing = [
+        sheet_column(kind, c) for c in _REQUIRED_COLUMNS if sheet_column(kind, c) not in header
+    ]
+    if missing:
+        raise ValueError(
+            f"Faltan columnas en la hoja {SHEETS[kind].worksheet}: {', '.join(sorted(missing))}"
+        )
+
+
+class _SpreadsheetReader:
+    """Reads any number of sheets with one values_batch_get per step, ranges
+    qualified with their worksheet's name."""
+
+    def __init__(self, open_spreadsheet):
+        self._open_spreadsheet = open_spreadsheet
+
+    def headers(self, kinds: list[str]) -> dict[str, list[str]]:
+        first_rows = self._batch_get({kind: ["1:1"] for kind in kinds}, "ROWS")
+        return {kind: values[0][0] if values[0] else [] for kind, values in first_rows.items()}
+
+    def columns(self, ranges: dict[str, list[str]]) -> dict[str, list[list]]:
+        columns = self._batch_get(ranges, "COLUMNS")
+        return {
+            kind: [list(v[0]) if v else [] for v in values] for kind, values in columns.items()
+        }
+
+    def _batch_get(self, ranges: dict[str, list[str]], dimension: str) -> dict[str, list]:
+        """The values of every range, grouped by kind, in one request."""
+        flat = [
+            (kind, f"'{SHEETS[kind].worksheet}'!{range_name}")
+            for kind, kind_ranges in ranges.items()
+            for range_name in kind_ranges
+        ]
+        response = self._open_spreadsheet().values_batch_get(
+            [range_name for _, range_name in flat],
+            params={
+                "majorDimension": dimension,
+                # amounts as numbers, not as the sheet displays them ("1,500");
+                # dates still as the dd/mm/YYYY text _parse_date expects
+                "valueRenderOption": "UNFORMATTED_VALUE",
+                "dateTimeRenderOption": "FORMATTED_STRING",
+            },
+        )
+        result = {kind: [] for kind in ranges}
+        # valueRanges come back in the order they were asked for
+        for (kind, _), value_range in zip(flat, response.get("valueRanges", [])):
+            result[kind].append(value_range.get("values", []))
+        return result
+
+
+def _month_of(fecha: str | None) -> tuple[int, int] | None:
+    """'2026-05-15' -> (2026, 5)."""
+    return (int(fecha[:4]), int(fecha[5:7])) if fecha else None
+
+
+def _updated_row(updated_range: str | None) -> int | None:
+    """Row number out of an append response range like 'Ventas!A12:I12'."""
+    if not updated_range:
+        return None
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+
+class TransactionStore:
+    """Read-through cache of both transaction sheets.
+
+    A sync is skipped while the mirror is younger than ``max_staleness``
+    seconds. Otherwise it pulls only the rows below the last one it has, unless
+    ``full_resync_interval`` elapsed (or a full resync is forced), in which case
+    it reloads the whole sheet. The connection is opened lazily and shared by
+    threads, so every access goes through one lock; syncs read the sheets
+    without holding it. Several worker processes
+    may share the file: writes take the database lock up front (BEGIN
+    IMMEDIATE) and are idempotent per sheet row, so two workers pulling the
+    same rows don't count them twice.
+
+    The month partitions live in ``partitions_path`` (by default next to the
+    database). Which of them are stale is recorded in the database, in the
+    same transaction as the rows, so every worker sees it.
+    """
+
+    def __init__(self, path: str, max_staleness: float = 60.0,
+                 full_resync_interval: float = 3600.0, partitions_path: str | None = None):
+        self.path = path
+        self.partitions = MonthPartitions(partitions_path or f"{path}.partitions")
+        self.max_staleness = max_staleness
+        self.full_resync_interval = full_resync_interval
+        self._lock = threading.RLock()
+        self._con: sqlite3.Connection | None = None
+
+    # ── connection ──────────────────────────────────────────────────
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            con = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            with con:
+                con.execute("BEGIN IMMEDIATE")
+                self._create_schema(con)
+            self._con = con
+        return self._con
+
+    @staticmethod
+    def _create_schema(con: sqlite3.Connection) -> None:
+        if con.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            for table in ("transactions", "monthly_totals", "sync_state", "stale_partitions"):
+                con.execute(f"DROP TABLE IF EXISTS {table}")
+            con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                kind        TEXT NOT NULL,
+                row_number  INTEGER NOT NULL,
+                tx_id       TEXT,
+                fecha       TEXT,
+                usuario_id  TEXT,
+                monto       REAL,
+                categoria   TEXT,
+                notas       TEXT,
+                metodo_pago TEXT,
+                PRIMARY KEY (kind, row_number)
+            )
+        """)
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_fecha ON transactions (kind, fecha)"
+        )
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_totals (
+                kind        TEXT NOT NULL,
+                year        INTEGER NOT NULL,
+                month       INTEGER NOT NULL,
+                categoria   TEXT NOT NULL,
+                metodo_pago TEXT NOT NULL,
+                usuario_id  TEXT NOT NULL,
+                total       REAL NOT NULL,
+                count       INTEGER NOT NULL,
+                PRIMARY KEY (kind, year, month, categoria, metodo_pago, usuario_id)
+            )
+        """)
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                kind           TEXT PRIMARY KEY,
+                header         TEXT NOT NULL,
+                row_count      INTEGER NOT NULL,
+                synced_at      REAL NOT NULL,
+                full_synced_at REAL NOT NULL
+            )
+        """)
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS stale_partitions (
+                kind  TEXT NOT NULL,
+                year  INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                PRIMARY KEY (kind, year, month)
+            )
+        """)
+
+    @contextmanager
+    def _write(self):
+        """A write transaction that holds the database lock from its first
+        statement, reads included, so other processes can't interleave."""
+        con = self._connection()
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            yield con
+
+    def close(self) -> None:
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+    def _state(self, kind: str) -> tuple[list[str], int, float, float] | None:
+        row = self._connection().execute(
+            "SELECT header, row_count, synced_at, full_synced_at FROM sync_state WHERE kind = ?",
+            (kind,),
+        ).fetchone()
+        if row is None:
+            return None
+        header, row_count, synced_at, full_synced_at = row
+        return json.loads(header), row_count, synced_at, full_synced_at
+
+    # ── syncing ─────────────────────────────────────────────────────
+
+    def has_synced(self, kind: str) -> bool:
+        with self._lock:
+            return self._state(kind) is not None
+
+    def refresh_all(self, open_spreadsheet, kinds=tuple(SHEETS),
+                    force_full: bool = False) -> list[Drift]:
+        """Bring the mirror of each sheet in kinds up to date if it is stale.
+
+        The stale sheets are read together: one values_batch_get for the
+        headers when a full sync needs them, and one for the columns, however
+        many sheets that covers. open_spreadsheet is only called when a sheet
+        actually has to be read, and nothing is written unless every sheet
+        read and passed the header check. Returns the running-total drift
+        found by the full resyncs among them (empty otherwise)."""
+        reader = _SpreadsheetReader(open_spreadsheet)
+        with self._lock:
+            now = time.time()
+            pulls, fulls = {}, []
+            for kind in kinds:
+                state = self._state(kind)
+                if state is None or force_full or not state[0]:
+                    # no header to anchor column positions on yet: reload
+                    fulls.append(kind)
+                elif now - state[3] >= self.full_resync_interval:
+                    fulls.append(kind)
+                elif now - state[2] >= self.max_staleness:
+                    pulls[kind] = state
+        if not pulls and not fulls:
+            return []
+
+        # The sheets are read without the lock, so reports keep reading the
+        # mirror meanwhile. Writes are idempotent per sheet row, so a sync
+        # that raced this one (another thread or worker) is harmless.
+        headers = reader.headers(fulls) if fulls else {}
+        for kind, state in pulls.items():
+            headers[kind] = state[0]
+        first_rows = {kind: 2 for kind in fulls}
+        first_rows.update({kind: state[1] + 2 for kind, state in pulls.items()})
+        names, ranges = {}, {}
+        for kind, first_row in first_rows.items():
+            names[kind], ranges[kind] = _projection(kind, headers[kind], first_row)
+        read = {kind: r for kind, r in ranges.items() if r}
+        columns = reader.columns(read) if read else {}
+        rows = {kind: _rows_from_columns(columns.get(kind, [])) for kind in first_rows}
+        for kind in fulls:
+            if rows[kind]:
+                _check_header(kind, headers[kind])
+
+        with self._lock:
+            drift = []
+            for kind in fulls:
+                drift += self._full_sync(kind, headers[kind], names[kind], rows[kind], now)
+            for kind, state in pulls.items():
+                self._pull_appended(kind, names[kind], rows[kind], state, now)
+            return drift
+
+    def _full_sync(self, kind: str, header: list[str], names: list[str], rows: list[list],
+                   now: float) -> list[Drift]:
+        with self._write() as con:
+            con.execute("DELETE FROM transactions WHERE kind = ?", (kind,))
+            self._insert(kind, names, rows, first_row=2, track_totals=False)
+            con.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(header), len(rows), now, now),
+            )
+            self._export(kind)
+            return self._rebuild_totals(kind)
+
+    def _pull_appended(self, kind: str, names: list[str], rows: list[list], state,
+                       now: float) -> None:
+        _header, row_count, _synced_at, _full_synced_at = state
+        with self._write() as con:
+            months = self._insert(kind, names, rows, first_row=row_count + 2)
+            # MAX: another worker may have pulled further meanwhile
+            con.execute(
+                "UPDATE sync_state SET row_count = MAX(row_count, ?), synced_at = ? WHERE kind = ?",
+                (row_count + len(rows), now, kind),
+            )
+            self._mark_stale(kind, months)
+
+    def _insert(self, kind: str, header: list[str], rows: list[list], first_row: int,
+                track_totals: bool = True) -> set[tuple[int, int]]:
+        """Upsert sheet rows by row number.
+
+        With track_totals, the running totals are moved by the difference: a
+        row that replaces an already mirrored one (same row number, or a
+        provisional copy with the same ID) is subtracted first.
+
+        Returns the (year, month)s of the rows written and, with
+        track_totals, of the rows they replaced."""
+        con = self._connection()
+        positions = {name: i for i, name in enumerate(header)}
+
+        def cell(row, column):
+            i = positions.get(sheet_column(kind, column))
+            return row[i] if i is not None and i < len(row) else None
+
+        months = set()
+        for offset, row in enumerate(rows):
+            values = (
+                kind,
+                first_row + offset,
+                cell(row, "ID"),
+                _parse_date(cell(row, "Fecha")),
+                cell(row, "UsuarioID"),
+                _parse_amount(cell(row, "Monto")),
+                cell(row, "Categoria"),
+                cell(row, "Notas"),
+                cell(row, "MetodoPago"),
+            )
+            if track_totals:
+                replaced = con.execute(
+                    "SELECT row_number, fecha, usuario_id, monto, categoria, metodo_pago "
+                    "FROM transactions "
+                    "WHERE kind = ? AND (row_number = ? OR (row_number < 0 AND tx_id = ?))",
+                    (kind, values[1], values[2]),
+                ).fetchall()
+                for row_number, *old in replaced:
+                    months.add(_month_of(old[0]))
+                    self._add_to_totals(kind, *old, sign=-1)
+                    con.execute(
+                        "DELETE FROM transactions WHERE kind = ? AND row_number = ?",
+                        (kind, row_number),
+                    )
+                self._add_to_totals(kind, *values[3:7], values[8], sign=1)
+            con.execute(
+                "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values
+            )
+            months.add(_month_of(values[3]))
+        months.discard(None)
+        return months
+
+    def record(self, kind: str, record: dict, updated_range: str | None) -> None:
+        """Write-through for a row that was just appended to the sheet.
+
+        record maps sheet column names to the values written. When the append
+        response doesn't say which row it landed on, the row is kept under a
+        provisional (negative) row number and the mirror is marked stale; the
+        next pull replaces it with the real row, matched by ID."""
+        with self._lock, self._write() as con:
+            state = self._state(kind)
+            if state is None:
+                return  # the first read does a full sync, which includes it
+            header, row_count, _synced_at, _full = state
+            row_number = _updated_row(updated_range)
+            if row_number is None:
+                lowest = con.execute(
+                    "SELECT MIN(row_number) FROM transactions WHERE kind = ?", (kind,)
+                ).fetchone()[0]
+                row_number = min(lowest or 0, 0) - 1
+                con.execute("UPDATE sync_state SET synced_at = 0 WHERE kind = ?", (kind,))
+            row = [record.get(name) for name in header]
+            months = self._insert(kind, header, [row], row_number)
+            if row_number == row_count + 2:
+                con.execute(
+                    "UPDATE sync_state SET row_count = MAX(row_count, ?) WHERE kind = ?",
+                    (row_count + 1, kind),
+                )
+            self._mark_stale(kind, months)
+
+    # ── month partitions ────────────────────────────────────────────
+
+    def _mark_stale(self, kind: str, months: set[tuple[int, int]]) -> None:
+        """Leave the partitions of months to be rewritten by the next read."""
+        self._connection().executemany(
+            "INSERT OR IGNORE INTO stale_partitions VALUES (?, ?, ?)",
+            [(kind, year, month) for year, month in months],
+        )
+
+    def _export_stale(self, kinds: list[str]) -> None:
+        """Bring the partitions of kinds up to date: rebuild the kinds that
+        have none and rewrite the months marked stale. Call under the lock."""
+        con = self._connection()
+        missing = [kind for kind in kinds if not self.partitions.exists(kind)]
+        marks = ", ".join("?" * len(kinds))
+        query = f"SELECT kind, year, month FROM stale_partitions WHERE kind IN ({marks})"
+        if not missing and con.execute(query, kinds).fetchone() is None:
+            return
+        with self._write():
+            stale = {}
+            # again inside the transaction: another worker may have exported them
+            for kind, year, month in con.execute(query, kinds).fetchall():
+                stale.setdefault(kind, set()).add((year, month))
+            for kind in kinds:
+                if kind in missing:
+                    self._export(kind)  # a mirror synced before the partitions existed
+                elif kind in stale:
+                    self._export(kind, stale[kind])
+
+    def _export(self, kind: str, months: set[tuple[int, int]] | None = None) -> None:
+        """Rewrite the partitions of the given months from the mirrored rows,
+        or all of the kind's partitions when months is None, and clear their
+        stale marks. Call inside a write transaction, so other workers don't
+        export at the same time."""
+        query = (
+            "SELECT row_number, fecha, usuario_id, monto, categoria, metodo_pago, notas "
+            "FROM transactions "
+            "WHERE kind = ? AND fecha BETWEEN ? AND ? AND monto IS NOT NULL "
+            "ORDER BY row_number < 0, abs(row_number)"
+        )
+        con = self._connection()
+        if months is None:
+            by_month = {}
+            for row in con.execute(query, (kind, "0000", "9999")):
+                by_month.setdefault(_month_of(row[1]), []).append(row)
+            self.partitions.write_all(kind, by_month)
+            con.execute("DELETE FROM stale_partitions WHERE kind = ?", (kind,))
+            return
+        for year, month in sorted(months):
+            first = f"{year:04d}-{month:02d}-01"
+            rows = con.execute(query, (kind, first, f"{year:04d}-{month:02d}-31")).fetchall()
+            self.partitions.write(kind, year, month, rows)
+            con.execute(
+                "DELETE FROM stale_partitions WHERE kind = ? AND year = ? AND month = ?",
+                (kind, year, month),
+            )
+
+    def latest(self, kinds, user_ids: list[str], count: int) -> pd.DataFrame:
+        """The newest whole months of the given kinds that together hold at
+        least count rows of user_ids (every month when there aren't that many).
+
+        Read from the month partitions, so the cost follows the months
+        returned, not the length of the history. Rows come newest month
+        first; within a month by kind, in the order given, then in sheet
+        order. Columns are partitions.COLUMNS plus "kind"; rows without a
+        date or an amount are left out, as in the running totals."""
+        with self._lock:
+            kinds = [kind for kind in kinds if self._state(kind) is not None]
+            if kinds:
+                self._export_stale(kinds)
+            months = sorted({m for kind in kinds for m in self.partitions.months(kind)})
+        frames, found = [], 0
+        for year, month in reversed(months):
+            for kind in kinds:
+                df = self.partitions.frame(kind, year, month)
+                df = df[df["UsuarioID"].isin(user_ids)].assign(kind=kind)
+                frames.append(df)
+                found += len(df)
+            if found >= count:
+                break
+        if not frames:
+            return pd.DataFrame(columns=[*PARTITION_COLUMNS, "kind"])
+        return pd.concat(frames, ignore_index=True)
+
+    # ── running totals ──────────────────────────────────────────────
+
+    def _add_to_totals(self, kind: str, fecha: str | None, usuario_id, monto: float | None,
+                       categoria, metodo_pago, sign: int) -> None:
+        if fecha is None or monto is None:
+            return  # reports skip these rows too
+        year, month = int(fecha[:4]), int(fecha[5:7])
+        self._connection().execute(
+            """
+            INSERT INTO monthly_totals
+                (kind, year, month, categoria, metodo_pago, usuario_id, total, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (kind, year, month, categoria, metodo_pago, usuario_id) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + excluded.count
+            """,
+            (kind, year, month, categoria or "", metodo_pago or "", usuario_id or "",
+             sign * monto, sign),
+        )
+
+    def _month_user_totals(self, kind: str) -> dict[tuple, tuple[float, int]]:
+        return {
+            (year, month, usuario_id): (total, count)
+            for year, month, usuario_id, total, count in self._connection().execute(
+                "SELECT year, month, usuario_id, SUM(total), SUM(count) FROM monthly_totals "
+                "WHERE kind = ? GROUP BY year, month, usuario_id",
+                (kind,),
+            )
+        }
+
+    def _rebuild_totals(self, kind: str) -> list[Drift]:
+        """Recompute one kind's totals from the mirrored rows and report how far
+        the running totals had drifted from them, per month and user."""
+        con = self._connection()
+        running = self._month_user_totals(kind)
+        con.execute("DELETE FROM monthly_totals WHERE kind = ?", (kind,))
+        con.execute(
+            """
+            INSERT INTO monthly_totals
+                (kind, year, month, categoria, metodo_pago, usuario_id, total, count)
+            SELECT kind, CAST(substr(fecha, 1, 4) AS INTEGER), CAST(substr(fecha, 6, 2) AS INTEGER),
+                   COALESCE(categoria, ''), COALESCE(metodo_pago, ''), COALESCE(usuario_id, ''),
+                   SUM(monto), COUNT(*)
+            FROM transactions
+            WHERE kind = ? AND fecha IS NOT NULL AND monto IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5, 6
+            """,
+            (kind,),
+        )
+        actual = self._month_user_totals(kind)
+        drift = []
+        for key in sorted(set(running) | set(actual)):
+            running_total, running_count = running.get(key, (0.0, 0))
+            actual_total, actual_count = actual.get(key, (0.0, 0))
+            if running_count != actual_count or abs(running_total - actual_total) > 0.005:
+                drift.append(Drift(kind, *key, running_total, actual_total))
+        return drift
+
+    def aggregate(self, kind: str, user_ids: list[str] | None, first: tuple[int, int],
+                  last: tuple[int, int], by: tuple[str, ...] = ()) -> list[tuple]:
+        """Totals of one kind from month first to month last, both (year,
+        month) and inclusive, summed over user_ids (None: every user) and
+        grouped by the AGGREGATE_KEYS in by.
+
+        Returns one (*by values, total, count) tuple per group, ordered by the
+        group values. Reads only the running totals of those months."""
+        unknown = set(by) - set(AGGREGATE_KEYS)
+        if unknown:
+            raise ValueError(f"cannot group totals by {', '.join(sorted(unknown))}")
+        columns = "".join(f"{key}, " for key in by)
+        users = ""
+        if user_ids is not None:
+            users = f"AND usuario_id IN ({', '.join('?' * len(user_ids))}) "
+        group = f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {columns}SUM(total), SUM(count) FROM monthly_totals "
+                f"WHERE kind = ? AND year * 12 + month BETWEEN ? AND ? {users}{group}",
+                (kind, first[0] * 12 + first[1], last[0] * 12 + last[1], *(user_ids or ())),
+            ).fetchall()
+        return [
+            (*row[:-2], float(row[-2] or 0.0), int(row[-1] or 0))
+            for row in rows
+            if row[-1]  # no groups: SUM over nothing is one NULL row
+        ]
+
+    def incomplete_rows(self, kind: str, user_ids: list[str]) -> int:
+        """Mirrored rows of one kind and user_ids without a valid date or
+        amount, which every report leaves out."""
+        marks = ", ".join("?" * len(user_ids))
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM transactions "
+                f"WHERE kind = ? AND usuario_id IN ({marks}) AND (fecha IS NULL OR monto IS NULL)",
+                (kind, *user_ids),
+            ).fetchone()[0]
+
+    def month_total(self, kind: str, year: int, month: int, user_ids: list[str]) -> float:
+        """Running total of one kind for a month, summed over user_ids."""
+        totals = self.aggregate(kind, user_ids, (year, month), (year, month))
+        return totals[0][0] if totals else 0.0
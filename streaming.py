@@ -0,0 +1,152 @@
+"""Show an agent reply in Telegram while it is still being generated."""
+
+import asyncio
+import time
+
+from langchain_core.messages import AIMessageChunk
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter
+
+# Telegram shows "typing..." for about 5 seconds per chat action.
+TYPING_REFRESH_SECONDS = 4.0
+
+
+def _seconds(delay) -> float:
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version."""
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+def visible_reply(text: str) -> str:
+    """The part of a partial reply the user should see.
+
+    Mirrors what call_model does with the finished message: everything up to a
+    closing </think> is reasoning. While a <think> block is still open nothing
+    is shown yet.
+    """
+    if "</think>" in text:
+        return text.split("</think>")[-1].strip()
+    if text.lstrip().startswith("<think>"):
+        return ""
+    return text.strip()
+
+
+class ReplyStreamer:
+    """One reply message for a turn, posted with the first streamed text and
+    edited as more arrives.
+
+    Edits are at most one per ``min_interval`` seconds (Telegram throttles
+    bots that edit faster) and a RetryAfter pushes the next one back. Until
+    there is text to show, a "typing" chat action is repeated so the chat
+    never looks idle. ``finish`` writes the final text, editing the streamed
+    message or sending a new one when nothing was streamed.
+    """
+
+    def __init__(self, bot, chat_id: int, min_interval: float = 1.5):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.message_id: int | None = None
+        self.edits = 0
+        self._shown = ""
+        self._next_edit_at = 0.0
+        self._typing: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Send "typing" right away and keep it up until the reply is posted."""
+        await self._send_typing()
+        self._typing = asyncio.create_task(self._keep_typing())
+
+    async def update(self, text: str) -> None:
+        """Show text (the reply so far) if the edit rate allows it."""
+        text = text[:MessageLimit.MAX_TEXT_LENGTH]
+        if not text or text == self._shown or time.monotonic() < self._next_edit_at:
+            return
+        await self._show(text)
+
+    async def finish(self, text: str) -> None:
+        """Show the complete reply, whatever the edit rate."""
+        self.close()
+        if self.message_id is None:
+            await self.bot.send_message(chat_id=self.chat_id, text=text)
+            return
+        if text != self._shown:
+            try:
+                await self._edit(text)
+            except RetryAfter as e:
+                await asyncio.sleep(_seconds(e.retry_after))
+                await self._edit(text)
+
+    def close(self) -> None:
+        """Stop the typing indicator."""
+        if self._typing is not None:
+            self._typing.cancel()
+            self._typing = None
+
+    async def _show(self, text: str) -> None:
+        try:
+            if self.message_id is None:
+                message = await self.bot.send_message(chat_id=self.chat_id, text=text)
+                self.message_id = message.message_id
+                self.close()
+            else:
+                await self._edit(text)
+        except RetryAfter as e:
+            self._next_edit_at = time.monotonic() + _seconds(e.retry_after)
+            return
+        self._shown = text
+        self._next_edit_at = time.monotonic() + self.min_interval
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=self.chat_id, message_id=self.message_id
+            )
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.edits += 1
+        self._shown = text
+
+    async def _send_typing(self) -> None:
+        try:
+            await self.bot.send_chat_action(chat_id=self.chat_id, action=ChatAction.TYPING)
+        except Exception as e:
+            print(f"[Stream] Chat action failed for chat {self.chat_id}: {e}")
+
+    async def _keep_typing(self) -> None:
+        while True:
+            await asyncio.sleep(TYPING_REFRESH_SECONDS)
+            await self._send_typing()
+
+
+async def stream_agent(agent, inputs: dict, config: dict, on_text) -> dict:
+    """Run the graph with astream and return its final state.
+
+    Tokens the model produces in the "agent" node are accumulated per message
+    and passed to ``on_text`` (visible part only, see visible_reply); a new
+    model message starts over, so text from a turn's tool-calling step is
+    replaced by the final answer.
+    """
+    final = None
+    text = ""
+    message_id = None
+    async for mode, payload in agent.astream(
+        inputs, config=config, stream_mode=["messages", "values"]
+    ):
+        if mode == "values":
+            final = payload
+            continue
+        chunk, metadata = payload
+        if metadata.get("langgraph_node") != "agent" or not isinstance(chunk, AIMessageChunk):
+            continue
+        if chunk.id != message_id:
+            message_id = chunk.id
+            text = ""
+        if isinstance(chunk.content, str) and chunk.content:
+            text += chunk.content
+            shown = visible_reply(text)
+            if shown:
+                await on_text(shown)
+    if final is None:
+        raise RuntimeError("the agent produced no state")
+    return final
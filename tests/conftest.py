@@ -22,12 +22,58 @@ def _isolate_env(monkeypatch, tmp_path):
 
 @pytest.fixture(autouse=True)
 def _clear_dedup_cache():
-    """The anti-duplicate cache in tools.py is module-global; reset it per test."""
+    """The anti-duplicate guard in tools.py is module-global; reset it per test."""
     import tools
 
-    tools._recent_transactions.clear()
+    tools.transaction_guard.reset()
     yield
-    tools._recent_transactions.clear()
+    tools.transaction_guard.reset()
+
+
+@pytest.fixture(autouse=True)
+def _reset_sheets_pool():
+    """tools.sheets_pool caches the gspread client and handles; tests swap the client.
+    Its request scheduler starts every test with full quota buckets."""
+    import tools
+
+    tools.sheets_pool.reset()
+    tools.sheets_scheduler.reset()
+    yield
+    tools.sheets_pool.reset()
+
+
+@pytest.fixture(autouse=True)
+def _reset_transaction_store():
+    """The local sheet mirror keeps its sqlite file open; reopen it inside each tmp_path."""
+    import tools
+
+    tools.transaction_store.close()
+    yield
+    tools.transaction_store.close()
+
+
+@pytest.fixture(autouse=True)
+def _reset_enum_registry():
+    """tools.enum_registry remembers the last cache file it read; start from
+    config.py, with the tool descriptions and matchers to match."""
+    import tools
+
+    tools.enum_registry.reset()
+    tools._matchers = None
+    yield
+    tools.enum_registry.reset()
+    tools._matchers = None
+    tools.describe_tools()
+
+
+@pytest.fixture(autouse=True)
+def _close_sheet_journal():
+    """tools.sheet_writer keeps its journal open; reopen it inside each tmp_path."""
+    import tools
+
+    tools.sheet_writer.close()
+    yield
+    tools.sheet_writer.close()
 
 
 @pytest.fixture
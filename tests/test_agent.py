@@ -78,3 +78,82 @@ def test_dedupe_ignores_args_key_order():
     a = {"name": "add_expense", "args": {"amount": 5000, "description": "pizza"}}
     b = {"name": "add_expense", "args": {"description": "pizza", "amount": 5000}}
     assert len(dedupe_tool_calls([a, b])) == 1
+
+
+# ── fast path: pre-parser and templated confirmation ──────────────
+
+def _no_model(monkeypatch):
+    import agent
+
+    class Unreachable:
+        def invoke(self, messages):
+            raise AssertionError("the model was called")
+
+    monkeypatch.setattr(agent, "llm_with_tools", Unreachable())
+
+
+def _fake_expense_sheet(monkeypatch):
+    import tools
+
+    rows = []
+
+    class Worksheet:
+        def append_rows(self, new_rows, value_input_option=None):
+            rows.extend(new_rows)
+            return {"updates": {"updatedRange": "EntradaMaterial!A2:I2"}}
+
+    monkeypatch.setattr(tools, "_worksheet", lambda name: Worksheet())
+    monkeypatch.setattr(tools, "_balance_after_write", lambda: "Balance de mayo")
+    return rows
+
+
+def test_plain_expense_is_recorded_without_calling_the_model(monkeypatch):
+    from langchain_core.messages import HumanMessage
+
+    from agent import build_graph
+
+    _no_model(monkeypatch)
+    rows = _fake_expense_sheet(monkeypatch)
+
+    result = build_graph().invoke(
+        {"messages": [HumanMessage(content="gasté 1500 en farmacia con QR")], "chat_id": 1}
+    )
+
+    assert len(rows) == 1
+    ai_call, tool_result, reply = result["messages"][1:]
+    assert ai_call.tool_calls[0]["id"] == tool_result.tool_call_id
+    assert reply.content == (
+        "Gasto de $1500 en farmacia registrado (categoría: Farmacia, pago: QR)."
+    )
+
+
+def test_after_tools_confirms_only_successful_transactions():
+    from langchain_core.messages import AIMessage, ToolMessage
+
+    from agent import after_tools
+
+    call = AIMessage(content="", tool_calls=[{"name": "add_expense", "args": {}, "id": "c1"}])
+    ok = ToolMessage(content="Gasto registrado", name="add_expense", tool_call_id="c1")
+    failed = ToolMessage(content="Error", name="add_expense", tool_call_id="c1", status="error")
+    report = ToolMessage(content="Balance", name="generate_monthly_report", tool_call_id="c1")
+
+    assert after_tools({"messages": [call, ok]}) == "confirm"
+    assert after_tools({"messages": [call, failed]}) == "agent"
+    assert after_tools({"messages": [call, ok, report]}) == "agent"
+
+
+def test_unparsed_message_goes_to_the_model(monkeypatch):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    import agent
+
+    class Model:
+        def invoke(self, messages):
+            return AIMessage(content="hola")
+
+    monkeypatch.setattr(agent, "llm_with_tools", Model())
+
+    result = agent.build_graph().invoke(
+        {"messages": [HumanMessage(content="hola, qué tal")], "chat_id": 1}
+    )
+    assert [m.content for m in result["messages"][1:]] == ["hola"]
@@ -1,5 +1,8 @@
 """Round-trip tests for the sqlite layer used by the Telegram bot."""
 
+import sqlite3
+
+import pytest
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 
 from database import (
@@ -7,6 +10,7 @@ from database import (
     load_history,
     mark_processed,
     save_message,
+    save_turn,
 )
 
 
@@ -123,3 +127,320 @@ def test_load_history_drops_orphaned_leading_tool_messages(db):
     # limit window starts at the tool message; it must be dropped
     history = load_history(db, chat_id, limit=2)
     assert [m.type for m in history] == ["human"]
+
+
+# ── save_turn ───────────────────────────────────────────────────────
+
+def test_init_db_enables_wal(db):
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_save_turn_writes_messages_and_marks_update(db):
+    chat_id = 2001
+    save_turn(
+        db,
+        chat_id,
+        [HumanMessage(content="gasté 500"), AIMessage(content="Gasto registrado.")],
+        77,
+    )
+
+    assert [m.content for m in load_history(db, chat_id)] == ["gasté 500", "Gasto registrado."]
+    assert is_duplicate(db, 77) is True
+
+
+def test_save_turn_accepts_several_update_ids(db):
+    save_turn(db, 2002, [HumanMessage(content="a\nb")], [78, 79])
+
+    assert is_duplicate(db, 78) and is_duplicate(db, 79)
+
+
+def test_save_turn_without_update_id_leaves_updates_untouched(db):
+    save_turn(db, 2003, [HumanMessage(content="falló")])
+
+    assert db.execute("SELECT COUNT(*) FROM updates").fetchone()[0] == 0
+    assert [m.content for m in load_history(db, 2003)] == ["falló"]
+
+
+def test_save_turn_is_all_or_nothing(db):
+    # a non-integer update_id makes the last insert of the turn fail
+    with pytest.raises(sqlite3.IntegrityError):
+        save_turn(db, 2004, [HumanMessage(content="ok")], ["not-an-update-id"])
+
+    assert load_history(db, 2004) == []
+
+
+# ── schema migrations ───────────────────────────────────────────────
+
+def test_init_db_is_at_latest_version(db):
+    from database import MIGRATIONS
+
+    assert db.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+
+
+def test_migrate_is_idempotent(db):
+    from database import MIGRATIONS, migrate
+
+    assert migrate(db) == len(MIGRATIONS)
+    assert migrate(db) == len(MIGRATIONS)
+
+
+def test_migrate_upgrades_a_pre_versioning_db(mem_db):
+    from database import MIGRATIONS, migrate
+
+    # what init_db used to create: tables, no index, user_version 0
+    mem_db.execute("CREATE TABLE updates (update_id INTEGER PRIMARY KEY)")
+    mem_db.execute(
+        "CREATE TABLE conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "chat_id INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+        "timestamp DATETIME)"
+    )
+    save_message(mem_db, 1, HumanMessage(content="viejo"))
+
+    assert migrate(mem_db) == len(MIGRATIONS)
+    assert [m.content for m in load_history(mem_db, 1)] == ["viejo"]
+
+
+def test_load_history_query_uses_chat_index(db):
+    plan = " ".join(
+        row[-1]
+        for row in db.execute(
+            "EXPLAIN QUERY PLAN SELECT role, content FROM conversations "
+            "WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+            (1, 20),
+        )
+    )
+    assert "idx_conversations_chat_id" in plan
+    assert "TEMP B-TREE" not in plan  # no sort step: rows come off the index in order
+
+
+# ── dedup memory front + retention ──────────────────────────────────
+
+def test_new_update_above_high_water_mark_skips_disk(db):
+    mark_processed(db, 100)
+    disk_before = db.dedup_stats["disk"]
+
+    assert is_duplicate(db, 101) is False
+    assert is_duplicate(db, 100) is True  # in the LRU
+    assert db.dedup_stats["disk"] == disk_before
+
+
+def test_old_update_not_in_memory_is_checked_on_disk(db):
+    mark_processed(db, 100)
+    db.recent_updates.clear()
+
+    assert is_duplicate(db, 100) is True
+    assert is_duplicate(db, 50) is False
+    assert db.dedup_stats["disk"] == 2
+
+
+def test_high_water_mark_survives_reopening(db):
+    from database import init_db
+
+    mark_processed(db, 500)
+    reopened = init_db()
+    try:
+        assert reopened.max_update_id == 500
+        assert is_duplicate(reopened, 500) is True
+    finally:
+        reopened.close()
+
+
+def test_lru_is_bounded(db, monkeypatch):
+    import database
+
+    monkeypatch.setattr(database, "RECENT_UPDATES_CACHE_SIZE", 3)
+    for update_id in range(10):
+        mark_processed(db, update_id)
+
+    assert list(db.recent_updates) == [7, 8, 9]
+
+
+def test_compact_forgets_old_updates_only(db):
+    from database import compact
+
+    mark_processed(db, 1)
+    mark_processed(db, 2)
+    db.execute("UPDATE updates SET processed_at = 0 WHERE update_id = 1")
+    db.commit()
+
+    removed, _ = compact(db, updates_max_age=3600, messages_per_chat=100)
+
+    assert removed == 1
+    db.recent_updates.clear()
+    assert is_duplicate(db, 1) is False
+    assert is_duplicate(db, 2) is True
+
+
+def test_compact_keeps_newest_history_rows_per_chat(db):
+    from database import compact
+
+    for i in range(5):
+        save_message(db, 1, HumanMessage(content=f"a-{i}"))
+    save_message(db, 2, HumanMessage(content="b-0"))
+
+    _, removed = compact(db, updates_max_age=3600, messages_per_chat=2)
+
+    assert removed == 3
+    assert [m.content for m in load_history(db, 1)] == ["a-3", "a-4"]
+    assert [m.content for m in load_history(db, 2)] == ["b-0"]
+
+
+def test_history_cache_serves_second_load_without_parsing(db, monkeypatch):
+    import database
+
+    save_message(db, 1, HumanMessage(content="hola"))
+    load_history(db, 1)
+
+    def no_parse(content):
+        raise AssertionError("history was re-parsed")
+
+    monkeypatch.setattr(database, "_parse_row", no_parse)
+    save_turn(db, 1, [AIMessage(content="qué tal")])
+
+    assert [m.content for m in load_history(db, 1)] == ["hola", "qué tal"]
+    assert db.history_cache.stats()["hits"] == 1
+
+
+def test_history_cache_window_slides_with_new_messages(db):
+    for i in range(3):
+        save_message(db, 1, HumanMessage(content=f"m-{i}"))
+    load_history(db, 1, limit=2)
+    save_message(db, 1, HumanMessage(content="m-3"))
+
+    assert [m.content for m in load_history(db, 1, limit=2)] == ["m-2", "m-3"]
+    # a wider window than the cached one has to go back to disk
+    assert [m.content for m in load_history(db, 1, limit=10)] == ["m-0", "m-1", "m-2", "m-3"]
+    assert db.history_cache.stats()["misses"] == 2
+
+
+def test_history_cache_drops_only_chats_another_connection_wrote_to(db):
+    from database import DB_PATH
+
+    for chat_id in (1, 2):
+        save_message(db, chat_id, HumanMessage(content=f"uno-{chat_id}"))
+        load_history(db, chat_id)
+
+    other = sqlite3.connect(DB_PATH)
+    save_message(other, 1, HumanMessage(content="dos"))
+    other.close()
+
+    assert [m.content for m in load_history(db, 1)] == ["uno-1", "dos"]
+    assert [m.content for m in load_history(db, 2)] == ["uno-2"]
+    stats = db.history_cache.stats()
+    assert stats["invalidations"] == 1
+    assert stats["hits"] == 1  # chat 2
+
+
+def test_history_cache_is_bounded(db):
+    db.history_cache.max_chats = 2
+    for chat_id in (1, 2, 3):
+        save_message(db, chat_id, HumanMessage(content="x"))
+        load_history(db, chat_id)
+
+    stats = db.history_cache.stats()
+    assert stats["chats"] == 2
+    assert stats["evictions"] == 1
+
+    db.history_cache.max_bytes = 0
+    load_history(db, 1)
+    assert db.history_cache.stats()["bytes"] == 0
+
+
+def _tool_exchange(call_id, result):
+    return [
+        AIMessage(content="", tool_calls=[{"name": "t", "args": {}, "id": call_id}]),
+        ToolMessage(content=result, tool_call_id=call_id),
+    ]
+
+
+def test_fit_to_budget_keeps_newest_messages_within_budget():
+    from langchain_core.messages.utils import count_tokens_approximately
+
+    from database import fit_to_budget
+
+    messages = [HumanMessage(content=f"mensaje {i} " * 20) for i in range(10)]
+    kept = fit_to_budget(messages, max_tokens=200)
+
+    assert kept == messages[-len(kept):]
+    assert 0 < len(kept) < 10
+    assert count_tokens_approximately(kept) <= 200
+
+
+def test_fit_to_budget_never_splits_a_tool_call_from_its_result():
+    from database import fit_to_budget
+
+    messages = [
+        HumanMessage(content="reporte"),
+        *_tool_exchange("c1", "x" * 2000),
+        AIMessage(content="listo"),
+    ]
+    kept = fit_to_budget(messages, max_tokens=100)
+
+    assert [m.content for m in kept] == ["listo"]
+
+
+def test_fit_to_budget_truncates_old_tool_outputs_only():
+    from database import fit_to_budget
+
+    old = _tool_exchange("c1", "viejo " * 500)
+    new = _tool_exchange("c2", "nuevo " * 500)
+    kept = fit_to_budget(
+        [HumanMessage(content="a"), *old, HumanMessage(content="b"), *new],
+        max_tokens=10_000,
+        tool_output_chars=50,
+    )
+
+    assert kept[2].content.endswith("[recortado]") and len(kept[2].content) < 70
+    assert kept[-1].content == new[1].content
+    assert len(old[1].content) == 3000  # originals untouched
+
+
+def test_fit_to_budget_keeps_the_latest_exchange_whole():
+    from database import fit_to_budget
+
+    new = _tool_exchange("c1", "nuevo " * 500)
+    kept = fit_to_budget(
+        [HumanMessage(content="reporte"), *new, AIMessage(content="listo")],
+        max_tokens=10_000,
+        tool_output_chars=50,
+    )
+
+    assert kept[2].content == new[1].content
+
+
+def test_load_history_with_token_budget(db):
+    save_turn(db, 1, [HumanMessage(content="hola " * 200), AIMessage(content="chau")])
+
+    assert [m.content for m in load_history(db, 1, max_tokens=50)] == ["chau"]
+    assert len(load_history(db, 1)) == 2
+
+
+def test_claim_update_has_one_winner_across_connections(db):
+    from database import claim_update, init_db
+
+    other = init_db()
+    assert claim_update(db, 1, "worker-a") is True
+    assert claim_update(other, 1, "worker-b") is False
+    assert claim_update(db, 1, "worker-a") is False  # not twice for the same worker either
+    other.close()
+
+
+def test_claim_update_loses_to_processed_updates(db):
+    from database import claim_update
+
+    mark_processed(db, 1)
+    assert claim_update(db, 1, "worker-a") is False
+
+
+def test_released_or_expired_claims_can_be_taken(db, monkeypatch):
+    import database
+    from database import claim_update, release_claims
+
+    claim_update(db, 1, "worker-a")
+    release_claims(db, [1], "worker-b")  # only the owner can release
+    assert claim_update(db, 1, "worker-b") is False
+    release_claims(db, [1], "worker-a")
+    assert claim_update(db, 1, "worker-b") is True
+
+    monkeypatch.setattr(database, "CLAIM_LEASE_SECONDS", -1)
+    assert claim_update(db, 1, "worker-c") is True  # worker-b's claim went stale
@@ -0,0 +1,66 @@
+"""Tests for the recent-writes guardrail in dedup.py."""
+
+import dedup
+from dedup import RecentWrites
+
+
+def _at(monkeypatch, seconds):
+    monkeypatch.setattr(dedup.time, "monotonic", lambda: seconds)
+    monkeypatch.setattr(dedup.time, "time", lambda: 1_000_000 + seconds)
+
+
+def test_second_claim_inside_window_is_suppressed(monkeypatch):
+    guard = RecentWrites(window=60)
+    _at(monkeypatch, 0)
+    assert guard.claim("a") is True
+    _at(monkeypatch, 59)
+    assert guard.claim("a") is False
+    assert guard.claim("b") is True
+
+    assert guard.stats() == {
+        "claimed": 2, "suppressed": 1, "released": 0, "expired": 0, "keys": 2,
+    }
+
+
+def test_keys_expire_in_claim_order(monkeypatch):
+    guard = RecentWrites(window=60)
+    for t, key in ((0, "a"), (10, "b"), (20, "c")):
+        _at(monkeypatch, t)
+        guard.claim(key)
+
+    _at(monkeypatch, 75)  # a and b are out of the window, c is not
+    assert guard.claim("a") is True
+    assert guard.claim("c") is False
+    assert guard.stats()["expired"] == 2
+
+
+def test_released_key_can_be_claimed_again_and_expires_from_its_new_time(monkeypatch):
+    guard = RecentWrites(window=60)
+    _at(monkeypatch, 0)
+    guard.claim("a")
+    guard.release("a")
+    _at(monkeypatch, 50)
+    assert guard.claim("a") is True
+
+    _at(monkeypatch, 70)  # the first claim's deque entry is stale by now
+    assert guard.claim("a") is False
+
+
+def test_sqlite_guard_survives_restart_and_is_shared(tmp_path, monkeypatch):
+    path = str(tmp_path / "dedup.db")
+    _at(monkeypatch, 0)
+    first = RecentWrites(window=60, path=path)
+    assert first.claim("a") is True
+    first.reset()  # "restart": connection closed, memory gone
+
+    second = RecentWrites(window=60, path=path)
+    assert second.claim("a") is False
+    assert first.claim("a") is False
+    second.release("a")
+    assert first.claim("a") is True
+
+    _at(monkeypatch, 61)
+    assert second.claim("a") is True
+    assert second.stats()["expired"] == 1
+    first.reset()
+    second.reset()
@@ -0,0 +1,160 @@
+"""Tests for the per-chat work queues in dispatcher.py."""
+
+import asyncio
+
+import pytest
+
+from dispatcher import ChatDispatcher
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_items_of_one_chat_are_handled_in_order_one_at_a_time():
+    async def scenario():
+        log = []
+
+        async def handle(chat_id, items):
+            log.append(f"start-{items[0]}")
+            await asyncio.sleep(0.01)
+            log.append(f"end-{items[0]}")
+
+        dispatcher = ChatDispatcher(handle, max_concurrent=4)
+        for n in range(3):
+            dispatcher.submit(1, n)
+        await dispatcher.join()
+        return log
+
+    assert _run(scenario()) == [
+        "start-0", "end-0", "start-1", "end-1", "start-2", "end-2",
+    ]
+
+
+def test_different_chats_overlap():
+    async def scenario():
+        running = set()
+        peak = 0
+
+        async def handle(chat_id, items):
+            nonlocal peak
+            running.add(chat_id)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01)
+            running.discard(chat_id)
+
+        dispatcher = ChatDispatcher(handle, max_concurrent=4)
+        for chat_id in range(3):
+            dispatcher.submit(chat_id, "hola")
+        await dispatcher.join()
+        return peak
+
+    assert _run(scenario()) == 3
+
+
+def test_global_limit_caps_parallel_turns():
+    async def scenario():
+        running = 0
+        peak = 0
+
+        async def handle(chat_id, items):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        dispatcher = ChatDispatcher(handle, max_concurrent=2)
+        for chat_id in range(6):
+            dispatcher.submit(chat_id, "hola")
+        await dispatcher.join()
+        return peak
+
+    assert _run(scenario()) == 2
+
+
+def test_full_chat_queue_rejects_new_items():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handle(chat_id, items):
+            await release.wait()
+
+        dispatcher = ChatDispatcher(handle, max_concurrent=1, max_queue_per_chat=2)
+        accepted = [dispatcher.submit(1, n) for n in range(3)]
+        other_chat = dispatcher.submit(2, "x")
+        release.set()
+        await dispatcher.join()
+        return accepted, other_chat, dispatcher.stats()
+
+    accepted, other_chat, stats = _run(scenario())
+    assert accepted == [True, True, False]
+    assert other_chat is True
+    assert stats["rejected"] == 1
+
+
+def test_burst_is_coalesced_into_one_turn():
+    async def scenario():
+        turns = []
+
+        async def handle(chat_id, items):
+            turns.append(items)
+
+        dispatcher = ChatDispatcher(handle, coalesce_seconds=0.05)
+        dispatcher.submit(1, "gasté 500 en café")
+        await asyncio.sleep(0.01)
+        dispatcher.submit(1, "con QR")
+        await dispatcher.join()
+        return turns, dispatcher.stats()
+
+    turns, stats = _run(scenario())
+    assert turns == [["gasté 500 en café", "con QR"]]
+    assert stats["coalesced"] == 1
+    assert stats["turns"] == 1
+
+
+def test_failed_turn_does_not_stop_the_chat_queue():
+    async def scenario():
+        handled = []
+
+        async def handle(chat_id, items):
+            if items[0] == "boom":
+                raise RuntimeError("boom")
+            handled.append(items[0])
+
+        dispatcher = ChatDispatcher(handle)
+        dispatcher.submit(1, "boom")
+        dispatcher.submit(1, "ok")
+        await dispatcher.join()
+        return handled, dispatcher.stats()
+
+    handled, stats = _run(scenario())
+    assert handled == ["ok"]
+    assert stats["failed"] == 1
+
+
+def test_stats_report_depth_and_waits():
+    async def scenario():
+        async def handle(chat_id, items):
+            await asyncio.sleep(0.01)
+
+        dispatcher = ChatDispatcher(handle)
+        for n in range(3):
+            dispatcher.submit(1, n)
+        during = dispatcher.stats()
+        await dispatcher.join()
+        return during, dispatcher.stats()
+
+    during, after = _run(scenario())
+    assert during["queued"] == 3
+    assert during["busiest_chat_depth"] == 3
+    assert after["queued"] == 0
+    assert after["max_depth"] == 3
+    assert after["turns"] == 3
+    assert after["wait_ms_max"] >= 10  # the third item waited for two turns
+    assert after["active_chats"] == 0
+
+
+def test_rejects_non_positive_limits():
+    with pytest.raises(ValueError):
+        ChatDispatcher(lambda chat_id, items: None, max_concurrent=0)
@@ -0,0 +1,140 @@
+"""Tests for the enum sync, cache file and registry in enums.py."""
+
+import json
+
+import pytest
+
+import config
+from enums import DEFAULTS, EnumRegistry, fetch_enums, read_cache, render_config, write_cache
+
+
+def _enums(**changes):
+    return {**DEFAULTS, **changes}
+
+
+def test_render_config_reproduces_config_py():
+    with open(config.__file__, encoding="utf-8") as f:
+        assert render_config(DEFAULTS) == f.read()
+
+
+def test_write_cache_bumps_the_version_only_on_change(tmp_path):
+    path = str(tmp_path / "enums.json")
+
+    assert write_cache(path, DEFAULTS) == 1
+    assert write_cache(path, DEFAULTS) == 1
+    assert write_cache(path, _enums(VENTAS_PAYMENT_METHODS=["Efectivo", "QR"])) == 2
+    assert read_cache(path)["enums"]["VENTAS_PAYMENT_METHODS"] == ["Efectivo", "QR"]
+
+
+def test_write_cache_rejects_an_empty_list(tmp_path):
+    with pytest.raises(ValueError, match="ENTRADA_CATEGORIES"):
+        write_cache(str(tmp_path / "enums.json"), _enums(ENTRADA_CATEGORIES=[]))
+
+
+def test_registry_serves_defaults_until_a_cache_exists(tmp_path):
+    registry = EnumRegistry(str(tmp_path / "enums.json"), reload_interval=0)
+
+    assert registry["VENTAS_CATEGORIES"] == config.VENTAS_CATEGORIES
+    assert registry.version == 0
+
+
+def test_registry_reloads_the_file_when_it_changes(tmp_path):
+    path = str(tmp_path / "enums.json")
+    registry = EnumRegistry(path, reload_interval=0)
+    write_cache(path, _enums(ENTRADA_CATEGORIES=["Farmacia", "Nueva"]))
+
+    assert registry["ENTRADA_CATEGORIES"] == ["Farmacia", "Nueva"]
+    assert registry.version == 1
+
+
+def test_registry_waits_for_the_reload_interval(tmp_path):
+    path = str(tmp_path / "enums.json")
+    registry = EnumRegistry(path, reload_interval=3600)
+    assert registry.version == 0  # first look
+
+    write_cache(path, _enums(ENTRADA_CATEGORIES=["Nueva"]))
+
+    assert registry["ENTRADA_CATEGORIES"] == config.ENTRADA_CATEGORIES
+    assert registry.reload() is True  # forced
+    assert registry["ENTRADA_CATEGORIES"] == ["Nueva"]
+
+
+def test_registry_keeps_the_last_good_lists_on_a_broken_file(tmp_path):
+    path = str(tmp_path / "enums.json")
+    registry = EnumRegistry(path, reload_interval=0)
+    write_cache(path, _enums(ENTRADA_CATEGORIES=["Nueva"]))
+    assert registry.version == 1
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 2, "enums": {"ENTRADA_CATEGORIES": []}}, f)
+
+    assert registry.version == 1
+    assert registry["ENTRADA_CATEGORIES"] == ["Nueva"]
+
+
+class _Spreadsheet:
+    """Headers, validation rules and value ranges as the Sheets API returns them."""
+
+    def __init__(self, rules):
+        self.rules = rules  # (sheet title, column index) -> condition
+        self.requests = []
+
+    def values_batch_get(self, ranges, params=None):
+        self.requests.append(("values", ranges))
+        values = {
+            "'EntradaMaterial'!1:1": [["EntradaMaterialID", "Categoria", "MetodoPago"]],
+            "'Ventas'!1:1": [["VentaID", "VentaMetodoPago", "Categoria"]],
+            "Listas!A2:A": [["Salud"], ["Farmacia"], [""], ["Farmacia "]],
+        }
+        return {"valueRanges": [{"values": values[r]} for r in ranges]}
+
+    def fetch_sheet_metadata(self, params):
+        self.requests.append(("metadata", params["ranges"]))
+        sheets = {}
+        for cell in params["ranges"]:  # "'Ventas'!B2"
+            title, a1 = cell.strip("'").split("'!")
+            column = ord(a1[0]) - ord("A")
+            validation = {"condition": self.rules[(title, column)]}
+            sheets.setdefault(title, []).append(
+                {"startColumn": column, "rowData": [{"values": [{"dataValidation": validation}]}]}
+            )
+        return {
+            "sheets": [{"properties": {"title": t}, "data": d} for t, d in sheets.items()]
+        }
+
+
+def _one_of_list(*items):
+    return {"type": "ONE_OF_LIST", "values": [{"userEnteredValue": i} for i in items]}
+
+
+def test_fetch_enums_reads_list_and_range_validations():
+    spreadsheet = _Spreadsheet({
+        ("EntradaMaterial", 1): {
+            "type": "ONE_OF_RANGE", "values": [{"userEnteredValue": "=Listas!$A$2:$A"}],
+        },
+        ("EntradaMaterial", 2): _one_of_list("QR", "Efectivo"),
+        ("Ventas", 1): _one_of_list("Efectivo"),
+        ("Ventas", 2): _one_of_list("Salario", "Bonificaciones"),
+    })
+
+    enums = fetch_enums(spreadsheet)
+
+    assert enums == {
+        "ENTRADA_CATEGORIES": ["Farmacia", "Salud"],
+        "ENTRADA_PAYMENT_METHODS": ["Efectivo", "QR"],
+        "VENTAS_CATEGORIES": ["Bonificaciones", "Salario"],
+        "VENTAS_PAYMENT_METHODS": ["Efectivo"],
+    }
+    assert [kind for kind, _ in spreadsheet.requests] == ["values", "metadata", "values"]
+
+
+def test_fetch_enums_fails_on_a_column_without_list_validation():
+    spreadsheet = _Spreadsheet({
+        ("EntradaMaterial", 1): {"type": "NUMBER_GREATER", "values": []},
+        ("EntradaMaterial", 2): _one_of_list("QR"),
+        ("Ventas", 1): _one_of_list("Efectivo"),
+        ("Ventas", 2): _one_of_list("Salario"),
+    })
+
+    with pytest.raises(ValueError, match="ENTRADA_CATEGORIES"):
+        fetch_enums(spreadsheet)
@@ -0,0 +1,70 @@
+"""Tests for the rules-based transaction pre-parser."""
+
+import pytest
+
+from fast_path import parse_transaction
+
+
+def test_parses_expense_with_payment_method():
+    assert parse_transaction("gasté 1500 en farmacia con QR") == (
+        "add_expense",
+        {"amount": 1500.0, "description": "farmacia", "category": "Farmacia", "payment_method": "QR"},
+    )
+
+
+def test_parses_income_and_defaults_to_cash():
+    tool, args = parse_transaction("Cobré 500.000 de sueldo")
+    assert tool == "add_income"
+    assert args["amount"] == 500000.0
+    assert args["category"] == "Salario"
+    assert args["payment_method"] == "Efectivo"
+
+
+@pytest.mark.parametrize(
+    "text, amount",
+    [
+        ("gasté $1.500,50 en farmacia", 1500.5),
+        ("gasté 15k en nafta", 15000.0),
+        ("gasté 2 mil en el súper", 2000.0),
+        ("gasté 1500 pesos en farmacia", 1500.0),
+    ],
+)
+def test_amount_formats(text, amount):
+    assert parse_transaction(text)[1]["amount"] == amount
+
+
+def test_today_is_the_date_it_records():
+    assert parse_transaction("hoy gasté 1500 en farmacia")[1]["amount"] == 1500.0
+
+
+def test_keeps_the_users_spelling_without_article():
+    assert parse_transaction("gasté 2000 en el Súper")[1]["description"] == "Súper"
+
+
+def test_resolves_full_category_and_card_names():
+    _, args = parse_transaction("pagué 30000 de expensas con tarjeta de crédito")
+    assert args["category"].startswith("Vivienda")
+    assert args["payment_method"] == "Tarjeta de crédito"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "¿gasté 1500 en farmacia?",            # question
+        "no gasté 1500 en farmacia",           # negation
+        "gasté 1500 en 2 pizzas",              # two numbers
+        "gasté 1500 en cosas",                 # unknown category
+        "gasté 1500 en café con leche",        # "con" but not a payment method
+        "cobré 5000 de sueldo con QR",         # QR is not an income method
+        "cuánto gasté este mes",               # no amount / not a record
+        "pagué el alquiler 300000",            # amount after the description
+        "gasté 500 en gaseosa",                # "gas" must match the whole word
+        "ayer gasté 1500 en farmacia",         # not today
+        "gasté 1500 en farmacia el mes pasado",  # not today
+        "gasté 1500 en farmacia el lunes",     # not today
+        "gasté 1500 en super en cuotas",       # unknown trailing clause
+        "gasté 1500 en pizza para Juan",       # unknown trailing clause
+    ],
+)
+def test_leaves_unclear_messages_to_the_model(text):
+    assert parse_transaction(text) is None
@@ -0,0 +1,57 @@
+"""Tests for the precomputed category / payment-method matcher in matcher.py."""
+
+from config import ENTRADA_CATEGORIES, ENTRADA_PAYMENT_METHODS
+from fast_path import EXPENSE_KEYWORDS, PAYMENT_KEYWORDS
+from matcher import Matcher, fold
+
+
+def _category(guess):
+    return Matcher(ENTRADA_CATEGORIES, EXPENSE_KEYWORDS).match(guess)
+
+
+def test_fold_ignores_case_and_accents():
+    assert fold("Alimentación Rápida") == "alimentacion rapida"
+
+
+def test_guesses_ignore_spacing():
+    assert _category("  alimentacion   (comestibles,  restaurantes) ") == ENTRADA_CATEGORIES[0]
+
+
+def test_start_of_a_later_word_of_an_entry():
+    assert _category("comestib").startswith("Alimentación")
+
+
+def test_exact_match_ignores_accents():
+    assert _category("ALIMENTACION (comestibles, restaurantes)") == ENTRADA_CATEGORIES[0]
+
+
+def test_aliases_and_their_plurals():
+    assert _category("super").startswith("Alimentación")
+    assert _category("nafta").startswith("Transporte")
+    assert _category("Uber").startswith("Transporte")
+    assert _category("remedios") == "Farmacia"
+
+
+def test_a_word_of_the_guess_can_be_an_alias():
+    assert _category("comida rapida").startswith("Alimentación")
+
+
+def test_typos_match_by_trigram_similarity():
+    assert _category("farmcia") == "Farmacia"
+    assert Matcher(ENTRADA_PAYMENT_METHODS, PAYMENT_KEYWORDS).match("efectibo") == "Efectivo"
+
+
+def test_guesses_below_the_threshold_do_not_match():
+    assert _category("banana-empanada") is None
+    assert Matcher(["Farmacia"], threshold=1.0).match("farmcia") is None
+
+
+def test_exact_match_wins_over_a_longer_entry_with_the_same_start():
+    assert Matcher(["CriptoLargo", "Cripto"]).match("cripto") == "Cripto"
+
+
+def test_aliases_for_entries_not_in_the_list_are_ignored():
+    matcher = Matcher(["Salud"], {"nafta": "Transporte", "remedio": "Salud"})
+
+    assert matcher.match("nafta") is None
+    assert matcher.match("remedios") == "Salud"
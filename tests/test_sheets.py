@@ -0,0 +1,419 @@
+"""Tests for the gspread client pool, request scheduler and batching writer in sheets.py."""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import threading
+import time
+
+import pytest
+import requests
+
+import tools
+from gspread.exceptions import APIError
+
+from sheets import RequestScheduler, SheetsPool, SheetWriter
+
+
+class _Creds:
+    def __init__(self, expires_in):
+        self.token = "tok"
+        self.expiry = self._utcnow() + timedelta(seconds=expires_in)
+        self.refreshes = 0
+
+    @staticmethod
+    def _utcnow():
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def refresh(self, _request):
+        self.refreshes += 1
+        self.expiry = self._utcnow() + timedelta(hours=1)
+
+
+class _Client:
+    def __init__(self, creds=None):
+        self.http_client = SimpleNamespace(auth=creds)
+        self.opened = []
+
+    def open_by_key(self, sheet_id):
+        self.opened.append(sheet_id)
+        return SimpleNamespace(worksheet=lambda name: SimpleNamespace(title=name))
+
+
+@pytest.fixture
+def connects():
+    return []
+
+
+@pytest.fixture
+def pool(connects):
+    def connect():
+        client = _Client(_Creds(expires_in=3600))
+        connects.append(client)
+        return client
+
+    return SheetsPool(connect, refresh_margin=300)
+
+
+def test_client_is_authorized_once(pool, connects):
+    assert pool.client() is pool.client()
+    assert len(connects) == 1
+    assert pool.stats()["client_misses"] == 1
+    assert pool.stats()["client_hits"] == 1
+
+
+def test_worksheet_handles_are_cached_per_sheet_and_tab(pool, connects):
+    first = pool.worksheet("sheet-a", "Ventas")
+    assert pool.worksheet("sheet-a", "Ventas") is first
+    assert pool.worksheet("sheet-a", "EntradaMaterial") is not first
+    pool.worksheet("sheet-b", "Ventas")
+
+    assert connects[0].opened == ["sheet-a", "sheet-b"]
+    stats = pool.stats()
+    assert stats["worksheet_hits"] == 1
+    assert stats["worksheet_misses"] == 3
+    assert stats["spreadsheet_misses"] == 2
+
+
+def test_token_refreshed_ahead_of_expiry():
+    creds = _Creds(expires_in=60)  # inside the 300s margin
+    pool = SheetsPool(lambda: _Client(creds), refresh_margin=300)
+
+    pool.client()
+    pool.client()
+
+    assert creds.refreshes == 1
+    assert pool.stats()["token_refreshes"] == 1
+
+
+def test_valid_token_is_not_refreshed(pool, connects):
+    pool.client()
+    assert connects[0].http_client.auth.refreshes == 0
+
+
+def test_invalidate_keeps_client_but_reopens_handles(pool, connects):
+    pool.worksheet("sheet-a", "Ventas")
+    pool.invalidate()
+    pool.worksheet("sheet-a", "Ventas")
+
+    assert len(connects) == 1
+    assert connects[0].opened == ["sheet-a", "sheet-a"]
+
+
+def test_slow_open_does_not_block_cached_lookups(connects):
+    opening, release = threading.Event(), threading.Event()
+
+    class SlowClient(_Client):
+        def open_by_key(self, sheet_id):
+            if sheet_id == "sheet-b":
+                opening.set()
+                release.wait(5)
+            return super().open_by_key(sheet_id)
+
+    pool = SheetsPool(lambda: SlowClient(_Creds(expires_in=3600)))
+    cached = pool.worksheet("sheet-a", "Ventas")
+    opener = threading.Thread(target=pool.worksheet, args=("sheet-b", "Ventas"))
+    opener.start()
+    assert opening.wait(5)
+
+    try:
+        started = time.monotonic()
+        assert pool.worksheet("sheet-a", "Ventas") is cached
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        opener.join(5)
+    assert pool.stats()["spreadsheet_misses"] == 2
+
+
+def test_tools_share_one_client_across_calls(monkeypatch):
+    """add_expense used to authorize twice: once to write, once for the report."""
+    calls = {"n": 0}
+
+    class Worksheet:
+        def append_rows(self, rows, value_input_option=None):
+            pass
+
+    class Client:
+        def open_by_key(self, sheet_id):
+            return SimpleNamespace(
+                worksheet=lambda name: Worksheet(),
+                values_batch_get=lambda ranges, params=None: {"valueRanges": []},
+            )
+
+    def connect():
+        calls["n"] += 1
+        return Client()
+
+    monkeypatch.setattr(tools, "get_gspread_client", connect)
+
+    tools.add_expense.invoke(
+        {"amount": 10, "description": "cafe", "category": "Alimentación"}
+    )
+    tools.generate_monthly_report.invoke({})
+
+    assert calls["n"] == 1
+
+
+# ── batched appends ────────────────────────────────────────────────
+
+class _AppendSheet:
+    def __init__(self, start_row=2, fail=False):
+        self.requests = []
+        self.start_row = start_row
+        self.fail = fail
+
+    def append_rows(self, rows, value_input_option=None):
+        if self.fail:
+            raise RuntimeError("sheet down")
+        self.requests.append(list(rows))
+        first = self.start_row + sum(len(r) for r in self.requests[:-1])
+        return {"updates": {"updatedRange": f"Ventas!A{first}:C{first + len(rows) - 1}"}}
+
+    def col_values(self, column):
+        return [row[0] for request in self.requests for row in request]
+
+
+def _append_concurrently(writer, rows):
+    results, errors = {}, {}
+
+    def append(i):
+        try:
+            results[i] = writer.append("Ventas", [rows[i]])
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(len(rows))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_concurrent_appends_share_one_request(tmp_path):
+    sheet = _AppendSheet()
+    writer = SheetWriter(lambda name: sheet, str(tmp_path / "journal.db"), window=0.2)
+    rows = [[f"id{i}", i, "x"] for i in range(5)]
+
+    results, errors = _append_concurrently(writer, rows)
+
+    assert not errors
+    assert len(sheet.requests) == 1
+    assert sorted(map(tuple, sheet.requests[0])) == sorted(map(tuple, rows))
+    # each caller gets the range its own row landed in
+    for i, (updated_range,) in results.items():
+        position = sheet.requests[0].index(rows[i])
+        assert updated_range == f"Ventas!A{2 + position}:C{2 + position}"
+    assert writer.stats() == {"appends": 5, "rows": 5, "requests": 1, "failed_requests": 0}
+
+
+def test_full_batch_is_sent_without_waiting(tmp_path):
+    sheet = _AppendSheet()
+    writer = SheetWriter(lambda name: sheet, str(tmp_path / "journal.db"), window=30, max_rows=2)
+
+    assert writer.append("Ventas", [["a", 1, "x"], ["b", 2, "x"]]) == [
+        "Ventas!A2:C2",
+        "Ventas!A3:C3",
+    ]
+
+
+def test_failed_flush_reaches_every_caller_and_leaves_no_journal(tmp_path):
+    sheet = _AppendSheet(fail=True)
+    writer = SheetWriter(lambda name: sheet, str(tmp_path / "journal.db"), window=0.2)
+
+    results, errors = _append_concurrently(writer, [["a", 1, "x"], ["b", 2, "x"]])
+
+    assert not results
+    assert len(errors) == 2
+    assert all("sheet down" in str(e) for e in errors.values())
+    # the callers reported the failure, so nothing may come back on replay
+    sheet.fail = False
+    assert SheetWriter(lambda name: sheet, str(tmp_path / "journal.db")).replay() == 0
+
+
+def test_replay_appends_only_rows_the_sheet_is_missing(tmp_path):
+    path = str(tmp_path / "journal.db")
+    sheet = _AppendSheet()
+    sheet.requests.append([["landed", 1, "x"]])  # flushed, then the process died
+    crashed = SheetWriter(lambda name: sheet, path)
+    crashed._journal("Ventas", [["landed", 1, "x"], ["lost", 2, "x"]])
+    crashed.close()
+
+    restarted = SheetWriter(lambda name: sheet, path)
+
+    assert restarted.replay() == 1
+    assert sheet.requests[-1] == [["lost", 2, "x"]]
+    assert restarted.replay() == 0
+
+
+# ── request scheduler ──────────────────────────────────────────────
+
+def _api_error(status, headers=None):
+    response = SimpleNamespace(
+        json=lambda: {"error": {"code": status, "message": "boom"}},
+        text="boom",
+        headers=headers or {},
+    )
+    return APIError(response)
+
+
+def _failing(*errors, result="ok"):
+    """A request that raises the given errors in turn, then returns result."""
+    pending = list(errors)
+    calls = []
+
+    def request():
+        calls.append(time.monotonic())
+        if pending:
+            raise pending.pop(0)
+        return result
+
+    return request, calls
+
+
+def test_quota_errors_are_retried_with_backoff():
+    scheduler = RequestScheduler(base_delay=0.01, max_delay=0.05)
+    request, calls = _failing(_api_error(429), _api_error(429))
+
+    assert scheduler.call("write", request) == "ok"
+    assert len(calls) == 3
+    assert calls[2] - calls[1] >= 0.01  # the backoff doubled
+    stats = scheduler.stats()
+    assert stats["write_retries"] == 2
+    assert stats["write_requests"] == 3
+    assert stats["write_last_minute"] == 3
+
+
+def test_retry_after_header_sets_the_delay():
+    scheduler = RequestScheduler(base_delay=5, max_delay=0.2)
+    request, calls = _failing(_api_error(429, {"Retry-After": "0.1"}))
+
+    scheduler.call("read", request)
+
+    assert 0.1 <= calls[1] - calls[0] < 1
+
+
+def test_server_errors_retry_reads_but_not_writes():
+    scheduler = RequestScheduler(base_delay=0.01)
+    read, read_calls = _failing(_api_error(503))
+    write, write_calls = _failing(_api_error(503))
+
+    assert scheduler.call("read", read) == "ok"
+    with pytest.raises(APIError):
+        scheduler.call("write", write)
+
+    assert len(read_calls) == 2
+    assert len(write_calls) == 1
+    assert scheduler.stats()["write_failed"] == 1
+
+
+def test_connection_errors_retry_reads_but_not_writes():
+    scheduler = RequestScheduler(base_delay=0.01)
+    read, read_calls = _failing(requests.Timeout("read timed out"))
+    write, write_calls = _failing(requests.ConnectionError("reset by peer"))
+
+    assert scheduler.call("read", read) == "ok"
+    with pytest.raises(requests.ConnectionError):
+        scheduler.call("write", write)
+
+    assert len(read_calls) == 2
+    assert len(write_calls) == 1
+
+
+def test_client_errors_are_not_retried():
+    scheduler = RequestScheduler(base_delay=0.01)
+    request, calls = _failing(_api_error(400))
+
+    with pytest.raises(APIError):
+        scheduler.call("read", request)
+    assert len(calls) == 1
+
+
+def test_requests_beyond_the_burst_are_paced():
+    scheduler = RequestScheduler(reads_per_minute=600, burst=2)
+
+    started = time.monotonic()
+    for _ in range(4):
+        scheduler.call("read", lambda: None)
+
+    # 2 from the bucket, then one every 60/598 s
+    assert time.monotonic() - started >= 0.15
+    assert scheduler.stats()["read_throttled"] == 2
+
+
+def test_waiting_writes_go_before_waiting_reads():
+    scheduler = RequestScheduler(max_in_flight=1)
+    release = threading.Event()
+    order = []
+
+    blocker = threading.Thread(target=scheduler.call, args=("read", release.wait))
+    blocker.start()
+    time.sleep(0.05)
+    read = threading.Thread(target=scheduler.call, args=("read", lambda: order.append("read")))
+    read.start()
+    time.sleep(0.05)
+    write = threading.Thread(target=scheduler.call, args=("write", lambda: order.append("write")))
+    write.start()
+    time.sleep(0.05)
+    release.set()
+    for t in (blocker, read, write):
+        t.join()
+
+    assert order == ["write", "read"]
+
+
+def test_pool_routes_worksheet_calls_through_the_scheduler():
+    scheduler = RequestScheduler(base_delay=0.01)
+    get_values, _ = _failing(_api_error(500), result=[["a"]])
+    client = SimpleNamespace(
+        http_client=None,
+        open_by_key=lambda key: SimpleNamespace(
+            worksheet=lambda name: SimpleNamespace(title=name, get_all_values=get_values)
+        ),
+    )
+    pool = SheetsPool(lambda: client, scheduler=scheduler)
+
+    worksheet = pool.worksheet("sheet-a", "Ventas")
+
+    assert worksheet.title == "Ventas"
+    assert worksheet.get_all_values() == [["a"]]
+    stats = scheduler.stats()
+    assert stats["read_requests"] == 4  # open_by_key, worksheet, two tries
+    assert stats["read_retries"] == 1
+
+
+def test_writer_after_a_server_error_appends_only_missing_rows(tmp_path):
+    class Sheet(_AppendSheet):
+        def append_rows(self, rows, value_input_option=None):
+            super().append_rows(rows)
+            if len(self.requests) == 1:
+                raise _api_error(502)  # written, but the answer got lost
+
+    sheet = Sheet()
+    writer = SheetWriter(lambda name: sheet, str(tmp_path / "journal.db"), window=0)
+
+    assert writer.append("Ventas", [["a", 1, "x"]]) == [None]
+    assert sheet.requests == [[["a", 1, "x"]]]
+
+
+def test_writer_after_a_dropped_connection_appends_only_missing_rows(tmp_path):
+    class Sheet(_AppendSheet):
+        def append_rows(self, rows, value_input_option=None):
+            super().append_rows(rows)
+            if len(self.requests) == 1:
+                raise requests.ConnectionError("reset by peer")  # written anyway
+
+    sheet = Sheet()
+    scheduled = SheetsPool(
+        lambda: SimpleNamespace(http_client=None, open_by_key=lambda key: SimpleNamespace(
+            worksheet=lambda name: sheet
+        )),
+        scheduler=RequestScheduler(base_delay=0.01),
+    )
+    writer = SheetWriter(
+        lambda name: scheduled.worksheet("sheet-a", name), str(tmp_path / "journal.db"), window=0
+    )
+
+    assert writer.append("Ventas", [["a", 1, "x"]]) == [None]
+    assert sheet.requests == [[["a", 1, "x"]]]
@@ -0,0 +1,486 @@
+"""Tests for the local sheet mirror in store.py."""
+
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+import partitions
+from store import SHEETS, TransactionStore
+
+HEADER = [
+    "VentaID", "VentaFecha", "VentaHora", "UsuarioID", "VentaMetodoPago",
+    "VentaStatus", "VentaNotas", "Monto", "Categoria",
+]
+
+
+def _row(tx_id, fecha, monto, nota="sueldo"):
+    return [tx_id, fecha, f"{fecha} 12:00:00", "16162b8f", "Efectivo", "TRUE",
+            nota, str(monto), "Salario"]
+
+
+class _Worksheet:
+    """Counts how the store reads the sheet."""
+
+    def __init__(self, rows):
+        self.values = [HEADER] + rows
+        self.full_reads = 0
+        self.ranges = []
+
+    def row_values(self, row):
+        self.full_reads += 1
+        return list(self.values[row - 1])
+
+    def batch_get(self, ranges, major_dimension=None):
+        assert major_dimension == "COLUMNS"
+        self.ranges.append(ranges)
+        result = []
+        for range_name in ranges:  # "B2:B"
+            column, first_row = ord(range_name[0]) - ord("A"), int(range_name.split(":")[0][1:])
+            values = [r[column] if column < len(r) else "" for r in self.values[first_row - 1:]]
+            while values and values[-1] == "":
+                values.pop()
+            result.append([values] if values else [])
+        return result
+
+
+class _Spreadsheet:
+    """Both sheets behind values_batch_get, counting requests."""
+
+    def __init__(self, **worksheets):
+        self.worksheets = {SHEETS[kind].worksheet: ws for kind, ws in worksheets.items()}
+        self.requests = 0
+        self.params = None
+
+    def values_batch_get(self, ranges, params=None):
+        self.requests += 1
+        self.params = params
+        by_sheet = {}
+        for i, qualified in enumerate(ranges):  # "'Ventas'!B2:B"
+            name, range_name = qualified.split("!")
+            by_sheet.setdefault(name.strip("'"), []).append((i, range_name))
+        value_ranges = [None] * len(ranges)
+        for name, sheet_ranges in by_sheet.items():
+            ws = self.worksheets[name]
+            if params["majorDimension"] == "ROWS":
+                values = [[ws.row_values(1)] for _ in sheet_ranges]
+            else:
+                values = ws.batch_get([r for _, r in sheet_ranges], major_dimension="COLUMNS")
+            for (i, _), v in zip(sheet_ranges, values):
+                value_ranges[i] = {"values": v}
+        return {"valueRanges": value_ranges}
+
+
+def _refresh(store, ws, force_full=False):
+    """Sync the income mirror from ws alone."""
+    return store.refresh_all(lambda: _Spreadsheet(income=ws), ("income",), force_full)
+
+
+def _column(store, column, kind="income"):
+    """column of every mirrored row of kind that has a date and an amount,
+    newest month first."""
+    return store.latest([kind], ["16162b8f"], float("inf"))[column].tolist()
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = TransactionStore(str(tmp_path / "tx.db"), max_staleness=0, full_resync_interval=3600)
+    yield s
+    s.close()
+
+
+def test_first_refresh_loads_the_whole_sheet(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100), _row("b", "02/05/2026", 200)])
+    _refresh(store, ws)
+
+    df = store.latest(["income"], ["16162b8f"], 2)
+    assert df["Monto"].tolist() == [100, 200]
+    assert df["Fecha"].iloc[0].month == 5
+    assert ws.full_reads == 1
+    # only the mirrored columns: not VentaHora (C) or VentaStatus (F)
+    assert ws.ranges == [["A2:A", "B2:B", "D2:D", "E2:E", "G2:G", "H2:H", "I2:I"]]
+
+
+def test_later_refresh_pulls_only_appended_rows(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    ws.values.append(_row("b", "02/05/2026", 200))
+
+    _refresh(store, ws)
+
+    assert ws.full_reads == 1
+    assert ws.ranges[-1][0] == "A3:A"
+    assert _column(store, "Monto") == [100, 200]
+
+
+def test_fresh_mirror_does_not_touch_the_sheet(tmp_path):
+    store = TransactionStore(str(tmp_path / "tx.db"), max_staleness=600)
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+
+    def boom():
+        raise AssertionError("sheet read while the mirror was fresh")
+
+    store.refresh_all(boom, ("income",))
+    store.close()
+
+
+def test_forced_full_resync_picks_up_edits(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    ws.values[1] = _row("a", "01/05/2026", 999)
+
+    _refresh(store, ws)  # incremental: edit not visible
+    assert _column(store, "Monto") == [100]
+
+    _refresh(store, ws, force_full=True)
+    assert _column(store, "Monto") == [999]
+
+
+def test_write_through_appends_without_reading(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    record = dict(zip(HEADER, _row("b", "03/05/2026", 50)))
+
+    store.record("income", record, "Ventas!A3:I3")
+
+    assert _column(store, "Monto") == [100, 50]
+    # the next incremental pull starts below the written row
+    _refresh(store, ws)
+    assert ws.ranges[-1][0] == "A4:A"
+
+
+def test_write_through_without_range_marks_mirror_stale(tmp_path):
+    store = TransactionStore(str(tmp_path / "tx.db"), max_staleness=600)
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    ws.values.append(_row("b", "02/05/2026", 200))
+
+    store.record("income", dict(zip(HEADER, ws.values[-1])), None)
+    _refresh(store, ws)
+
+    assert ws.ranges[-1][0] == "A3:A"
+    assert _column(store, "Monto") == [100, 200]
+    store.close()
+
+
+def test_missing_required_column_is_reported(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    ws.values[0] = [c if c != "Monto" else "Importe" for c in HEADER]
+
+    with pytest.raises(ValueError, match="Faltan columnas en la hoja Ventas: Monto"):
+        _refresh(store, ws)
+
+
+def test_unparseable_cells_leave_the_row_out_of_reports(store):
+    ws = _Worksheet([_row("a", "mayo", "mucho")])
+    _refresh(store, ws)
+
+    assert store.latest(["income"], ["16162b8f"], 1).empty
+    assert store.incomplete_rows("income", ["16162b8f"]) == 1
+
+
+def test_amounts_with_thousands_separators_are_read(store):
+    ws = _Worksheet([_row("a", "01/05/2026", "1,500"), _row("b", "02/05/2026", 250.5)])
+    spreadsheet = _Spreadsheet(income=ws)
+
+    store.refresh_all(lambda: spreadsheet, ("income",))
+
+    assert spreadsheet.params["valueRenderOption"] == "UNFORMATTED_VALUE"
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 1750.5
+    assert store.incomplete_rows("income", ["16162b8f"]) == 0
+
+
+# ── running monthly totals ──────────────────────────────────────────
+
+def test_totals_follow_appended_and_written_rows(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    ws.values.append(_row("b", "02/05/2026", 200))
+    _refresh(store, ws)
+    store.record("income", dict(zip(HEADER, _row("c", "03/05/2026", 50))), "Ventas!A4:I4")
+
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 350
+    assert store.month_total("income", 2026, 6, ["16162b8f"]) == 0
+
+
+def test_provisional_write_is_not_counted_twice(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    ws.values.append(_row("b", "02/05/2026", 200))
+
+    store.record("income", dict(zip(HEADER, ws.values[-1])), None)
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 300
+
+    _refresh(store, ws)  # pulls row b for real
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 300
+    assert _column(store, "Monto") == [100, 200]
+
+
+def test_full_resync_reports_drift_from_hand_edits(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    assert _refresh(store, ws, force_full=True) == []
+
+    ws.values[1] = _row("a", "01/05/2026", 150)
+    drift = _refresh(store, ws, force_full=True)
+
+    assert [(d.year, d.month, d.running, d.actual) for d in drift] == [(2026, 5, 100, 150)]
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 150
+
+
+def test_two_workers_pulling_the_same_rows_count_them_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "tx.db")
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    first = TransactionStore(path, max_staleness=0)
+    second = TransactionStore(path, max_staleness=0)
+    _refresh(first, ws)
+    _refresh(second, ws)
+
+    ws.values.append(_row("b", "02/05/2026", 200))
+    stale = second._state("income")
+    _refresh(first, ws)
+    # raced: second planned its pull before first's landed, and pulls the same rows
+    monkeypatch.setattr(second, "_state", lambda kind: stale)
+    _refresh(second, ws)
+    monkeypatch.undo()
+
+    assert first.month_total("income", 2026, 5, ["16162b8f"]) == 300
+    assert second._state("income")[1] == 2
+    first.close()
+    second.close()
+
+
+
+def _expense_row(tx_id, fecha, monto):
+    return [tx_id, fecha, f"{fecha} 12:00:00", "16162b8f", "TRUE", str(monto),
+            "Farmacia", "remedio", "QR"]
+
+
+def test_refresh_all_reads_every_sheet_in_shared_requests(store):
+    expenses = _Worksheet([_expense_row("e", "03/05/2026", 40)])
+    expenses.values[0] = [
+        "EntradaMaterialID", "EntradaMaterialFecha", "EntradaMaterialHora", "UsuarioID",
+        "EntradaMaterialStatus", "Monto", "Categoria", "Notas", "MetodoPago",
+    ]
+    incomes = _Worksheet([_row("a", "01/05/2026", 100)])
+    spreadsheet = _Spreadsheet(income=incomes, expense=expenses)
+
+    store.refresh_all(lambda: spreadsheet)
+    assert spreadsheet.requests == 2  # headers, then columns
+
+    incomes.values.append(_row("b", "02/05/2026", 200))
+    store.refresh_all(lambda: spreadsheet)
+    assert spreadsheet.requests == 3  # a pull needs no header
+
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 300
+    assert _column(store, "Notas", kind="expense") == ["remedio"]
+
+
+def test_reads_are_not_blocked_while_a_sync_waits_on_the_sheet(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100)])
+    _refresh(store, ws)
+    ws.values.append(_row("b", "02/05/2026", 200))
+    reading, release = threading.Event(), threading.Event()
+
+    class SlowSpreadsheet(_Spreadsheet):
+        def values_batch_get(self, ranges, params=None):
+            reading.set()
+            release.wait(5)
+            return super().values_batch_get(ranges, params)
+
+    sync = threading.Thread(
+        target=store.refresh_all, args=(lambda: SlowSpreadsheet(income=ws), ("income",))
+    )
+    sync.start()
+    assert reading.wait(5)
+
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 100  # not blocked
+    release.set()
+    sync.join()
+    assert store.month_total("income", 2026, 5, ["16162b8f"]) == 300
+
+
+def test_refresh_all_writes_nothing_when_one_header_is_broken(store):
+    broken = _Worksheet([_row("e", "03/05/2026", 40)])  # income header on the expense sheet
+    spreadsheet = _Spreadsheet(income=_Worksheet([_row("a", "01/05/2026", 100)]), expense=broken)
+
+    with pytest.raises(ValueError, match="Faltan columnas en la hoja EntradaMaterial"):
+        store.refresh_all(lambda: spreadsheet)
+
+    assert not store.has_synced("income")
+
+
+def test_aggregate_groups_running_totals_over_a_range(store):
+    ws = _Worksheet([
+        _row("a", "15/12/2025", 100),
+        _row("b", "02/01/2026", 200),
+        _row("c", "20/01/2026", 50),
+        _row("d", "01/03/2026", 999),  # outside the range
+    ])
+    ws.values[3][8] = "Freelance"
+    _refresh(store, ws)
+    record = dict(zip(HEADER, _row("e", "25/01/2026", 30)))
+    store.record("income", record, "Ventas!A6:I6")
+
+    users = ["16162b8f"]
+    assert store.aggregate("income", users, (2025, 12), (2026, 1)) == [(380.0, 4)]
+    assert store.aggregate("income", users, (2025, 12), (2026, 1), by=("year", "month")) == [
+        (2025, 12, 100.0, 1),
+        (2026, 1, 280.0, 3),
+    ]
+    assert store.aggregate("income", users, (2026, 1), (2026, 1), by=("categoria",)) == [
+        ("Freelance", 50.0, 1),
+        ("Salario", 230.0, 2),
+    ]
+    assert store.aggregate("income", users, (2024, 1), (2024, 12)) == []
+    with pytest.raises(ValueError):
+        store.aggregate("income", users, (2026, 1), (2026, 1), by=("notas",))
+
+
+def test_aggregate_over_every_user(store):
+    ws = _Worksheet([_row("a", "01/05/2026", 100), _row("b", "02/05/2026", 200)])
+    ws.values[2][3] = "otro"
+    _refresh(store, ws)
+
+    assert store.aggregate("income", ["16162b8f"], (2026, 5), (2026, 5)) == [(100.0, 1)]
+    assert store.aggregate("income", None, (2026, 5), (2026, 5)) == [(300.0, 2)]
+
+
+def test_old_schema_is_dropped_and_resynced(tmp_path):
+
+    path = str(tmp_path / "tx.db")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE monthly_totals (kind, year, month, usuario_id, total, count)")
+    con.execute("CREATE TABLE sync_state (kind, header, row_count, synced_at, full_synced_at)")
+    con.execute("INSERT INTO sync_state VALUES ('income', '[]', 5, 0, 0)")
+    con.commit()
+    con.close()
+
+    store = TransactionStore(path, max_staleness=0)
+    assert not store.has_synced("income")
+    _refresh(store, _Worksheet([_row("a", "01/05/2026", 100)]))
+    assert store.aggregate("income", ["16162b8f"], (2026, 5), (2026, 5), by=("metodo_pago",)) == [
+        ("Efectivo", 100.0, 1)
+    ]
+    store.close()
+
+
+def test_sync_writes_one_partition_per_month(store):
+    ws = _Worksheet([_row("a", "01/04/2026", 100), _row("b", "02/05/2026", 200),
+                     _row("c", "03/05/2026", "abc")])  # no amount: left out
+    _refresh(store, ws)
+
+    assert store.partitions.months("income") == [(2026, 4), (2026, 5)]
+    may = store.partitions.frame("income", 2026, 5)
+    assert may["Monto"].tolist() == [200]
+    assert may["UsuarioID"].tolist() == ["16162b8f"]
+    assert may["Fecha"].dtype == "datetime64[ns]"
+
+
+def test_partition_frames_decode_codes_as_categoricals(store):
+    ws = _Worksheet([_row("a", "01/04/2026", 100), _row("b", "02/05/2026", 200)])
+    ws.values[2][8] = "Bonificaciones"
+    _refresh(store, ws)
+
+    april = store.partitions.frame("income", 2026, 4)
+    may = store.partitions.frame("income", 2026, 5)
+
+    assert april["Categoria"].dtype == "category"
+    assert april["Categoria"].cat.codes.tolist() == [0]
+    assert may["Categoria"].cat.codes.tolist() == [1]  # one dictionary for every month
+    assert may["Categoria"].tolist() == ["Bonificaciones"]
+    assert may["MetodoPago"].tolist() == ["Efectivo"]
+
+
+def _spy_on_writes(store, monkeypatch) -> list:
+    written = []
+    write = store.partitions.write
+
+    def spy(kind, year, month, rows):
+        written.append((year, month))
+        write(kind, year, month, rows)
+
+    monkeypatch.setattr(store.partitions, "write", spy)
+    return written
+
+
+def test_pull_rewrites_only_the_months_it_touched(store, monkeypatch):
+    ws = _Worksheet([_row("a", "01/04/2026", 100), _row("b", "02/05/2026", 200)])
+    _refresh(store, ws)
+    ws.values.append(_row("c", "20/05/2026", 50, nota="bono"))
+    written = _spy_on_writes(store, monkeypatch)
+
+    _refresh(store, ws)
+    assert written == []  # exported by the next read
+    store.latest(["income"], ["16162b8f"], 1)
+
+    assert written == [(2026, 5)]
+    assert store.partitions.frame("income", 2026, 5)["Notas"].tolist() == ["sueldo", "bono"]
+
+
+def test_write_throughs_rewrite_a_month_once_per_read(store, monkeypatch):
+    ws = _Worksheet([_row("a", "02/05/2026", 200)])
+    _refresh(store, ws)
+    written = _spy_on_writes(store, monkeypatch)
+
+    for n, row in enumerate((3, 4, 5)):
+        record = dict(zip(HEADER, _row(f"w{n}", "10/05/2026", 10 + n)))
+        store.record("income", record, f"Ventas!A{row}:I{row}")
+    df = store.latest(["income"], ["16162b8f"], 10)
+    store.latest(["income"], ["16162b8f"], 10)
+
+    assert written == [(2026, 5)]
+    assert df["Monto"].tolist() == [200, 10, 11, 12]
+
+
+def test_long_notes_are_cut_in_the_partitions(store):
+    note = "x" * (partitions.NOTE_WIDTH * 10)
+    _refresh(store, _Worksheet([_row("a", "01/05/2026", 100, nota=note),
+                                _row("b", "02/05/2026", 200)]))
+
+    array = store.partitions.read("income", 2026, 5)
+    assert array.dtype["notas"].itemsize == partitions.NOTE_WIDTH * 4
+    assert store.partitions.frame("income", 2026, 5)["Notas"][0].endswith("…")
+    con = sqlite3.connect(store.path)
+    kept = con.execute("SELECT notas FROM transactions WHERE tx_id = 'a'").fetchone()[0]
+    con.close()
+    assert kept == note  # the mirror keeps it whole
+
+
+def test_latest_reads_only_the_months_it_needs(store, monkeypatch):
+    ws = _Worksheet([_row(str(m), f"01/{m:02d}/2026", m) for m in range(1, 7)])
+    _refresh(store, ws)
+    read = []
+    frame = store.partitions.frame
+
+    def spy(kind, year, month):
+        read.append(month)
+        return frame(kind, year, month)
+
+    monkeypatch.setattr(store.partitions, "frame", spy)
+
+    df = store.latest(["income", "expense"], ["16162b8f"], 2)
+
+    assert read == [6, 5]  # expense never synced: skipped
+    assert df["Monto"].tolist() == [6, 5]
+    assert set(df["kind"]) == {"income"}
+
+
+def test_full_resync_drops_months_that_no_longer_have_rows(store):
+    ws = _Worksheet([_row("a", "01/04/2026", 100), _row("b", "02/05/2026", 200)])
+    _refresh(store, ws)
+    del ws.values[1]
+
+    _refresh(store, ws, force_full=True)
+
+    assert store.partitions.months("income") == [(2026, 5)]
+
+
+def test_missing_partitions_are_rebuilt_from_the_mirror(store):
+    _refresh(store, _Worksheet([_row("a", "01/05/2026", 100)]))
+    shutil.rmtree(store.partitions.root)
+
+    assert store.latest(["income"], ["16162b8f"], 5)["Monto"].tolist() == [100]
+    assert store.partitions.months("income") == [(2026, 5)]
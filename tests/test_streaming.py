@@ -0,0 +1,106 @@
+"""Tests for streamed replies (streaming.py) with a fake Telegram bot."""
+
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+from streaming import ReplyStreamer, stream_agent, visible_reply
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def send_chat_action(self, chat_id, action):
+        self.calls.append(("action", action))
+
+    async def send_message(self, chat_id, text):
+        self.calls.append(("send", text))
+        return SimpleNamespace(message_id=7)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.calls.append(("edit", text))
+
+
+def test_visible_reply_hides_reasoning():
+    assert visible_reply("<think>hmm") == ""
+    assert visible_reply("<think>hmm</think> Listo") == "Listo"
+    assert visible_reply("Hola") == "Hola"
+
+
+def test_streamer_posts_then_edits_at_most_once_per_interval():
+    async def scenario():
+        bot = FakeBot()
+        reply = ReplyStreamer(bot, 1, min_interval=60)
+        await reply.start()
+        for text in ("Hola", "Hola que", "Hola que tal"):
+            await reply.update(text)
+        await reply.finish("Hola que tal mundo")
+        return bot.calls
+
+    assert _run(scenario()) == [
+        ("action", "typing"),
+        ("send", "Hola"),
+        ("edit", "Hola que tal mundo"),
+    ]
+
+
+def test_streamer_sends_plainly_when_nothing_was_streamed():
+    async def scenario():
+        bot = FakeBot()
+        reply = ReplyStreamer(bot, 1)
+        await reply.finish("Gasto registrado.")
+        return bot.calls
+
+    assert _run(scenario()) == [("send", "Gasto registrado.")]
+
+
+def test_streamer_backs_off_on_retry_after():
+    async def scenario():
+        bot = FakeBot()
+
+        async def throttled(text, chat_id, message_id):
+            raise RetryAfter(30)
+
+        reply = ReplyStreamer(bot, 1, min_interval=0)
+        await reply.update("Hola")
+        bot.edit_message_text = throttled
+        await reply.update("Hola que")  # throttled: dropped, next edit pushed back
+        del bot.edit_message_text
+        await reply.update("Hola que tal")  # still inside the back-off
+        return bot.calls
+
+    assert _run(scenario()) == [("send", "Hola")]
+
+
+def test_stream_agent_passes_visible_tokens_and_returns_final_state(monkeypatch):
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    import agent
+
+    monkeypatch.setattr(
+        agent,
+        "llm_with_tools",
+        GenericFakeChatModel(messages=iter([AIMessage(content="<think>x</think> Hola mundo")])),
+    )
+    seen = []
+
+    async def on_text(text):
+        seen.append(text)
+
+    state = _run(stream_agent(
+        agent.build_graph(),
+        {"messages": [HumanMessage(content="hola")], "chat_id": 1},
+        {"recursion_limit": 10},
+        on_text,
+    ))
+
+    assert seen[-1] == "Hola mundo"
+    assert all("think" not in text for text in seen)
+    assert state["messages"][-1].content == "Hola mundo"
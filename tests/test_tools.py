@@ -1,5 +1,7 @@
 """Tests for the pure/no-network paths in tools.py."""
 
+from datetime import datetime
+
 import pytest
 
 from config import (
@@ -24,35 +26,48 @@ from tools import (
 # ── _fuzzy_match ───────────────────────────────────────────────────
 
 def test_fuzzy_match_exact_case_insensitive():
-    assert _fuzzy_match("efectivo", ENTRADA_PAYMENT_METHODS) == "Efectivo"
+    assert _fuzzy_match("efectivo", "expense", "metodo_pago") == "Efectivo"
 
 
 def test_fuzzy_match_prefix():
     # "Alimentación (comestibles, restaurantes)" starts with "aliment"
-    result = _fuzzy_match("aliment", ENTRADA_CATEGORIES)
+    result = _fuzzy_match("aliment", "expense", "categoria")
     assert result is not None
     assert result.startswith("Alimentación")
 
 
 def test_fuzzy_match_contains():
     # "comestibles" is inside the alimentacion label but not at the start
-    result = _fuzzy_match("comestibles", ENTRADA_CATEGORIES)
+    result = _fuzzy_match("comestibles", "expense", "categoria")
     assert result is not None
     assert "comestibles" in result.lower()
 
 
 def test_fuzzy_match_no_match_returns_none():
-    assert _fuzzy_match("banana-empanada", ENTRADA_CATEGORIES) is None
+    assert _fuzzy_match("banana-empanada", "expense", "categoria") is None
 
 
 def test_fuzzy_match_strips_whitespace():
-    assert _fuzzy_match("  efectivo  ", ENTRADA_PAYMENT_METHODS) == "Efectivo"
+    assert _fuzzy_match("  efectivo  ", "expense", "metodo_pago") == "Efectivo"
 
 
-def test_fuzzy_match_exact_wins_over_prefix():
+def test_fuzzy_match_exact_wins_over_prefix(monkeypatch):
     """A shorter valid entry that is an exact match must beat a longer one it prefixes."""
-    valid = ["Cripto", "CriptoLargo"]
-    assert _fuzzy_match("cripto", valid) == "Cripto"
+    from enums import DEFAULTS, write_cache
+
+    monkeypatch.setattr(tools.enum_registry, "reload_interval", 0)
+    write_cache(
+        tools.enum_registry.path, {**DEFAULTS, "ENTRADA_PAYMENT_METHODS": ["CriptoLargo", "Cripto"]}
+    )
+    assert _fuzzy_match("cripto", "expense", "metodo_pago") == "Cripto"
+
+
+def test_fuzzy_match_builds_matchers_once_per_registry_version():
+    matcher = tools._matcher("expense", "categoria")
+
+    _fuzzy_match("aliment", "expense", "categoria")
+
+    assert tools._matcher("expense", "categoria") is matcher
 
 
 # ── add_expense / add_income: input-validation branches ────────────
@@ -191,8 +206,8 @@ def test_add_expense_keeps_transaction_when_report_fails(monkeypatch):
         def __init__(self):
             self.rows = []
 
-        def append_row(self, row, value_input_option=None):
-            self.rows.append((row, value_input_option))
+        def append_rows(self, rows, value_input_option=None):
+            self.rows.extend((row, value_input_option) for row in rows)
 
     class DummySpreadsheet:
         def __init__(self):
@@ -211,11 +226,7 @@ def test_add_expense_keeps_transaction_when_report_fails(monkeypatch):
     dummy_client = DummyClient()
     monkeypatch.setattr(tools, "get_gspread_client", lambda: dummy_client)
 
-    class DummyReportTool:
-        def invoke(self, payload):
-            return "Error generando reporte: boom"
-
-    monkeypatch.setattr(tools, "generate_monthly_report", DummyReportTool())
+    monkeypatch.setattr(tools, "_balance_after_write", lambda: "Error generando reporte: boom")
 
     msg = add_expense.invoke(
         {
@@ -233,7 +244,7 @@ def test_add_expense_keeps_transaction_when_report_fails(monkeypatch):
 
 def test_add_income_raises_when_append_fails(monkeypatch):
     class DummyWorksheet:
-        def append_row(self, row, value_input_option=None):
+        def append_rows(self, rows, value_input_option=None):
             raise RuntimeError("sheet down")
 
     class DummySpreadsheet:
@@ -248,12 +259,11 @@ def test_add_income_raises_when_append_fails(monkeypatch):
     monkeypatch.setattr(tools, "get_gspread_client", lambda: dummy_client)
     called = {"report": False}
 
-    class DummyReportTool:
-        def invoke(self, _payload):
-            called["report"] = True
-            return "Balance del mes:\nIngresos: $0.00 | Gastos: $0.00\nTotal disponible: $0.00"
+    def balance():
+        called["report"] = True
+        return "Balance del mes:\nIngresos: $0.00 | Gastos: $0.00\nTotal disponible: $0.00"
 
-    monkeypatch.setattr(tools, "generate_monthly_report", DummyReportTool())
+    monkeypatch.setattr(tools, "_balance_after_write", balance)
 
     with pytest.raises(RuntimeError, match="No se pudo registrar el ingreso"):
         add_income.invoke(
@@ -279,9 +289,11 @@ def test_categories_lists_are_disjoint_enough_for_errors():
 class _DummyWorksheet:
     def __init__(self):
         self.rows = []
+        self.requests = 0
 
-    def append_row(self, row, value_input_option=None):
-        self.rows.append(row)
+    def append_rows(self, rows, value_input_option=None):
+        self.requests += 1
+        self.rows.extend(rows)
 
 
 class _DummySpreadsheet:
@@ -300,9 +312,8 @@ class _DummyClient:
         return self.spreadsheet
 
 
-class _DummyReportTool:
-    def invoke(self, _payload):
-        return "Balance del mes:\nIngresos: $0.00 | Gastos: $0.00\nTotal disponible: $0.00"
+def _dummy_balance():
+    return "Balance del mes:\nIngresos: $0.00 | Gastos: $0.00\nTotal disponible: $0.00"
 
 
 @pytest.fixture
@@ -310,7 +321,7 @@ def sheets(monkeypatch):
     """Patch gspread + report so add_expense/add_income run fully offline."""
     client = _DummyClient()
     monkeypatch.setattr(tools, "get_gspread_client", lambda: client)
-    monkeypatch.setattr(tools, "generate_monthly_report", _DummyReportTool())
+    monkeypatch.setattr(tools, "_balance_after_write", _dummy_balance)
     return client.spreadsheet.worksheet_obj
 
 
@@ -381,9 +392,11 @@ def test_dedup_expires_after_window(sheets, monkeypatch):
     add_expense.invoke(_EXPENSE)
 
     # Pretend the dedup window already elapsed
-    real_monotonic = tools.time.monotonic
+    import dedup
+
+    real_monotonic = dedup.time.monotonic
     monkeypatch.setattr(
-        tools.time,
+        dedup.time,
         "monotonic",
         lambda: real_monotonic() + tools.DEDUP_WINDOW_SECONDS + 1,
     )
@@ -393,6 +406,34 @@ def test_dedup_expires_after_window(sheets, monkeypatch):
     assert len(sheets.rows) == 2
 
 
+def test_balance_after_write_reads_no_sheet_once_mirror_synced(sheet_data, monkeypatch):
+    sheet_data(
+        ventas=[_income_record("01/05/2026", 1000)],
+        gastos=[_expense_record("02/05/2026", 300)],
+    )
+    tools.generate_monthly_report.invoke({"month": 5, "year": 2026})  # first sync
+
+    class WriteOnlyWorksheet:
+        def append_rows(self, rows, value_input_option=None):
+            return {"updates": {"updatedRange": "EntradaMaterial!A3:I3"}}
+
+        def __getattr__(self, name):
+            raise AssertionError(f"unexpected sheet call: {name}")
+
+    class May3:
+        @staticmethod
+        def now(tz):
+            return datetime(2026, 5, 3, 10, 0, tzinfo=tz)
+
+    monkeypatch.setattr(tools, "_worksheet", lambda name: WriteOnlyWorksheet())
+    monkeypatch.setattr(tools, "datetime", May3)
+
+    msg = add_expense.invoke(_EXPENSE)
+
+    assert "Gastos: $5,300.00" in msg
+    assert "Total disponible: $-4,300.00" in msg
+
+
 def test_failed_append_does_not_block_retry(monkeypatch):
     """If the sheet write fails, the transaction must NOT be remembered as recorded."""
     calls = {"n": 0}
@@ -401,11 +442,11 @@ def test_failed_append_does_not_block_retry(monkeypatch):
         def __init__(self):
             self.rows = []
 
-        def append_row(self, row, value_input_option=None):
+        def append_rows(self, rows, value_input_option=None):
             calls["n"] += 1
             if calls["n"] == 1:
                 raise RuntimeError("sheet down")
-            self.rows.append(row)
+            self.rows.extend(rows)
 
     worksheet = FlakyWorksheet()
 
@@ -418,7 +459,7 @@ def test_failed_append_does_not_block_retry(monkeypatch):
             return Spreadsheet()
 
     monkeypatch.setattr(tools, "get_gspread_client", lambda: Client())
-    monkeypatch.setattr(tools, "generate_monthly_report", _DummyReportTool())
+    monkeypatch.setattr(tools, "_balance_after_write", _dummy_balance)
 
     with pytest.raises(RuntimeError, match="No se pudo registrar el gasto"):
         add_expense.invoke(_EXPENSE)
@@ -461,11 +502,28 @@ def _income_record(fecha, monto, categoria="Salario", nota="sueldo", usuario="16
 
 
 class _RecordsWorksheet:
+    """Serves records the way the Sheets API does: a header row, then strings."""
+
     def __init__(self, records):
         self.records = records
 
-    def get_all_records(self):
-        return self.records
+    def get_all_values(self):
+        if not self.records:
+            return []
+        header = list(self.records[0])
+        return [header] + [[str(r.get(c, "")) for c in header] for r in self.records]
+
+    def read(self, range_name, dimension):
+        """Values of "1:1" (ROWS) or "B2:B" (COLUMNS), trimmed like the API does."""
+        values = self.get_all_values()
+        if dimension == "ROWS":
+            row = int(range_name.split(":")[0])
+            return [values[row - 1]] if len(values) >= row else []
+        column, first_row = ord(range_name[0]) - ord("A"), int(range_name.split(":")[0][1:])
+        cells = [row[column] for row in values[first_row - 1:]]
+        while cells and cells[-1] == "":
+            cells.pop()
+        return [cells] if cells else []
 
 
 class _RecordsSpreadsheet:
@@ -474,10 +532,20 @@ class _RecordsSpreadsheet:
             "Ventas": _RecordsWorksheet(ventas),
             "EntradaMaterial": _RecordsWorksheet(gastos),
         }
+        self.batch_requests = []
 
     def worksheet(self, name):
         return self._sheets[name]
 
+    def values_batch_get(self, ranges, params=None):
+        self.batch_requests.append(ranges)
+        value_ranges = []
+        for qualified in ranges:  # "'Ventas'!B2:B"
+            name, range_name = qualified.split("!")
+            values = self._sheets[name.strip("'")].read(range_name, params["majorDimension"])
+            value_ranges.append({"range": qualified, "values": values} if values else {"range": qualified})
+        return {"valueRanges": value_ranges}
+
 
 @pytest.fixture
 def sheet_data(monkeypatch):
@@ -491,6 +559,7 @@ def sheet_data(monkeypatch):
                 return spreadsheet
 
         monkeypatch.setattr(tools, "get_gspread_client", lambda: Client())
+        return spreadsheet
 
     return install
 
@@ -569,6 +638,51 @@ def test_spending_by_category_sorts_biggest_first(sheet_data):
     assert "Total: $1,000.00" in msg
 
 
+def test_spending_by_category_groups_unlisted_categories(sheet_data):
+    sheet_data(
+        gastos=[
+            _expense_record("05/05/2026", 100, categoria="Comida"),
+            _expense_record("06/05/2026", 50, categoria=""),
+            _expense_record("10/05/2026", 850),
+        ]
+    )
+    msg = spending_by_category.invoke({"month": 5, "year": 2026})
+    lines = msg.splitlines()
+
+    assert lines[1] == "- Alimentación: $850.00 (85%)"
+    assert lines[2] == "- Fuera de la lista: $150.00 (15%)"
+    assert "Comida" not in msg
+    assert "calidad de datos" in lines[-1]
+
+
+def test_data_quality_report_lists_values_outside_the_enums(sheet_data):
+    sheet_data(
+        ventas=[_income_record("01/05/2026", 1000)],
+        gastos=[
+            _expense_record("05/05/2026", 100, categoria="Comida"),
+            _expense_record("06/05/2026", 40, categoria="Comida"),
+            _expense_record("07/05/2026", "abc"),
+            _expense_record("08/05/2026", 5, categoria="Otra", usuario="intruso"),
+        ],
+    )
+    msg = tools.data_quality_report.invoke({})
+
+    assert msg.splitlines() == [
+        "Problemas de datos en la planilla:",
+        "EntradaMaterial:",
+        '- Categoría fuera de la lista: "Comida" (2 filas, $140.00)',
+        "- 1 fila sin fecha o monto válidos",
+    ]
+
+
+def test_data_quality_report_with_clean_data(sheet_data):
+    sheet_data(gastos=[_expense_record("10/05/2026", 900)])
+
+    msg = tools.data_quality_report.invoke({})
+
+    assert msg.startswith("Los datos de la planilla están en orden")
+
+
 def test_spending_by_category_reports_empty_month(sheet_data):
     sheet_data(gastos=[_expense_record("10/05/2026", 900)])
     msg = spending_by_category.invoke({"month": 1, "year": 2020})
@@ -617,3 +731,164 @@ def test_recent_transactions_rejects_non_positive_limit(sheet_data):
     msg = list_recent_transactions.invoke({"limit": 0})
 
     assert msg.startswith("Error listando movimientos:")
+
+
+def test_shared_dedup_sees_other_workers_writes(sheets, monkeypatch, tmp_path):
+    from dedup import RecentWrites
+
+    path = str(tmp_path / "dedup.db")
+    monkeypatch.setattr(tools, "transaction_guard", RecentWrites(60, path=path))
+    add_expense.invoke(_EXPENSE)
+
+    # another worker process: its own guard on the same file
+    other = RecentWrites(60, path=path)
+    monkeypatch.setattr(tools, "transaction_guard", other)
+    second = add_expense.invoke(_EXPENSE)
+
+    assert "ya fue registrado" in second
+    assert other.stats()["suppressed"] == 1
+    assert len(sheets.rows) == 1
+    other.reset()
+
+
+def test_dedup_is_per_chat(sheets):
+    first = add_expense.invoke({**_EXPENSE, "chat_id": 1})
+    other_chat = add_expense.invoke({**_EXPENSE, "chat_id": 2})
+    same_chat = add_expense.invoke({**_EXPENSE, "chat_id": 1})
+
+    assert "ya fue registrado" not in other_chat
+    assert "ya fue registrado" in same_chat
+    assert len(sheets.rows) == 2
+    assert tools.transaction_guard.stats()["suppressed"] == 1
+
+
+def test_add_expenses_records_the_list_in_one_request(sheets):
+    add_expense.invoke(_EXPENSE)
+    msg = tools.add_expenses.invoke(
+        {
+            "expenses": [
+                _EXPENSE,  # just recorded: skipped
+                {"amount": 1200, "description": "taxi", "category": "Transporte"},
+                {"amount": 800, "description": "farmacia", "category": "Farmacia",
+                 "payment_method": "QR"},
+            ]
+        }
+    )
+
+    lines = msg.split("\n\n")[0].split("\n")
+    assert "ya fue registrado" in lines[0]
+    assert lines[1].startswith("Gasto de $1200 en taxi registrado (categoría: Transporte")
+    assert "Balance del mes" in msg
+    assert sheets.requests == 2
+    assert [row[7] for row in sheets.rows] == ["pizza", "taxi", "farmacia"]
+
+
+def test_add_expenses_records_nothing_when_one_item_is_invalid(sheets):
+    with pytest.raises(ValueError, match="no válida"):
+        tools.add_expenses.invoke(
+            {
+                "expenses": [
+                    {"amount": 1200, "description": "taxi", "category": "Transporte"},
+                    {"amount": 800, "description": "sueldo", "category": "Salario"},
+                ]
+            }
+        )
+
+    assert sheets.rows == []
+    assert tools.transaction_guard.stats()["claimed"] == 0
+
+
+def test_reports_read_both_sheets_in_the_same_requests(sheet_data):
+    spreadsheet = sheet_data(
+        ventas=[_income_record("01/05/2026", 1000)],
+        gastos=[_expense_record("02/05/2026", 300)],
+    )
+
+    msg = list_recent_transactions.invoke({"limit": 5})
+
+    assert "Últimos 2 movimientos" in msg
+    headers, columns = spreadsheet.batch_requests
+    assert headers == ["'EntradaMaterial'!1:1", "'Ventas'!1:1"]
+    assert {r.split("!")[0] for r in columns} == {"'EntradaMaterial'", "'Ventas'"}
+
+
+class _May2026:
+    @staticmethod
+    def now(tz):
+        return datetime(2026, 5, 20, 10, 0, tzinfo=tz)
+
+
+def test_monthly_trend_lists_each_month_of_the_window(sheet_data, monkeypatch):
+    monkeypatch.setattr(tools, "datetime", _May2026)
+    sheet_data(
+        ventas=[_income_record("01/03/2026", 1000), _income_record("01/05/2026", 2000)],
+        gastos=[_expense_record("10/03/2026", 300), _expense_record("10/01/2026", 999)],
+    )
+
+    msg = tools.monthly_trend.invoke({"months": 3})
+    lines = msg.splitlines()
+
+    assert lines[0] == "Últimos 3 meses:"
+    assert lines[1].startswith("- marzo 2026: ingresos $1,000.00 | gastos $300.00")
+    assert lines[2].startswith("- abril 2026: ingresos $0.00")
+    assert lines[3].startswith("- mayo 2026: ingresos $2,000.00")
+    assert lines[4] == "Total: ingresos $3,000.00 | gastos $300.00 | balance $2,700.00"
+
+
+def test_compare_years_cuts_both_years_at_the_current_month(sheet_data, monkeypatch):
+    monkeypatch.setattr(tools, "datetime", _May2026)
+    sheet_data(
+        ventas=[_income_record("01/02/2026", 1500), _income_record("01/02/2025", 1000),
+                _income_record("01/11/2025", 5000)],  # after May: not comparable yet
+        gastos=[_expense_record("10/03/2026", 500)],
+    )
+
+    msg = tools.compare_years.invoke({})
+
+    assert msg.splitlines() == [
+        "2026 vs 2025 (enero a mayo):",
+        "Ingresos: $1,500.00 vs $1,000.00 (+50%)",
+        "Gastos: $500.00 vs $0.00 (sin datos del año anterior)",
+        "Balance: $1,000.00 vs $1,000.00",
+    ]
+
+
+def test_recent_transactions_pages_back_with_offset(sheet_data):
+    sheet_data(
+        ventas=[_income_record(f"{day:02d}/06/2026", day, nota=f"i{day}") for day in (1, 3, 5)],
+        gastos=[_expense_record(f"{day:02d}/06/2026", day, nota=f"g{day}") for day in (2, 4)],
+    )
+
+    first = list_recent_transactions.invoke({"limit": 2}).splitlines()
+    second = list_recent_transactions.invoke({"limit": 2, "offset": 2}).splitlines()
+    last = list_recent_transactions.invoke({"limit": 2, "offset": 4}).splitlines()
+
+    assert [l.split(" | ")[3][:2] for l in first[1:3]] == ["i5", "g4"]
+    assert first[-1] == "(quedan 3 más antiguos; siguientes: offset=2)"
+    assert second[0] == "Movimientos 3 a 4, del más reciente:"
+    assert [l.split(" | ")[3][:2] for l in second[1:3]] == ["i3", "g2"]
+    assert last == ["Movimientos 5 a 5, del más reciente:", last[1]]
+    assert "i1" in last[1]
+    assert list_recent_transactions.invoke({"offset": 5}) == (
+        "No hay movimientos anteriores a los últimos 5."
+    )
+
+
+def test_validation_and_tool_descriptions_follow_the_enum_registry(monkeypatch):
+    from enums import DEFAULTS, write_cache
+
+    monkeypatch.setattr(tools.enum_registry, "reload_interval", 0)
+    assert "Criptomonedas" not in tools.add_expense.description
+    write_cache(
+        tools.enum_registry.path,
+        {**DEFAULTS, "ENTRADA_CATEGORIES": ["Farmacia", "Criptomonedas (exchanges)"]},
+    )
+
+    assert tools._validate_transaction_inputs(
+        100, "btc", "cripto", "Efectivo", "expense"
+    )[2] == "Criptomonedas (exchanges)"
+    with pytest.raises(ValueError, match="no válida"):
+        tools._validate_transaction_inputs(100, "pizza", "Alimentación", "Efectivo", "expense")
+
+    assert tools.describe_tools() == 1
+    assert "One of these categories: Farmacia, Criptomonedas\n" in tools.add_expense.description
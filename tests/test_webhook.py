@@ -0,0 +1,191 @@
+"""Tests for the webhook server, driven by POSTing update JSON to it locally."""
+
+import asyncio
+import json
+
+from webhook import LatencyTracker, WebhookServer
+
+SECRET = "s3cret"
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _post(port, payload, secret=SECRET, path="/telegram"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode()
+    headers = f"POST {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\nConnection: close\r\n"
+    if secret is not None:
+        headers += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+    writer.write(headers.encode() + b"\r\n" + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def _send_raw(port, request: bytes):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+def _update(update_id, text="gasté 100 en farmacia"):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "text": text,
+        },
+    }
+
+
+async def _serving(handle, **kwargs):
+    server = WebhookServer(handle, secret_token=SECRET, **kwargs)
+    await server.start("127.0.0.1", 0)
+    return server
+
+
+def test_posted_updates_are_acknowledged_and_handled_in_order():
+    async def scenario():
+        handled = []
+
+        async def handle(payload):
+            handled.append(payload["update_id"])
+
+        server = await _serving(handle)
+        statuses = [await _post(server.port, _update(n)) for n in (1, 2, 3)]
+        await server.join()
+        await server.stop()
+        return statuses, handled, server.stats()
+
+    statuses, handled, stats = _run(scenario())
+    assert statuses == [200, 200, 200]
+    assert handled == [1, 2, 3]
+    assert stats["received"] == 3 and stats["handled"] == 3
+
+
+def test_wrong_or_missing_secret_is_forbidden():
+    async def scenario():
+        handled = []
+
+        async def handle(payload):
+            handled.append(payload)
+
+        server = await _serving(handle)
+        statuses = [
+            await _post(server.port, _update(1), secret="nope"),
+            await _post(server.port, _update(2), secret=None),
+            await _post(server.port, _update(3), path="/otro"),
+        ]
+        await server.stop()
+        return statuses, handled, server.stats()
+
+    statuses, handled, stats = _run(scenario())
+    assert statuses == [403, 403, 404]
+    assert handled == []
+    assert stats["forbidden"] == 2
+
+
+def test_full_queue_answers_503_and_repeats_are_not_queued_twice():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handle(payload):
+            await release.wait()
+
+        server = await _serving(handle, max_queue=1)
+        first = await _post(server.port, _update(1))
+        await asyncio.sleep(0.01)  # consumer takes 1 and blocks on it
+        queued = await _post(server.port, _update(2))
+        repeated = await _post(server.port, _update(2))
+        full = await _post(server.port, _update(3))
+        release.set()
+        await server.stop()
+        return [first, queued, repeated, full], server.stats()
+
+    statuses, stats = _run(scenario())
+    assert statuses == [200, 200, 200, 503]
+    assert stats["repeated"] == 1
+    assert stats["rejected_full"] == 1
+    assert stats["handled"] == 2
+
+
+def test_handler_failure_does_not_stop_the_consumer():
+    async def scenario():
+        handled = []
+
+        async def handle(payload):
+            if payload["update_id"] == 1:
+                raise RuntimeError("boom")
+            handled.append(payload["update_id"])
+
+        server = await _serving(handle)
+        await _post(server.port, _update(1))
+        await _post(server.port, _update(2))
+        await server.join()
+        await server.stop()
+        return handled, server.stats()
+
+    handled, stats = _run(scenario())
+    assert handled == [2]
+    assert stats["failed"] == 1
+
+
+def test_oversized_headers_and_negative_lengths_are_rejected():
+    async def scenario():
+        async def handle(payload):
+            pass
+
+        server = await _serving(handle)
+        many = "".join(f"X-Filler-{i}: x\r\n" for i in range(100))
+        statuses = [
+            await _send_raw(server.port, f"POST /telegram HTTP/1.1\r\n{many}\r\n".encode()),
+            await _send_raw(
+                server.port,
+                f"POST /telegram HTTP/1.1\r\nX-Big: {'x' * 20_000}\r\n\r\n".encode(),
+            ),
+            await _send_raw(
+                server.port, b"POST /telegram HTTP/1.1\r\nContent-Length: -1\r\n\r\n"
+            ),
+        ]
+        await server.stop()
+        return statuses
+
+    assert _run(scenario()) == [431, 431, 400]
+
+
+def test_non_integer_update_ids_are_rejected():
+    async def scenario():
+        handled = []
+
+        async def handle(payload):
+            handled.append(payload)
+
+        server = await _serving(handle)
+        statuses = [
+            await _post(server.port, {"update_id": [1]}),
+            await _post(server.port, {"update_id": {"a": 1}}),
+            await _post(server.port, ["no", "dict"]),
+        ]
+        await server.stop()
+        return statuses, handled
+
+    statuses, handled = _run(scenario())
+    assert statuses == [400, 400, 400]
+    assert handled == []
+
+
+def test_latency_tracker_measures_ingest_to_reply():
+    tracker = LatencyTracker(max_pending=2)
+    for update_id in (1, 2, 3):
+        tracker.ingested(update_id)
+    tracker.replied([1, 3])  # 1 was forgotten: only 2 pending allowed
+
+    assert tracker.stats()["replies"] == 1
@@ -1,9 +1,9 @@
 """Module for Telegram agent tools, including expense and income management via Google Sheets."""
 
 import os
-import time
 import uuid
 from datetime import datetime
+from typing import Annotated
 from zoneinfo import ZoneInfo
 
 ARGENTINA = ZoneInfo("America/Argentina/Buenos_Aires")
@@ -12,13 +12,15 @@ import pandas as pd
 from dotenv import load_dotenv
 from google.oauth2.service_account import Credentials
 from langchain_core.tools import tool
+from langgraph.prebuilt import InjectedState
 
-from config import (
-    ENTRADA_CATEGORIES,
-    ENTRADA_PAYMENT_METHODS,
-    VENTAS_CATEGORIES,
-    VENTAS_PAYMENT_METHODS,
-)
+from dedup import RecentWrites
+from enums import ENUMS_PATH, EnumRegistry, fetch_enums, write_cache
+from fast_path import EXPENSE_KEYWORDS, INCOME_KEYWORDS, PAYMENT_KEYWORDS
+from matcher import Matcher
+from models import ExpenseItem
+from sheets import RequestScheduler, SheetsPool, SheetWriter
+from store import SHEETS, STORE_PATH, TransactionStore
 
 load_dotenv()
 
@@ -26,6 +28,52 @@ load_dotenv()
 # automatizaciones en las mismas hojas).
 KNOWN_USER_IDS = ["16162b8f", "3075a55c"]
 
+# Categorías y métodos de pago válidos, sincronizados desde la validación de
+# la planilla (ver enums.py). Cada proceso relee el archivo cuando cambia, así
+# que una categoría nueva no necesita reiniciar el bot.
+enum_registry = EnumRegistry(
+    os.getenv("ENUMS_CACHE_PATH", ENUMS_PATH),
+    reload_interval=float(os.getenv("ENUMS_RELOAD_SECONDS", "60")),
+)
+
+# Lista del registro que valida cada columna codificada, por tipo de
+# movimiento. Lo que la hoja tenga fuera de estas listas no se agrupa aparte
+# en los reportes: se detalla en data_quality_report.
+ENUM_NAMES = {
+    "expense": {"categoria": "ENTRADA_CATEGORIES", "metodo_pago": "ENTRADA_PAYMENT_METHODS"},
+    "income": {"categoria": "VENTAS_CATEGORIES", "metodo_pago": "VENTAS_PAYMENT_METHODS"},
+}
+
+
+# Palabras que el modelo (o el usuario) puede usar para un valor de cada
+# columna codificada; son las mismas tablas del fast path.
+ALIASES = {
+    "expense": {"categoria": EXPENSE_KEYWORDS, "metodo_pago": PAYMENT_KEYWORDS},
+    "income": {"categoria": INCOME_KEYWORDS, "metodo_pago": PAYMENT_KEYWORDS},
+}
+
+
+def _valid_values(kind: str, column: str) -> list[str]:
+    return enum_registry[ENUM_NAMES[kind][column]]
+
+
+# Matcher de cada columna codificada, por tipo de movimiento: se arman una vez
+# por versión del registro, cuando cambian las listas.
+_matchers: tuple[int, dict[tuple[str, str], Matcher]] | None = None
+
+
+def _matcher(kind: str, column: str) -> Matcher:
+    global _matchers
+    version = enum_registry.version
+    if _matchers is None or _matchers[0] != version:
+        _matchers = version, {
+            (k, c): Matcher(_valid_values(k, c), ALIASES[k][c])
+            for k, columns in ENUM_NAMES.items()
+            for c in columns
+        }
+    return _matchers[1][(kind, column)]
+
+
 MONTH_NAMES_ES = [
     "enero", "febrero", "marzo", "abril", "mayo", "junio",
     "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre",
@@ -33,45 +81,28 @@ MONTH_NAMES_ES = [
 
 # Guardrail anti-duplicados: si el modelo llama a la misma tool con los mismos
 # datos dentro de esta ventana, se ignora la segunda llamada en vez de crear
-# otra fila en la planilla.
+# otra fila en la planilla. Las claves son por chat.
 DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "120"))
-_recent_transactions: dict[tuple[str, float, str], float] = {}
-
-
-def _dedup_key(kind: str, amount: float, description: str) -> tuple[str, float, str]:
-    return (kind, round(float(amount), 2), description.strip().lower())
-
-
-def _is_recent_duplicate(kind: str, amount: float, description: str) -> bool:
-    """True if an identical transaction was already recorded within the dedup window."""
-    now = time.monotonic()
-    for key, recorded_at in list(_recent_transactions.items()):
-        if now - recorded_at > DEDUP_WINDOW_SECONDS:
-            del _recent_transactions[key]
-    return _dedup_key(kind, amount, description) in _recent_transactions
+# Con DEDUP_DB_PATH el guardrail vive en sqlite: sobrevive reinicios y lo
+# comparten todos los procesos. Con varios workers (WORKERS > 1) se usa la
+# base del espejo si no se indica otra.
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH") or (
+    os.getenv("TRANSACTIONS_DB_PATH", STORE_PATH)
+    if int(os.getenv("WORKERS", "1")) > 1
+    else None
+)
+transaction_guard = RecentWrites(DEDUP_WINDOW_SECONDS, path=DEDUP_DB_PATH)
 
 
-def _remember_transaction(kind: str, amount: float, description: str) -> None:
-    _recent_transactions[_dedup_key(kind, amount, description)] = time.monotonic()
+def _dedup_key(chat_id: int | None, kind: str, amount: float, description: str) -> str:
+    return f"{chat_id}|{kind}|{round(float(amount), 2)}|{description.strip().lower()}"
 
 
-def _fuzzy_match(value: str, valid_list: list[str]) -> str | None:
-    """Find the full valid entry that starts with or contains the given value (case-insensitive).
-    Returns the matched full string, or None if no match found."""
-    value_lower = value.strip().lower()
-    # Exact match first
-    for item in valid_list:
-        if item.lower() == value_lower:
-            return item
-    # Prefix match
-    for item in valid_list:
-        if item.lower().startswith(value_lower):
-            return item
-    # Contains match
-    for item in valid_list:
-        if value_lower in item.lower():
-            return item
-    return None
+def _fuzzy_match(value: str, kind: str, column: str) -> str | None:
+    """The full entry of the kind's column list value stands for, or None if
+    there is none: exact, prefix, alias, word start, then trigram-similar
+    (see matcher.Matcher)."""
+    return _matcher(kind, column).match(value)
 
 
 def _validate_transaction_inputs(
@@ -79,9 +110,10 @@ def _validate_transaction_inputs(
     description: str,
     category: str,
     payment_method: str,
-    valid_categories: list[str],
-    valid_payment_methods: list[str],
+    kind: str,
 ) -> tuple[float, str, str, str]:
+    """Checked amount and description, with category and payment method
+    resolved to full entries of the kind's current lists in enum_registry."""
     if amount is None or not isinstance(amount, (int, float)) or not pd.notna(amount):
         raise ValueError("El monto debe ser un número válido y mayor que cero.")
     if amount <= 0:
@@ -91,13 +123,15 @@ def _validate_transaction_inputs(
     if not description:
         raise ValueError("La descripción no puede estar vacía.")
 
-    matched_category = _fuzzy_match(category, valid_categories)
+    valid_categories = _valid_values(kind, "categoria")
+    valid_payment_methods = _valid_values(kind, "metodo_pago")
+    matched_category = _fuzzy_match(category, kind, "categoria")
     if not matched_category:
         raise ValueError(
             f"Categoría '{category}' no válida. Usa: {', '.join(valid_categories)}"
         )
 
-    matched_payment = _fuzzy_match(payment_method, valid_payment_methods)
+    matched_payment = _fuzzy_match(payment_method, kind, "metodo_pago")
     if not matched_payment:
         raise ValueError(
             f"Método '{payment_method}' no válido. Usa: {', '.join(valid_payment_methods)}"
@@ -114,7 +148,10 @@ def _get_required_env(name: str) -> str:
 
 
 def get_gspread_client():
-    """Initialize and return a gspread client"""
+    """Authorize a new gspread client from the service-account file.
+
+    Tools don't call this per request: sheets_pool calls it once and reuses the
+    client (and its HTTP session) for the rest of the process."""
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
@@ -124,17 +161,166 @@ def get_gspread_client():
     return gspread.authorize(creds)
 
 
+# Todo pedido a la API de Sheets pasa por acá: se espacia según las cuotas por
+# minuto de la cuenta de servicio y se reintenta ante un 429 (las lecturas,
+# también ante errores transitorios).
+sheets_scheduler = RequestScheduler(
+    reads_per_minute=int(os.getenv("SHEETS_READS_PER_MINUTE", "60")),
+    writes_per_minute=int(os.getenv("SHEETS_WRITES_PER_MINUTE", "60")),
+    max_in_flight=int(os.getenv("SHEETS_MAX_IN_FLIGHT", "4")),
+    max_retries=int(os.getenv("SHEETS_MAX_RETRIES", "5")),
+)
+
+# La lambda busca get_gspread_client al llamarse, así que reemplazar el
+# atributo del módulo (los tests lo hacen) cambia con qué se conecta el pool.
+sheets_pool = SheetsPool(
+    connect=lambda: get_gspread_client(),
+    refresh_margin=float(os.getenv("SHEETS_TOKEN_REFRESH_MARGIN_SECONDS", "300")),
+    scheduler=sheets_scheduler,
+)
+
+
+def _spreadsheet():
+    """Cached handle for the configured spreadsheet."""
+    return sheets_pool.spreadsheet(_get_required_env("GOOGLE_SHEET_ID"))
+
+
+def _worksheet(name: str):
+    """Cached handle for one tab of the configured spreadsheet."""
+    return sheets_pool.worksheet(_get_required_env("GOOGLE_SHEET_ID"), name)
+
+
+# Las filas agregadas con menos de SHEETS_WRITE_WINDOW_MS de diferencia van a
+# la planilla en un solo append_rows. Mientras esperan quedan registradas en
+# SHEETS_JOURNAL_PATH hasta que la hoja las tenga (ver sheets.SheetWriter).
+sheet_writer = SheetWriter(
+    lambda name: _worksheet(name),
+    os.getenv("SHEETS_JOURNAL_PATH", "sheet_journal.db"),
+    window=float(os.getenv("SHEETS_WRITE_WINDOW_MS", "50")) / 1000,
+    max_rows=int(os.getenv("SHEETS_WRITE_MAX_ROWS", "100")),
+)
+
+
+# Espejo local de las dos hojas, del que leen los reportes (ver store.py).
+transaction_store = TransactionStore(
+    os.getenv("TRANSACTIONS_DB_PATH", STORE_PATH),
+    max_staleness=float(os.getenv("TRANSACTIONS_MAX_STALENESS_SECONDS", "60")),
+    full_resync_interval=float(os.getenv("TRANSACTIONS_FULL_RESYNC_SECONDS", "3600")),
+)
+
+
+def _write_through(kind: str, record: dict, updated_range: str | None) -> None:
+    """Mirror a row that was just appended to the sheet.
+
+    The sheet write already succeeded at this point, so a local failure is only
+    logged: the next read resyncs the mirror from the sheet anyway."""
+    try:
+        transaction_store.record(kind, record, updated_range)
+    except Exception as e:
+        print(f"[Store] Write-through failed, the next read will resync: {e}")
+
+
+def _refresh_mirror(kinds=tuple(SHEETS), force_full: bool = False) -> list:
+    """Catch the local mirror of the given sheets up with the spreadsheet
+    where it is stale, reading all of them in the same batch requests.
+
+    Returns (and logs) the running-total drift a full resync found."""
+    drift = transaction_store.refresh_all(
+        lambda: _spreadsheet(), kinds, force_full=force_full
+    )
+    _log_drift(drift)
+    return drift
+
+
+def _log_drift(drift) -> None:
+    for d in drift:
+        print(
+            f"[Balance] Drift in {d.kind} {d.month:02d}/{d.year} for {d.usuario_id or '-'}: "
+            f"running ${d.running:,.2f} vs sheet ${d.actual:,.2f}"
+        )
+
+
+def replay_sheet_journal() -> int:
+    """Append rows a crash left in the write journal; run once at startup."""
+    replayed = sheet_writer.replay()
+    if replayed:
+        print(f"[Sheets] Replayed {replayed} journaled rows")
+        _refresh_mirror(force_full=True)
+    return replayed
+
+
+def resync_transactions() -> None:
+    """Reload both sheets into the local mirror, picking up edits made by hand."""
+    _refresh_mirror(force_full=True)
+
+
+def reconcile_balances() -> list:
+    """Recompute the running monthly totals from a full reload of both sheets.
+
+    Meant to run on a schedule. Returns (and logs) every total that had drifted;
+    the totals are corrected either way."""
+    drift = _refresh_mirror(force_full=True)
+    if not drift:
+        print("[Balance] Running totals match the sheets")
+    return drift
+
+
+def sync_enums() -> tuple[int, dict]:
+    """Pull the valid lists from the sheet's validation rules into the cache
+    file and load them. Returns the cache version and the lists."""
+    enums = fetch_enums(_spreadsheet())
+    version = write_cache(enum_registry.path, enums)
+    enum_registry.reload()
+    return version, enums
+
+
+def _expense_record(amount: float, description: str, category: str, payment_method: str) -> dict:
+    """An EntradaMaterial row, in column order."""
+    now = datetime.now(ARGENTINA)
+    return {
+        "EntradaMaterialID": uuid.uuid4().hex[:8],
+        "EntradaMaterialFecha": now.strftime("%d/%m/%Y"),
+        "EntradaMaterialHora": now.strftime("%d/%m/%Y %H:%M:%S"),
+        "UsuarioID": "16162b8f",
+        "EntradaMaterialStatus": "TRUE",
+        "Monto": abs(amount),
+        "Categoria": category,
+        "Notas": description,
+        "MetodoPago": payment_method,
+    }
+
+
+def _income_record(amount: float, description: str, category: str, payment_method: str) -> dict:
+    """A Ventas row, in column order."""
+    now = datetime.now(ARGENTINA)
+    return {
+        "VentaID": uuid.uuid4().hex[:8],
+        "VentaFecha": now.strftime("%d/%m/%Y"),
+        "VentaHora": now.strftime("%d/%m/%Y %H:%M:%S"),
+        "UsuarioID": "16162b8f",
+        "VentaMetodoPago": payment_method,
+        "VentaStatus": "TRUE",
+        "VentaNotas": description,
+        "Monto": abs(amount),
+        "Categoria": category,
+    }
+
+
 @tool
 def add_expense(
-    amount: float, description: str, category: str, payment_method: str = "Efectivo"
+    amount: float,
+    description: str,
+    category: str,
+    payment_method: str = "Efectivo",
+    chat_id: Annotated[int | None, InjectedState("chat_id")] = None,
 ) -> str:
     """Add an expense to EntradaMaterial sheet.
 
     Args:
         amount: The amount spent (positive number)
         description: What the expense was for
-        category: Category from your sheet (e.g., Alimentación, Transporte, Vivienda, etc.)
-        payment_method: Payment method from your sheet (e.g., Efectivo, Tarjeta de crédito, Transferencia, etc.)
+        category: One of these categories: {expense_categories}
+        payment_method: One of these payment methods: {expense_payment_methods}
 
     Returns:
         Confirmation message
@@ -145,36 +331,23 @@ def add_expense(
         description,
         category,
         payment_method,
-        ENTRADA_CATEGORIES,
-        ENTRADA_PAYMENT_METHODS,
+        "expense",
     )
 
-    if _is_recent_duplicate("expense", amount, description):
+    dedup_key = _dedup_key(chat_id, "expense", amount, description)
+    if not transaction_guard.claim(dedup_key):
         return (
             f"Ese gasto de ${amount:g} en {description} ya fue registrado hace un momento. "
             "No lo registré de nuevo para evitar duplicados. La operación ya está guardada."
         )
 
+    appended = False
     try:
-        client = get_gspread_client()
-        spreadsheet = client.open_by_key(_get_required_env("GOOGLE_SHEET_ID"))
-        worksheet = spreadsheet.worksheet("EntradaMaterial")
-
-        now = datetime.now(ARGENTINA)
-        row = [
-            uuid.uuid4().hex[:8],
-            now.strftime("%d/%m/%Y"),
-            now.strftime("%d/%m/%Y %H:%M:%S"),
-            "16162b8f",
-            "TRUE",
-            abs(amount),
-            category,
-            description,
-            payment_method,
-        ]
-        worksheet.append_row(row, value_input_option="USER_ENTERED")
-        _remember_transaction("expense", amount, description)
-        report = generate_monthly_report.invoke({})
+        record = _expense_record(amount, description, category, payment_method)
+        (updated_range,) = sheet_writer.append("EntradaMaterial", [list(record.values())])
+        appended = True
+        _write_through("expense", record, updated_range)
+        report = _balance_after_write()
         if report.startswith("Error generando reporte:"):
             return (
                 f"Gasto de ${amount:g} en {description} registrado (categoría: {category}, pago: {payment_method}).\n\n"
@@ -185,20 +358,27 @@ def add_expense(
             f"{report}"
         )
     except Exception as e:
+        if not appended:
+            transaction_guard.release(dedup_key)
+        sheets_pool.invalidate()
         raise RuntimeError(f"No se pudo registrar el gasto: {str(e)}") from e
 
 
 @tool
 def add_income(
-    amount: float, description: str, category: str, payment_method: str = "Efectivo"
+    amount: float,
+    description: str,
+    category: str,
+    payment_method: str = "Efectivo",
+    chat_id: Annotated[int | None, InjectedState("chat_id")] = None,
 ) -> str:
     """Add income to Ventas sheet.
 
     Args:
         amount: The amount received (positive number)
         description: What the income was for
-        category: Category from your sheet (e.g., Salario, Freelance, Emprendimiento, etc.)
-        payment_method: Payment method from your sheet (e.g., Efectivo, Tarjeta de débito, Transferencia, etc.)
+        category: One of these categories: {income_categories}
+        payment_method: One of these payment methods: {income_payment_methods}
 
     Returns:
         Confirmation message
@@ -209,36 +389,23 @@ def add_income(
         description,
         category,
         payment_method,
-        VENTAS_CATEGORIES,
-        VENTAS_PAYMENT_METHODS,
+        "income",
     )
 
-    if _is_recent_duplicate("income", amount, description):
+    dedup_key = _dedup_key(chat_id, "income", amount, description)
+    if not transaction_guard.claim(dedup_key):
         return (
             f"Ese ingreso de ${amount:g} por {description} ya fue registrado hace un momento. "
             "No lo registré de nuevo para evitar duplicados. La operación ya está guardada."
         )
 
+    appended = False
     try:
-        client = get_gspread_client()
-        spreadsheet = client.open_by_key(_get_required_env("GOOGLE_SHEET_ID"))
-        worksheet = spreadsheet.worksheet("Ventas")
-
-        now = datetime.now(ARGENTINA)
-        row = [
-            uuid.uuid4().hex[:8],
-            now.strftime("%d/%m/%Y"),
-            now.strftime("%d/%m/%Y %H:%M:%S"),
-            "16162b8f",
-            payment_method,
-            "TRUE",
-            description,
-            abs(amount),
-            category,
-        ]
-        worksheet.append_row(row, value_input_option="USER_ENTERED")
-        _remember_transaction("income", amount, description)
-        report = generate_monthly_report.invoke({})
+        record = _income_record(amount, description, category, payment_method)
+        (updated_range,) = sheet_writer.append("Ventas", [list(record.values())])
+        appended = True
+        _write_through("income", record, updated_range)
+        report = _balance_after_write()
         if report.startswith("Error generando reporte:"):
             return (
                 f"Ingreso de ${amount:g} por {description} registrado (categoría: {category}, pago: {payment_method}).\n\n"
@@ -249,9 +416,79 @@ def add_income(
             f"{report}"
         )
     except Exception as e:
+        if not appended:
+            transaction_guard.release(dedup_key)
+        sheets_pool.invalidate()
         raise RuntimeError(f"No se pudo registrar el ingreso: {str(e)}") from e
 
 
+@tool
+def add_expenses(
+    expenses: list[ExpenseItem],
+    chat_id: Annotated[int | None, InjectedState("chat_id")] = None,
+) -> str:
+    """Add several expenses to EntradaMaterial sheet in one go.
+
+    Use this instead of calling add_expense repeatedly when the user lists more
+    than one expense in a message.
+
+    Args:
+        expenses: The expenses, each with amount, description, category and payment_method.
+            Categories: {expense_categories}. Payment methods: {expense_payment_methods}
+
+    Returns:
+        One confirmation line per expense, then the monthly balance
+    """
+    if not expenses:
+        raise ValueError("No hay gastos para registrar.")
+    # Validate everything first: either the whole list is recorded or none of it.
+    validated = [
+        _validate_transaction_inputs(
+            item.amount,
+            item.description,
+            item.category,
+            item.payment_method,
+            "expense",
+        )
+        for item in (e if isinstance(e, ExpenseItem) else ExpenseItem(**e) for e in expenses)
+    ]
+
+    lines = []
+    claimed = []
+    for amount, description, category, payment_method in validated:
+        dedup_key = _dedup_key(chat_id, "expense", amount, description)
+        if not transaction_guard.claim(dedup_key):
+            lines.append(
+                f"Ese gasto de ${amount:g} en {description} ya fue registrado hace un momento, "
+                "no lo registré de nuevo."
+            )
+            continue
+        claimed.append(
+            (dedup_key, _expense_record(amount, description, category, payment_method))
+        )
+        lines.append(
+            f"Gasto de ${amount:g} en {description} registrado (categoría: {category}, pago: {payment_method})."
+        )
+    if not claimed:
+        return "\n".join(lines)
+
+    try:
+        ranges = sheet_writer.append(
+            "EntradaMaterial", [list(record.values()) for _, record in claimed]
+        )
+    except Exception as e:
+        for dedup_key, _ in claimed:
+            transaction_guard.release(dedup_key)
+        sheets_pool.invalidate()
+        raise RuntimeError(f"No se pudieron registrar los gastos: {str(e)}") from e
+    for (_, record), updated_range in zip(claimed, ranges):
+        _write_through("expense", record, updated_range)
+    report = _balance_after_write()
+    if report.startswith("Error generando reporte:"):
+        report = f"Aviso: no se pudo generar el reporte mensual. {report}"
+    return "\n".join(lines) + f"\n\n{report}"
+
+
 # ── reporting helpers ───────────────────────────────────────────────
 
 
@@ -274,41 +511,35 @@ def _short_category(category: str) -> str:
     return str(category).split(" (")[0]
 
 
-def _load_transactions(
-    spreadsheet, worksheet_name: str, date_column: str, extra_columns: tuple = ()
-) -> pd.DataFrame:
-    """Read a worksheet into a DataFrame ready for reporting: Monto as numbers,
-    dates parsed, and only the rows that belong to the known users."""
-    df = pd.DataFrame(spreadsheet.worksheet(worksheet_name).get_all_records())
-    if df.empty:
-        return df
+# Todos los meses, para aggregate.
+_ALL_MONTHS = ((1, 1), (9999, 12))
 
-    required = {"Monto", date_column, "UsuarioID", *extra_columns}
-    missing = required - set(df.columns)
-    if missing:
-        raise ValueError(
-            f"Faltan columnas en la hoja {worksheet_name}: {', '.join(sorted(missing))}"
-        )
 
-    df["Monto"] = pd.to_numeric(df["Monto"], errors="coerce")
-    df[date_column] = pd.to_datetime(
-        df[date_column], format="%d/%m/%Y", errors="coerce"
+def _balance_report(month: int, year: int) -> str:
+    """Balance text for one month, read from the mirror's running totals."""
+    total_income = transaction_store.month_total("income", year, month, KNOWN_USER_IDS)
+    total_expenses = transaction_store.month_total("expense", year, month, KNOWN_USER_IDS)
+    balance = total_income - total_expenses
+    return (
+        f"Balance de {_month_label(month, year)}:\n"
+        f"Ingresos: ${total_income:,.2f} | Gastos: ${total_expenses:,.2f}\n"
+        f"Total disponible: ${balance:,.2f}"
     )
-    return df[df["UsuarioID"].isin(KNOWN_USER_IDS)]
 
 
-def _month_rows(df: pd.DataFrame, date_column: str, month: int, year: int) -> pd.DataFrame:
-    """Rows of df that fall inside the given month."""
-    if df.empty:
-        return df
-    dates = df[date_column]
-    return df[(dates.dt.year == year) & (dates.dt.month == month)]
+def _balance_after_write() -> str:
+    """Current month's balance for the add_expense/add_income confirmation.
 
-
-def _month_total(df: pd.DataFrame, date_column: str, month: int, year: int) -> float:
-    """Sum of Monto for the given month; 0.0 when there are no rows."""
-    rows = _month_rows(df, date_column, month, year)
-    return 0.0 if rows.empty else float(rows["Monto"].sum())
+    The row just written is already in the running totals, so this reads no
+    sheet unless the mirror has never synced."""
+    try:
+        never_synced = [kind for kind in SHEETS if not transaction_store.has_synced(kind)]
+        if never_synced:
+            _refresh_mirror(never_synced)
+        month, year = _resolve_month(None, None)
+        return _balance_report(month, year)
+    except Exception as e:
+        return f"Error generando reporte: {str(e)}"
 
 
 @tool
@@ -324,21 +555,8 @@ def generate_monthly_report(month: int | None = None, year: int | None = None) -
     """
     try:
         month, year = _resolve_month(month, year)
-        client = get_gspread_client()
-        spreadsheet = client.open_by_key(_get_required_env("GOOGLE_SHEET_ID"))
-
-        ventas = _load_transactions(spreadsheet, "Ventas", "VentaFecha")
-        gastos = _load_transactions(spreadsheet, "EntradaMaterial", "EntradaMaterialFecha")
-
-        total_income = _month_total(ventas, "VentaFecha", month, year)
-        total_expenses = _month_total(gastos, "EntradaMaterialFecha", month, year)
-        balance = total_income - total_expenses
-
-        return (
-            f"Balance de {_month_label(month, year)}:\n"
-            f"Ingresos: ${total_income:,.2f} | Gastos: ${total_expenses:,.2f}\n"
-            f"Total disponible: ${balance:,.2f}"
-        )
+        _refresh_mirror()
+        return _balance_report(month, year)
     except Exception as e:
         return f"Error generando reporte: {str(e)}"
 
@@ -356,81 +574,265 @@ def spending_by_category(month: int | None = None, year: int | None = None) -> s
     """
     try:
         month, year = _resolve_month(month, year)
-        client = get_gspread_client()
-        spreadsheet = client.open_by_key(_get_required_env("GOOGLE_SHEET_ID"))
-
-        gastos = _load_transactions(
-            spreadsheet, "EntradaMaterial", "EntradaMaterialFecha",
-            extra_columns=("Categoria",),
+        _refresh_mirror(("expense",))
+        totals = transaction_store.aggregate(
+            "expense", KNOWN_USER_IDS, (year, month), (year, month), by=("categoria",)
         )
-        month_expenses = _month_rows(gastos, "EntradaMaterialFecha", month, year)
-        if month_expenses.empty:
+        if not totals:
             return f"No hay gastos registrados en {_month_label(month, year)}."
 
-        totals = (
-            month_expenses.groupby("Categoria")["Monto"].sum().sort_values(ascending=False)
-        )
-        grand_total = totals.sum()
+        valid = set(_valid_values("expense", "categoria"))
+        groups = [
+            (_short_category(category), amount)
+            for category, amount, _count in totals
+            if category in valid
+        ]
+        unlisted = [amount for category, amount, _ in totals if category not in valid]
+        if unlisted:
+            groups.append(("Fuera de la lista", sum(unlisted)))
+        groups.sort(key=lambda g: g[1], reverse=True)
+        grand_total = sum(amount for _, amount, _ in totals)
 
         lines = [f"Gastos por categoría en {_month_label(month, year)}:"]
-        for category, amount in totals.items():
-            share = amount / grand_total * 100
-            lines.append(f"- {_short_category(category)}: ${amount:,.2f} ({share:.0f}%)")
+        for label, amount in groups:
+            share = amount / grand_total * 100 if grand_total else 0
+            lines.append(f"- {label}: ${amount:,.2f} ({share:.0f}%)")
         lines.append(f"Total: ${grand_total:,.2f}")
+        if unlisted:
+            lines.append("(Hay gastos con categorías que no están en la lista; "
+                         "el reporte de calidad de datos los detalla.)")
         return "\n".join(lines)
     except Exception as e:
         return f"Error generando desglose: {str(e)}"
 
 
+def _months_back(months: int, month: int, year: int) -> tuple[int, int]:
+    """The month that starts a window of the given length ending at (year, month)."""
+    index = year * 12 + month - 1 - (months - 1)
+    return index // 12, index % 12 + 1
+
+
 @tool
-def list_recent_transactions(limit: int = 10) -> str:
-    """List the most recent transactions, expenses and incomes combined.
+def monthly_trend(months: int = 6) -> str:
+    """Income, expenses and balance month by month over the last few months,
+    the current one included ("últimos 6 meses", "cómo vengo este semestre").
 
     Args:
-        limit: How many transactions to show, most recent first (default 10).
+        months: How many months to show, 1-36 (default 6).
 
     Returns:
-        A string with one line per transaction.
+        A string with one line per month and the totals of the period.
     """
     try:
-        if limit <= 0:
-            raise ValueError("La cantidad debe ser mayor que cero.")
+        if not 1 <= months <= 36:
+            raise ValueError("La cantidad de meses debe estar entre 1 y 36.")
+        month, year = _resolve_month(None, None)
+        first, last = _months_back(months, month, year), (year, month)
+        _refresh_mirror()
+        per_month = {}
+        for kind in ("income", "expense"):
+            for y, m, total, _count in transaction_store.aggregate(
+                kind, KNOWN_USER_IDS, first, last, by=("year", "month")
+            ):
+                per_month.setdefault((y, m), {})[kind] = total
+
+        lines = [f"Últimos {months} meses:"]
+        total_income = total_expenses = 0.0
+        y, m = first
+        for _ in range(months):
+            income = per_month.get((y, m), {}).get("income", 0.0)
+            expenses = per_month.get((y, m), {}).get("expense", 0.0)
+            total_income += income
+            total_expenses += expenses
+            lines.append(
+                f"- {_month_label(m, y)}: ingresos ${income:,.2f} | gastos ${expenses:,.2f} | "
+                f"balance ${income - expenses:,.2f}"
+            )
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        lines.append(
+            f"Total: ingresos ${total_income:,.2f} | gastos ${total_expenses:,.2f} | "
+            f"balance ${total_income - total_expenses:,.2f}"
+        )
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error generando reporte: {str(e)}"
 
-        client = get_gspread_client()
-        spreadsheet = client.open_by_key(_get_required_env("GOOGLE_SHEET_ID"))
 
-        gastos = _load_transactions(
-            spreadsheet, "EntradaMaterial", "EntradaMaterialFecha",
-            extra_columns=("Notas", "Categoria"),
-        )
-        ventas = _load_transactions(
-            spreadsheet, "Ventas", "VentaFecha",
-            extra_columns=("VentaNotas", "Categoria"),
-        )
+def _change(current: float, previous: float) -> str:
+    if not previous:
+        return "sin datos del año anterior" if current else "sin cambios"
+    return f"{(current - previous) / previous * 100:+.0f}%"
 
-        entries = []
-        for _, row in gastos.iterrows():
-            entries.append(
-                (row["EntradaMaterialFecha"], "Gasto", row["Monto"], row["Notas"], row["Categoria"])
-            )
-        for _, row in ventas.iterrows():
-            entries.append(
-                (row["VentaFecha"], "Ingreso", row["Monto"], row["VentaNotas"], row["Categoria"])
+
+@tool
+def compare_years(year: int | None = None) -> str:
+    """Compare a year's income, expenses and balance with the year before
+    ("este año vs el anterior"). For the current year both years are cut at
+    the current month, so the comparison is like for like.
+
+    Args:
+        year: Four-digit year to compare with the previous one. Defaults to the current year.
+
+    Returns:
+        A string with the totals of both years and the change in percent.
+    """
+    try:
+        current_month, current_year = _resolve_month(None, None)
+        year = year if year is not None else current_year
+        last_month = current_month if year == current_year else 12
+        _refresh_mirror()
+
+        def totals(y):
+            return {
+                kind: sum(
+                    total for total, _ in transaction_store.aggregate(
+                        kind, KNOWN_USER_IDS, (y, 1), (y, last_month)
+                    )
+                )
+                for kind in ("income", "expense")
+            }
+
+        now, before = totals(year), totals(year - 1)
+        span = "" if last_month == 12 else f" (enero a {MONTH_NAMES_ES[last_month - 1]})"
+        lines = [f"{year} vs {year - 1}{span}:"]
+        for kind, label in (("income", "Ingresos"), ("expense", "Gastos")):
+            lines.append(
+                f"{label}: ${now[kind]:,.2f} vs ${before[kind]:,.2f} "
+                f"({_change(now[kind], before[kind])})"
             )
+        balance_now = now["income"] - now["expense"]
+        balance_before = before["income"] - before["expense"]
+        lines.append(f"Balance: ${balance_now:,.2f} vs ${balance_before:,.2f}")
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error generando reporte: {str(e)}"
 
-        entries = [e for e in entries if pd.notna(e[0])]
-        if not entries:
-            return "No hay movimientos registrados todavía."
 
-        entries.sort(key=lambda e: e[0], reverse=True)
-        shown = entries[:limit]
+@tool
+def list_recent_transactions(limit: int = 10, offset: int = 0) -> str:
+    """List the most recent transactions, expenses and incomes combined.
 
-        lines = [f"Últimos {len(shown)} movimientos:"]
-        for when, kind, amount, note, category in shown:
+    Args:
+        limit: How many transactions to show, most recent first (default 10).
+        offset: How many of the most recent to skip, for paging back: after
+            showing 10, offset=10 gives the 10 before those ("los 10 anteriores").
+
+    Returns:
+        A string with one line per transaction.
+    """
+    try:
+        if limit <= 0:
+            raise ValueError("La cantidad debe ser mayor que cero.")
+        if offset < 0:
+            raise ValueError("El desplazamiento no puede ser negativo.")
+
+        kinds = ("expense", "income")
+        _refresh_mirror(kinds)
+        # only the newest months that cover the page, read from their partitions
+        movements = transaction_store.latest(kinds, KNOWN_USER_IDS, offset + limit)
+        if movements.empty:
+            return "No hay movimientos registrados todavía."
+
+        # top-k by date: a partial selection, no full sort of those months
+        shown = movements.nlargest(offset + limit, "Fecha", keep="first").iloc[offset:]
+        if shown.empty:
+            return f"No hay movimientos anteriores a los últimos {offset}."
+
+        if offset == 0:
+            lines = [f"Últimos {len(shown)} movimientos:"]
+        else:
+            lines = [f"Movimientos {offset + 1} a {offset + len(shown)}, del más reciente:"]
+        for when, kind, amount, note, category in zip(
+            shown["Fecha"].dt.strftime("%d/%m/%Y"),
+            shown["kind"].map({"expense": "Gasto", "income": "Ingreso"}),
+            shown["Monto"],
+            shown["Notas"],
+            shown["Categoria"],
+        ):
             lines.append(
-                f"- {when.strftime('%d/%m/%Y')} | {kind} | ${amount:,.2f} | "
-                f"{note} ({_short_category(category)})"
+                f"- {when} | {kind} | ${amount:,.2f} | {note} ({_short_category(category)})"
             )
+        total = sum(
+            count
+            for kind in kinds
+            for _total, count in transaction_store.aggregate(kind, KNOWN_USER_IDS, *_ALL_MONTHS)
+        )
+        remaining = total - offset - len(shown)
+        if remaining > 0:
+            lines.append(f"(quedan {remaining} más antiguos; siguientes: offset={offset + len(shown)})")
         return "\n".join(lines)
     except Exception as e:
         return f"Error listando movimientos: {str(e)}"
+
+
+_COLUMN_LABELS = {"categoria": "Categoría", "metodo_pago": "Método de pago"}
+
+
+def _quality_issues(kind: str) -> list[str]:
+    """One line per value of the kind's rows outside its enum_registry lists,
+    plus the rows without a valid date or amount. Read from the running totals."""
+    lines = []
+    for column in ENUM_NAMES[kind]:
+        allowed = set(_valid_values(kind, column))
+        for value, total, count in transaction_store.aggregate(
+            kind, KNOWN_USER_IDS, *_ALL_MONTHS, by=(column,)
+        ):
+            if value not in allowed:
+                lines.append(
+                    f"- {_COLUMN_LABELS[column]} fuera de la lista: \"{value or '(vacía)'}\" "
+                    f"({count} {'fila' if count == 1 else 'filas'}, ${total:,.2f})"
+                )
+    incomplete = transaction_store.incomplete_rows(kind, KNOWN_USER_IDS)
+    if incomplete:
+        lines.append(
+            f"- {incomplete} {'fila' if incomplete == 1 else 'filas'} sin fecha o monto válidos"
+        )
+    return lines
+
+
+@tool
+def data_quality_report() -> str:
+    """Check the spreadsheet's data: categories and payment methods that aren't
+    in the valid lists, and rows without a valid date or amount. Reports leave
+    those out or group them as "Fuera de la lista".
+
+    Returns:
+        A string listing each problem with its row count and amount, per sheet.
+    """
+    try:
+        _refresh_mirror()
+        lines = []
+        for kind in ("expense", "income"):
+            issues = _quality_issues(kind)
+            if issues:
+                lines += [f"{SHEETS[kind].worksheet}:", *issues]
+        if not lines:
+            return "Los datos de la planilla están en orden: no hay valores fuera de las listas."
+        return "\n".join(["Problemas de datos en la planilla:", *lines])
+    except Exception as e:
+        return f"Error revisando los datos: {str(e)}"
+
+
+# Descripciones de las tools que registran, tal como están escritas, con
+# marcadores para las listas válidas.
+_DESCRIPTION_TEMPLATES = {t.name: t.description for t in (add_expense, add_income, add_expenses)}
+
+
+def describe_tools() -> int:
+    """Fill enum_registry's current lists into what the model sees of the
+    tools that record transactions. Returns the registry version used."""
+    version = enum_registry.version
+    lists = {
+        f"{kind}_{key}": ", ".join(
+            _short_category(v) if column == "categoria" else v
+            for v in _valid_values(kind, column)
+        )
+        for kind in ENUM_NAMES
+        for column, key in (("categoria", "categories"), ("metodo_pago", "payment_methods"))
+    }
+    for t in (add_expense, add_income, add_expenses):
+        t.description = _DESCRIPTION_TEMPLATES[t.name].format(**lists)
+    return version
+
+
+describe_tools()
@@ -0,0 +1,246 @@
+"""Receive Telegram updates over a webhook instead of long polling.
+
+A small HTTP/1.1 server on asyncio streams: Telegram POSTs each update as
+JSON, the server checks the secret token, puts the payload on a bounded queue
+and answers 200 at once. A consumer task hands queued payloads to
+``handle_update``, so a slow turn never holds up Telegram's request.
+"""
+
+import asyncio
+import hmac
+import json
+import time
+from collections import OrderedDict, deque
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+READ_TIMEOUT_SECONDS = 30.0
+# Limits on a request's headers, checked before the secret is.
+MAX_HEADERS = 64
+MAX_HEADER_BYTES = 16 * 1024
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable",
+}
+
+
+class LatencyTracker:
+    """Time from an update arriving to its reply being sent.
+
+    ``ingested`` stamps an update_id, ``replied`` closes it. Updates that never
+    get a reply (duplicates, commands) are forgotten oldest first past
+    ``max_pending``.
+    """
+
+    def __init__(self, max_pending: int = 10_000, samples: int = 1000):
+        self.max_pending = max_pending
+        self._pending: OrderedDict[int, float] = OrderedDict()
+        self._samples: deque[float] = deque(maxlen=samples)
+
+    def ingested(self, update_id: int) -> None:
+        self._pending[update_id] = time.monotonic()
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)
+
+    def replied(self, update_ids) -> None:
+        now = time.monotonic()
+        for update_id in update_ids:
+            started = self._pending.pop(update_id, None)
+            if started is not None:
+                self._samples.append(now - started)
+
+    def stats(self) -> dict:
+        samples = sorted(self._samples)
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000 if samples else 0.0
+
+        return {
+            "replies": len(samples),
+            "reply_ms_p50": percentile(0.50),
+            "reply_ms_p95": percentile(0.95),
+            "reply_ms_max": samples[-1] * 1000 if samples else 0.0,
+        }
+
+
+class WebhookServer:
+    """Accept updates on ``path`` and feed them to ``handle_update(payload)``.
+
+    Requests without the right ``X-Telegram-Bot-Api-Secret-Token`` get 403.
+    When ``max_queue`` updates are already waiting the server answers 503, and
+    Telegram retries the update later. An update_id that is still queued is
+    acknowledged but not queued twice.
+    """
+
+    def __init__(self, handle_update, secret_token: str, path: str = "/telegram",
+                 max_queue: int = 100, max_body: int = 1 << 20,
+                 latency: LatencyTracker | None = None):
+        if not secret_token:
+            raise ValueError("a webhook needs a secret token")
+        self._handle_update = handle_update
+        self._secret = secret_token.encode()
+        self.path = path
+        self.max_body = max_body
+        self.latency = latency or LatencyTracker()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._queued_ids: set[int] = set()
+        self._server = None
+        self._consumer: asyncio.Task | None = None
+        self.port: int | None = None
+        self._counters = {
+            "received": 0,
+            "forbidden": 0,
+            "rejected_full": 0,
+            "repeated": 0,
+            "handled": 0,
+            "failed": 0,
+        }
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8443, ssl=None) -> None:
+        self._server = await asyncio.start_server(self._serve, host, port, ssl=ssl)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self) -> None:
+        """Stop accepting connections, then finish what is already queued."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self._queue.join()
+        if self._consumer is not None:
+            self._consumer.cancel()
+
+    async def join(self) -> None:
+        """Wait until every queued update has been handed over."""
+        await self._queue.join()
+
+    def stats(self) -> dict:
+        return {**self._counters, "queued": self._queue.qsize(), **self.latency.stats()}
+
+    async def _consume(self) -> None:
+        while True:
+            payload = await self._queue.get()
+            try:
+                await self._handle_update(payload)
+                self._counters["handled"] += 1
+            except Exception as e:
+                self._counters["failed"] += 1
+                print(f"[Webhook] Update {payload.get('update_id')} failed: {e}")
+            finally:
+                self._queued_ids.discard(payload.get("update_id"))
+                self._queue.task_done()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:  # Telegram keeps connections alive between updates
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT_SECONDS)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status = self._respond_to(method, target, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except _BadRequest as e:
+            self._write_response(writer, e.status, keep_alive=False)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await self._read_line(reader)
+        if not line:
+            return None
+        try:
+            method, target, _version = line.decode("latin-1").split()
+        except ValueError:
+            raise _BadRequest(400)
+        headers = {}
+        header_bytes = 0
+        while True:
+            line = await self._read_line(reader)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header_bytes += len(line)
+            if len(headers) >= MAX_HEADERS or header_bytes > MAX_HEADER_BYTES:
+                raise _BadRequest(431)
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        if method == "POST":
+            if "content-length" not in headers:
+                raise _BadRequest(411)
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                raise _BadRequest(400)
+            if length < 0:
+                raise _BadRequest(400)
+            if length > self.max_body:
+                raise _BadRequest(413)
+            body = await reader.readexactly(length)
+        return method, target, headers, body
+
+    @staticmethod
+    async def _read_line(reader) -> bytes:
+        try:
+            return await reader.readline()
+        except ValueError:  # longer than the stream's buffer limit
+            raise _BadRequest(431)
+
+    def _respond_to(self, method: str, target: str, headers: dict, body: bytes) -> int:
+        if target.split("?")[0] != self.path:
+            return 404
+        if method == "GET":
+            return 200  # health check
+        if method != "POST":
+            return 405
+        secret = headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(secret, self._secret):
+            self._counters["forbidden"] += 1
+            return 403
+        try:
+            payload = json.loads(body)
+            update_id = payload["update_id"]
+            if not isinstance(update_id, int) or isinstance(update_id, bool):
+                raise TypeError(f"update_id {update_id!r} is not an integer")
+        except (ValueError, KeyError, TypeError):
+            return 400
+        self._counters["received"] += 1
+        if update_id in self._queued_ids:
+            self._counters["repeated"] += 1
+            return 200
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self._counters["rejected_full"] += 1
+            return 503
+        self._queued_ids.add(update_id)
+        self.latency.ingested(update_id)
+        return 200
+
+    @staticmethod
+    def _write_response(writer, status: int, keep_alive: bool) -> None:
+        body = _REASONS[status].encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            f"Content-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+            + body
+        )
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status